@@ -1,18 +1,23 @@
 import logging
 import platform
 import sys
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 import click
 from colorama import Back, Fore, Style
 
 from . import args, errors, shutdown, startup
+from .conversion.protocol import COMPRESSIONS
+from .conversion.render import DPI_PROFILES
 from .document import ARCHIVE_SUBDIR, SAFE_EXTENSION
 from .isolation_provider.container import Container
-from .isolation_provider.dummy import Dummy
+from .isolation_provider.dummy import DUMMY_PATTERNS, Dummy
+from .isolation_provider.images import IMAGE_CODECS
+from .isolation_provider.ocr_cache import clear_ocr_cache
 from .isolation_provider.qubes import Qubes, is_qubes_native_conversion
 from .logic import DangerzoneCore
 from .podman.machine import PodmanMachineManager
+from .scheduling import SCHEDULES
 from .settings import Settings
 from .updater import install
 from .util import get_version, replace_control_chars
@@ -30,6 +35,140 @@ def print_header(s: str) -> None:
     help=f"Default is filename ending with {SAFE_EXTENSION}",
 )
 @click.option("--ocr-lang", help="Language to OCR, defaults to none")
+@click.option(
+    "--ocr-workers",
+    type=click.IntRange(min=1),
+    help="Number of pages to OCR in parallel, defaults to the number of CPU cores",
+)
+@click.option(
+    "--render-workers",
+    type=click.IntRange(min=1),
+    help=(
+        "Number of pages to render in parallel in the sandbox, defaults to the number"
+        " of CPU cores. Not supported on Qubes"
+    ),
+)
+@click.option(
+    "--libreoffice-listener/--no-libreoffice-listener",
+    default=None,
+    help=(
+        "Start LibreOffice along with the sandbox, and convert Office documents with"
+        " it, instead of starting it for every document. Disabled by default. Not"
+        " supported on Qubes"
+    ),
+)
+@click.option(
+    "--session-size",
+    type=click.IntRange(min=1),
+    help=(
+        "Max number of documents to convert in a single sandbox, one after the other."
+        " Larger sessions save the startup time of a sandbox for every document, at"
+        " the cost of converting more documents in the same sandbox. Defaults to 1."
+        " Not supported on Qubes"
+    ),
+)
+@click.option(
+    "--parallel-conversions",
+    type=click.IntRange(min=1),
+    help=(
+        "Max number of documents to convert in parallel, each in its own sandbox."
+        " Defaults to as many as the CPUs and memory of the sandboxes allow."
+        " Not supported on Qubes"
+    ),
+)
+@click.option(
+    "--schedule",
+    type=click.Choice(SCHEDULES),
+    help=(
+        "The order in which to convert the documents: 'fifo' converts them in the"
+        " order they were given, and 'shortest-first' converts the ones with the"
+        " fewest estimated pages first. Defaults to 'shortest-first'"
+    ),
+)
+@click.option(
+    "--pages",
+    help=(
+        "Convert only some of the pages of the documents, e.g., '1-5,10' or '3-'."
+        " Not supported on Qubes"
+    ),
+)
+@click.option(
+    "--preview",
+    flag_value=True,
+    help=(
+        "Convert the documents quickly into low resolution previews, without OCR."
+        " Only the first page is converted, unless --pages is given. Not supported"
+        " on Qubes"
+    ),
+)
+@click.option(
+    "--dpi-profile",
+    type=click.Choice(list(DPI_PROFILES)),
+    help=(
+        "How to choose the DPI of every page, based on its size: 'fast' renders pages"
+        " with fewer pixels, and 'high' with more. Defaults to 'standard', which"
+        " lowers the DPI only for pages larger than A3. Not supported on Qubes"
+    ),
+)
+@click.option(
+    "--pixel-budget",
+    type=click.IntRange(min=1),
+    help=(
+        "Max number of pixels of a page, which overrides the one of the DPI profile."
+        " The DPI of a page never exceeds the bounds of the DPI profile, though."
+        " Not supported on Qubes"
+    ),
+)
+@click.option(
+    "--page-compression",
+    type=click.Choice(list(COMPRESSIONS)),
+    help=(
+        "How the sandbox compresses the pixels of pages, before it sends them to the"
+        " host. Defaults to 'zlib' on Windows and macOS, where the sandbox runs in a"
+        " VM, and to 'none' elsewhere. Not supported on Qubes"
+    ),
+)
+@click.option(
+    "--image-codec",
+    type=click.Choice(IMAGE_CODECS),
+    help=(
+        "How to encode the pages of the safe PDF: 'lossless' keeps the exact pixels,"
+        " 'jpeg' creates much smaller files, and 'auto' uses JPEG only for pages that"
+        " look like photos. Defaults to 'lossless'"
+    ),
+)
+@click.option(
+    "--image-quality",
+    type=click.IntRange(min=1, max=100),
+    help="Quality of JPEG images, from 1 to 100, defaults to 85",
+)
+@click.option(
+    "--blank-page-threshold",
+    type=click.FloatRange(min=0, max=1),
+    help=(
+        "Max ratio of pixels in a page that can differ from its background color, for"
+        " the page to be considered blank. Blank pages are not OCRed, and are replaced"
+        " with a page of their background color. Defaults to 0, i.e., only pages of a"
+        " single color are considered blank"
+    ),
+)
+@click.option(
+    "--ocr-cache/--no-ocr-cache",
+    default=None,
+    help=(
+        "Keep OCRed pages in the 'ocr' subdirectory of the cache directory of"
+        " Dangerzone (e.g., ~/.cache/dangerzone/ocr on Linux), so that identical"
+        " pages are not OCRed twice. The cache holds the OCRed pages of every"
+        " converted document, until they are evicted or removed with"
+        " --clear-ocr-cache. Disabled by default"
+    ),
+)
+@click.option(
+    "--clear-ocr-cache",
+    "clear_cache",
+    flag_value=True,
+    help="Remove every page from the OCR cache",
+)
 @click.option(
     "--archive",
     "archive",
@@ -39,6 +178,13 @@ def print_header(s: str) -> None:
 @click.option(
     "--unsafe-dummy-conversion", "dummy_conversion", flag_value=True, hidden=True
 )
+@click.option(
+    "--unsafe-dummy-pattern",
+    "dummy_pattern",
+    type=click.Choice(DUMMY_PATTERNS),
+    default="solid",
+    hidden=True,
+)
 @click.argument(
     "filenames",
     required=False,
@@ -81,9 +227,26 @@ def cli_main(
     filenames: Optional[List[str]],
     archive: bool,
     dummy_conversion: bool,
+    dummy_pattern: str,
     debug: bool,
     set_container_runtime: Optional[str] = None,
     linger: bool = False,
+    ocr_workers: Optional[int] = None,
+    image_codec: Optional[str] = None,
+    image_quality: Optional[int] = None,
+    blank_page_threshold: Optional[float] = None,
+    ocr_cache: Optional[bool] = None,
+    clear_cache: bool = False,
+    render_workers: Optional[int] = None,
+    libreoffice_listener: Optional[bool] = None,
+    dpi_profile: Optional[str] = None,
+    pixel_budget: Optional[int] = None,
+    page_compression: Optional[str] = None,
+    session_size: Optional[int] = None,
+    parallel_conversions: Optional[int] = None,
+    schedule: Optional[str] = None,
+    pages: Optional[str] = None,
+    preview: bool = False,
 ) -> None:
     setup_logging()
     display_banner()
@@ -100,24 +263,50 @@ def cli_main(
             )
             click.echo(f"Set the settings container_runtime to {container_runtime}")
         sys.exit(0)
-    elif not filenames:
+    if clear_cache:
+        clear_ocr_cache()
+        click.echo("Cleared the OCR cache")
+        if not filenames:
+            sys.exit(0)
+    if not filenames:
         raise click.UsageError("Missing argument 'FILENAMES...'")
 
+    # Options that override the respective settings, only for this run.
+    provider_kwargs: Dict[str, Any] = {
+        "ocr_workers": ocr_workers,
+        "image_codec": image_codec,
+        "image_quality": image_quality,
+        "blank_page_threshold": blank_page_threshold,
+        "ocr_cache": ocr_cache,
+        "render_workers": render_workers,
+        "libreoffice_listener": libreoffice_listener,
+        "dpi_profile": dpi_profile,
+        "pixel_budget": pixel_budget,
+        "page_compression": page_compression,
+        "session_size": session_size,
+        "parallel_conversions": parallel_conversions,
+    }
     if getattr(sys, "dangerzone_dev", False) and dummy_conversion:
-        dangerzone = DangerzoneCore(Dummy())
+        dangerzone = DangerzoneCore(Dummy(pattern=dummy_pattern, **provider_kwargs))
     elif is_qubes_native_conversion():
-        dangerzone = DangerzoneCore(Qubes())
+        if pages or preview:
+            raise click.UsageError("--pages and --preview are not supported on Qubes")
+        dangerzone = DangerzoneCore(Qubes(**provider_kwargs))
     else:
-        dangerzone = DangerzoneCore(Container(debug=debug))
+        dangerzone = DangerzoneCore(Container(debug=debug, **provider_kwargs))
 
     if len(filenames) == 1 and output_filename:
-        dangerzone.add_document_from_filename(filenames[0], output_filename, archive)
+        dangerzone.add_document_from_filename(
+            filenames[0], output_filename, archive, pages=pages, preview=preview
+        )
     elif len(filenames) > 1 and output_filename:
         click.echo("--output-filename can only be used with one input file.")
         sys.exit(1)
     else:
         for filename in filenames:
-            dangerzone.add_document_from_filename(filename, archive=archive)
+            dangerzone.add_document_from_filename(
+                filename, archive=archive, pages=pages, preview=preview
+            )
 
     # Validate OCR language
     if ocr_lang:
@@ -146,7 +335,7 @@ def cli_main(
     try:
         startup.StartupLogic(tasks=tasks).run()
         print_header("Converting document(s) to safe PDF")
-        dangerzone.convert_documents(ocr_lang)
+        dangerzone.convert_documents(ocr_lang, schedule=schedule)
     finally:
         if dangerzone.isolation_provider.requires_install() and not linger:
             task_container_stop = shutdown.ContainerStopTask()
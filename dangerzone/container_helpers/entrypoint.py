@@ -161,14 +161,6 @@ oci_config: dict[str, typing.Any] = {
             "source": "tmpfs",
             "options": ["nosuid", "noexec", "nodev"],
         },
-        # Used for LibreOffice extensions, which are only conditionally
-        # installed depending on which file is being converted.
-        {
-            "destination": "/usr/lib/libreoffice/share/extensions/",
-            "type": "tmpfs",
-            "source": "tmpfs",
-            "options": ["nosuid", "noexec", "nodev"],
-        },
     ],
     "linux": {
         "namespaces": [
@@ -6,6 +6,7 @@ import platform
 import shutil
 import subprocess
 import sys
+from dataclasses import dataclass
 from pathlib import Path, PurePosixPath
 from typing import IO, Callable, Iterable, List, Optional, Tuple, Union
 
@@ -70,6 +71,66 @@ def get_runtime_version() -> Tuple[int, int]:
         raise RuntimeError(msg)
 
 
+@dataclass
+class RuntimeResources:
+    """The CPUs and memory that containers can use."""
+
+    cpus: int
+    # In bytes, or 0 if unknown.
+    memory: int
+    # Whether the container runtime can limit the CPUs and memory of a container.
+    can_limit_cpus: bool = False
+    can_limit_memory: bool = False
+
+
+def parse_runtime_info(info: dict) -> RuntimeResources:
+    """Get the resources of containers, from the output of `podman/docker info`."""
+    if "host" in info:
+        # Podman reports the cgroup controllers that containers can use. Rootless
+        # containers on cgroups v1 cannot use any of them.
+        controllers = info["host"].get("cgroupControllers") or []
+        return RuntimeResources(
+            cpus=int(info["host"]["cpus"]),
+            memory=int(info["host"]["memTotal"]),
+            can_limit_cpus="cpu" in controllers,
+            can_limit_memory="memory" in controllers,
+        )
+    return RuntimeResources(
+        cpus=int(info["NCPU"]),
+        memory=int(info["MemTotal"]),
+        can_limit_cpus=bool(info.get("CpuCfsQuota")),
+        can_limit_memory=bool(info.get("MemoryLimit")),
+    )
+
+
+@functools.cache
+def query_runtime_resources() -> RuntimeResources:
+    """Ask the container runtime for the CPUs and memory that containers can use.
+
+    Only the resources that the container runtime reports are cached. If it fails,
+    e.g., because the Podman machine has not started yet, it's asked again the next
+    time.
+    """
+    podman = init_podman_command()
+    info = podman.run(["info", "--format", "json"])
+    assert isinstance(info, str)
+    return parse_runtime_info(json.loads(info))
+
+
+def get_runtime_resources() -> RuntimeResources:
+    """Get the CPUs and memory that containers can use.
+
+    On Windows and macOS, these are the resources of the Podman machine, not of the
+    host. If the container runtime cannot report them, fall back to the CPUs of the
+    host, and to an unknown amount of memory.
+    """
+    try:
+        return query_runtime_resources()
+    except Exception as e:
+        log.warning(f"Could not get the resources of the container runtime: {e}")
+        return RuntimeResources(cpus=os.cpu_count() or 1, memory=0)
+
+
 def get_podman_path() -> Optional[Path]:
     podman_bin = "podman"
     if platform.system() == "Linux":
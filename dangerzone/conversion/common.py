@@ -1,11 +1,53 @@
 import asyncio
+import concurrent.futures
 import os
 import sys
 from abc import abstractmethod
-from typing import Callable, List, Optional, TextIO, Tuple
+from typing import Callable, List, Optional, Sequence, Set, TextIO, Tuple, Union
 
 DEFAULT_DPI = 150  # Pixels per inch
 INT_BYTES = 2
+# Size of the length that precedes every document in a session.
+DOCUMENT_LENGTH_BYTES = 8
+INPUT_CHUNK_SIZE = 1024 * 1024  # Size of the chunks in which we read the input
+# Max size of the command output that we keep for debugging purposes.
+CAPTURED_OUTPUT_MAX_SIZE = 1024 * 1024
+
+
+def parse_page_ranges(spec: str) -> List[Tuple[int, Optional[int]]]:
+    """Parse a page range specification, such as "1-5,10,20-".
+
+    Return the first and last page of every range, where the last page is None for
+    ranges that extend to the end of the document. Page numbers start from 1.
+
+    :raises ValueError: if the specification is not valid
+    """
+    ranges: List[Tuple[int, Optional[int]]] = []
+    for item in spec.split(","):
+        first, sep, last = item.strip().partition("-")
+        if not first.strip().isdigit() or (last.strip() and not last.strip().isdigit()):
+            raise ValueError(f"Invalid page range: '{item.strip()}'")
+        start = int(first)
+        end = None if sep and not last.strip() else int(last or first)
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"Invalid page range: '{item.strip()}'")
+        ranges.append((start, end))
+    return ranges
+
+
+def select_pages(spec: Optional[str], page_count: int) -> List[int]:
+    """Get the (0-based) numbers of the pages that a specification selects, in order.
+
+    Pages that are not in the document are ignored. Without a specification, select
+    every page.
+    """
+    if not spec:
+        return list(range(page_count))
+    pages: Set[int] = set()
+    for start, end in parse_page_ranges(spec):
+        last = page_count if end is None else min(end, page_count)
+        pages.update(range(start - 1, last))
+    return sorted(pages)
 
 
 def running_on_qubes() -> bool:
@@ -13,11 +55,109 @@ def running_on_qubes() -> bool:
     return os.path.exists("/usr/share/qubes/marker-vm")
 
 
+def encode_ints(nums: Sequence[int]) -> bytes:
+    return b"".join(num.to_bytes(INT_BYTES, "big", signed=False) for num in nums)
+
+
+class FrameWriter:
+    """Write frames to a file, each one as a header of ints followed by a payload.
+
+    Every frame is sent with a single vectored write, straight to the file
+    descriptor, instead of a write per field. The writes happen in a dedicated
+    thread, so that frames are written in the order they were submitted, and the
+    event loop is free to render the next page in the meantime.
+    """
+
+    def __init__(self, file: TextIO = sys.stdout) -> None:
+        self.file = file
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="frame-writer"
+        )
+
+    def _write_frame(
+        self, nums: Sequence[int], payload: Union[bytes, memoryview] = b""
+    ) -> None:
+        self._write(encode_ints(nums), payload)
+
+    def _write(self, header: bytes, payload: Union[bytes, memoryview] = b"") -> None:
+        """Write a frame whose header has already been encoded."""
+        # Anything that was written to the buffered stream must precede the frame.
+        self.file.flush()
+        buffers = [memoryview(header), memoryview(payload)]
+        if not hasattr(os, "writev"):
+            # Windows has no vectored writes, but the Dummy provider runs there.
+            for buf in buffers:
+                self.file.buffer.write(buf)
+            self.file.flush()
+            return
+
+        fd = self.file.fileno()
+        while buffers:
+            written = os.writev(fd, buffers)
+            # Skip the buffers that were written in full, and retry the rest.
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers.pop(0)
+            if buffers:
+                buffers[0] = buffers[0][written:]
+
+    async def write_frame(
+        self, nums: Sequence[int], payload: Union[bytes, memoryview] = b""
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._write_frame, nums, payload)
+
+    async def write(
+        self, header: bytes, payload: Union[bytes, memoryview] = b""
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._write, header, payload)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class OutputRing:
+    """Keep the last bytes of an output, up to a max size.
+
+    The bytes are appended to a single buffer, and the oldest ones are dropped once
+    it exceeds the max size, so that a noisy command takes linear time and bounded
+    memory.
+    """
+
+    def __init__(self, max_size: int = CAPTURED_OUTPUT_MAX_SIZE) -> None:
+        self.max_size = max_size
+        self.buf = bytearray()
+        self.dropped = 0
+
+    def append(self, data: bytes) -> None:
+        self.buf += data
+        excess = len(self.buf) - self.max_size
+        if excess > 0:
+            del self.buf[:excess]
+            self.dropped += excess
+
+    def getvalue(self) -> bytes:
+        if not self.dropped:
+            return bytes(self.buf)
+        return f"[... dropped {self.dropped} bytes ...]\n".encode() + self.buf
+
+
 class DangerzoneConverter:
-    def __init__(self, progress_callback: Optional[Callable] = None) -> None:
+    def __init__(
+        self,
+        progress_callback: Optional[Callable] = None,
+        captured_output_max_size: int = CAPTURED_OUTPUT_MAX_SIZE,
+    ) -> None:
         self.percentage: float = 0.0
         self.progress_callback = progress_callback
-        self.captured_output: bytes = b""
+        self.output = OutputRing(captured_output_max_size)
+        self.frame_writer = FrameWriter()
+
+    @property
+    def captured_output(self) -> bytes:
+        """The output of the commands that we have run, for debugging purposes."""
+        return self.output.getvalue()
 
     @classmethod
     def _read_bytes(cls) -> bytes:
@@ -27,6 +167,44 @@ class DangerzoneConverter:
             raise EOFError
         return data
 
+    @classmethod
+    def _read_to_file(
+        cls, path: str, file: TextIO = sys.stdin, size: Optional[int] = None
+    ) -> None:
+        """Copy the stdin to a file, in chunks, without holding it all in memory.
+
+        If a size is given, copy exactly as many bytes, else copy everything until
+        the end of the stdin.
+        """
+        chunk = memoryview(bytearray(INPUT_CHUNK_SIZE))
+        remaining = size
+        with open(path, "wb") as f:
+            while remaining is None or remaining > 0:
+                buf = (
+                    chunk if remaining is None else chunk[: min(remaining, len(chunk))]
+                )
+                n = file.buffer.readinto(buf)  # type: ignore [attr-defined]
+                if n is None or (not n and remaining is not None):
+                    raise EOFError
+                if not n:
+                    break
+                f.write(buf[:n])
+                if remaining is not None:
+                    remaining -= n
+
+    @classmethod
+    def _read_document_length(cls, file: TextIO = sys.stdin) -> Optional[int]:
+        """Read the size of the next document in a session.
+
+        Return None if the host has closed the stdin, which ends the session.
+        """
+        data = file.buffer.read(DOCUMENT_LENGTH_BYTES)
+        if not data:
+            return None
+        if len(data) != DOCUMENT_LENGTH_BYTES:
+            raise EOFError
+        return int.from_bytes(data, "big", signed=False)
+
     @classmethod
     def _write_bytes(cls, data: bytes, file: TextIO = sys.stdout) -> None:
         file.buffer.write(data)
@@ -50,6 +228,16 @@ class DangerzoneConverter:
     async def read_bytes(cls) -> bytes:
         return await asyncio.to_thread(cls._read_bytes)
 
+    @classmethod
+    async def read_to_file(
+        cls, path: str, file: TextIO = sys.stdin, size: Optional[int] = None
+    ) -> None:
+        return await asyncio.to_thread(cls._read_to_file, path, file=file, size=size)
+
+    @classmethod
+    async def read_document_length(cls, file: TextIO = sys.stdin) -> Optional[int]:
+        return await asyncio.to_thread(cls._read_document_length, file=file)
+
     @classmethod
     async def write_bytes(cls, data: bytes, file: TextIO = sys.stdout) -> None:
         return await asyncio.to_thread(cls._write_bytes, data, file=file)
@@ -63,25 +251,30 @@ class DangerzoneConverter:
         return await asyncio.to_thread(cls._write_int, num, file=file)
 
     async def read_stream(
-        self, sr: asyncio.StreamReader, callback: Optional[Callable] = None
+        self,
+        sr: asyncio.StreamReader,
+        callback: Optional[Callable] = None,
+        discard: bool = False,
     ) -> bytes:
         """Consume a byte stream line-by-line.
 
         Read all lines in a stream until EOF. If a user has passed a callback, call it for
-        each line.
+        each line. If the caller does not need the lines, they can discard them, in
+        which case this method returns an empty byte string.
 
         Note that the lines are in bytes, since we can't assume that all command output will
         be UTF-8 encoded. Higher level commands are advised to decode the output to Unicode,
         if they know its encoding.
         """
-        buf = b""
+        lines = []
         while not sr.at_eof():
             line = await sr.readline()
-            self.captured_output += line
+            self.output.append(line)
             if callback is not None:
                 await callback(line)
-            buf += line
-        return buf
+            if not discard:
+                lines.append(line)
+        return b"".join(lines)
 
     async def run_command(
         self,
@@ -90,11 +283,13 @@ class DangerzoneConverter:
         error_message: str,
         stdout_callback: Optional[Callable] = None,
         stderr_callback: Optional[Callable] = None,
+        discard_stdout: bool = False,
     ) -> Tuple[bytes, bytes]:
         """Run a command and get its output.
 
         Run a command using asyncio.subprocess, consume its standard streams, and return its
-        output in bytes.
+        output in bytes. If the caller does not need the standard output, they can
+        discard it, in which case it's returned empty.
 
         :raises RuntimeError: if the process returns a non-zero exit status
         """
@@ -108,7 +303,7 @@ class DangerzoneConverter:
 
         # Log command to debug log so we can trace back which errors
         # are from each command
-        self.captured_output += f"[COMMAND] {' '.join(args)}\n".encode()
+        self.output.append(f"[COMMAND] {' '.join(args)}\n".encode())
 
         assert proc.stdout is not None
         assert proc.stderr is not None
@@ -116,7 +311,7 @@ class DangerzoneConverter:
         # Create asynchronous tasks that will consume the standard streams of the command,
         # and call callbacks if necessary.
         stdout_task = asyncio.create_task(
-            self.read_stream(proc.stdout, stdout_callback)
+            self.read_stream(proc.stdout, stdout_callback, discard=discard_stdout)
         )
         stderr_task = asyncio.create_task(
             self.read_stream(proc.stderr, stderr_callback)
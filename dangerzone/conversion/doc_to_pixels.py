@@ -1,7 +1,10 @@
 import asyncio
+import contextlib
 import os
+import shutil
 import sys
-from typing import Dict, Optional
+import time
+from typing import Dict, List, Optional
 
 # XXX: PyMUPDF logs to stdout by default [1]. The PyMuPDF devs provide a way [2] to log to
 # stderr, but it's based on environment variables. These envvars are consulted at import
@@ -18,21 +21,73 @@ import fitz
 import magic
 
 from . import errors
-from .common import DEFAULT_DPI, DangerzoneConverter, running_on_qubes
+from .common import DangerzoneConverter, running_on_qubes
+from .events import EventWriter
+from .libreoffice import (
+    LIBREOFFICE_EXT_DIR,
+    LibreOfficeListener,
+    is_listener_file,
+    libreoffice_listener_enabled,
+)
+from .protocol import (
+    PROTOCOL_V1,
+    encode_document_end,
+    encode_page,
+    encode_stream_header,
+    get_protocol,
+    session_enabled,
+)
+from .render import get_dpi_profile, get_pages, get_render_workers, render_pages
 
 
 class DocumentToPixels(DangerzoneConverter):
+    def __init__(
+        self,
+        libreoffice: Optional[LibreOfficeListener] = None,
+        events: Optional[EventWriter] = None,
+    ) -> None:
+        super().__init__()
+        self.libreoffice = libreoffice
+        self.events = events or EventWriter()
+        self.protocol, self.compression = get_protocol()
+        # The number of pages that will be sent, once it's known.
+        self.page_count: Optional[int] = None
+
     async def write_page_count(self, count: int) -> None:
-        return await self.write_int(count)
+        self.page_count = count
+        header = encode_stream_header(self.protocol, count)
+        return await self.frame_writer.write(header)
+
+    async def write_document_end(self, status: int) -> None:
+        """End a document of a session, with its status.
 
-    async def write_page_width(self, width: int) -> None:
-        return await self.write_int(width)
+        If the document failed before its page count was sent, send a page count of
+        zero first, so that the host does not wait for any pages.
+        """
+        header = b""
+        if self.page_count is None:
+            header = encode_stream_header(self.protocol, 0)
+        return await self.frame_writer.write(header + encode_document_end(status))
 
-    async def write_page_height(self, height: int) -> None:
-        return await self.write_int(height)
+    async def write_page(
+        self, number: int, width: int, height: int, dpi: int, data: bytes
+    ) -> None:
+        """Write the header and pixels of a page, with a single write.
 
-    async def write_page_data(self, data: bytes) -> None:
-        return await self.write_bytes(data)
+        In protocol v2, the pixels are packed and compressed first, in a thread, so
+        that the event loop can keep waiting for the next rendered page.
+        """
+        header, payload = await asyncio.to_thread(
+            encode_page,
+            self.protocol,
+            self.compression,
+            number,
+            width,
+            height,
+            dpi,
+            data,
+        )
+        return await self.frame_writer.write(header, payload)
 
     def update_progress(self, text: str, *, error: bool = False) -> None:
         print(text, file=sys.stderr)
@@ -162,7 +217,8 @@ class DocumentToPixels(DangerzoneConverter):
         }
 
         # Detect MIME type
-        mime_type = self.detect_mime_type("/tmp/input_file")
+        with self.events.stage("mime"):
+            mime_type = self.detect_mime_type("/tmp/input_file")
 
         # Validate MIME type
         if mime_type not in conversions:
@@ -171,8 +227,10 @@ class DocumentToPixels(DangerzoneConverter):
         # Convert input document to PDF
         conversion = conversions[mime_type]
         if conversion["type"] == "PyMuPDF":
+            filename = "/tmp/input_file"
+            filetype: Optional[str] = mime_type
             try:
-                doc = fitz.open("/tmp/input_file", filetype=mime_type)
+                doc = fitz.open(filename, filetype=filetype)
             except (ValueError, fitz.FileDataError):
                 raise errors.DocCorruptedException()
         elif conversion["type"] == "libreoffice":
@@ -183,23 +241,21 @@ class DocumentToPixels(DangerzoneConverter):
             #     https://github.com/freedomofpress/dangerzone/issues/498
             if libreoffice_ext == "h2orestart.oxt" and running_on_qubes():
                 raise errors.DocFormatUnsupportedHWPQubes()
-            if libreoffice_ext:
-                await self.install_libreoffice_ext(libreoffice_ext)
-            self.update_progress("Converting to PDF using LibreOffice")
-            args = [
-                "libreoffice",
-                "--headless",
-                "--safe-mode",
-                "--convert-to",
-                "pdf",
-                "--outdir",
-                "/tmp",
-                "/tmp/input_file",
-            ]
-            await self.run_command(
-                args,
-                error_message="Conversion to PDF with LibreOffice failed",
-            )
+            with self.events.stage("libreoffice"):
+                ext_args = []
+                if libreoffice_ext:
+                    ext_args.append(self.setup_libreoffice_ext(libreoffice_ext))
+                self.update_progress("Converting to PDF using LibreOffice")
+                start = time.perf_counter()
+                # The listener runs without any extensions, so documents that need
+                # one are converted with the command line.
+                method = await self.convert_with_libreoffice(
+                    use_listener=not libreoffice_ext, extra_args=ext_args
+                )
+                self.update_progress(
+                    f"Converted {mime_type} to PDF with LibreOffice ({method}) in"
+                    f" {time.perf_counter() - start:.2f}s"
+                )
             pdf_filename = "/tmp/input_file.pdf"
             # XXX: Sometimes, LibreOffice can fail with status code 0. So, we need to
             # always check if the file exists. See:
@@ -207,46 +263,114 @@ class DocumentToPixels(DangerzoneConverter):
             #     https://github.com/freedomofpress/dangerzone/issues/494
             if not os.path.exists(pdf_filename):
                 raise errors.LibreofficeFailure()
+            filename = pdf_filename
+            filetype = None
             try:
-                doc = fitz.open(pdf_filename)
+                doc = fitz.open(filename)
             except (ValueError, fitz.FileDataError):
                 raise errors.DocCorruptedException()
         else:
             # NOTE: This should never be reached
             raise errors.DocFormatUnsupported()
 
-        # Obtain number of pages
+        # Obtain number of pages, and the ones that the host asked for.
         if doc.page_count > errors.MAX_PAGES:
             raise errors.MaxPagesException()
-        await self.write_page_count(doc.page_count)
-
-        for page in doc.pages():
-            # TODO check if page.number is doc-controlled
-            page_num = page.number + 1  # pages start in 1
+        selected_pages = get_pages(doc.page_count)
+        await self.write_page_count(len(selected_pages))
 
-            self.update_progress(
-                f"Converting page {page_num}/{doc.page_count} to pixels"
-            )
-            pix = page.get_pixmap(dpi=DEFAULT_DPI)
-            rgb_buf = pix.samples_mv
-            await self.write_page_width(pix.width)
-            await self.write_page_height(pix.height)
-            await self.write_page_data(rgb_buf)
+        # Render the pages in parallel, but write them out strictly in page order.
+        # Raster images are rendered with no more pixels than they have. SVG images
+        # have no pixels, so they are rendered like any other document.
+        is_raster_image = (
+            mime_type.startswith("image/") and mime_type != "image/svg+xml"
+        )
+        # Protocol v1 cannot carry the DPI of a page, so every page is rendered at
+        # the default DPI, which is what the host assumes.
+        profile = None if self.protocol == PROTOCOL_V1 else get_dpi_profile()
+        pages = render_pages(
+            doc,
+            filename,
+            filetype,
+            workers=get_render_workers(),
+            profile=profile,
+            image=is_raster_image,
+            pages=selected_pages,
+        )
+        n_pages = len(selected_pages)
+        self.events.emit("start", "render", pages=n_pages)
+        page_num = 0
+        async for width, height, dpi, rgb_buf in pages:
+            # Pages start in 1, both in the output and in the document.
+            number = selected_pages[page_num] + 1
+            page_num += 1
+            self.update_progress(f"Converting page {page_num}/{n_pages} to pixels")
+            self.events.emit("page", "render", page=page_num, pages=n_pages)
+            await self.write_page(number, width, height, dpi, rgb_buf)
 
+        self.events.emit("end", "render", pages=n_pages)
         self.update_progress("Converted document to pixels")
 
-    async def install_libreoffice_ext(self, libreoffice_ext: str) -> None:
-        self.update_progress(f"Installing LibreOffice extension '{libreoffice_ext}'")
-        unzip_args = [
-            "unzip",
-            "-d",
-            f"/usr/lib/libreoffice/share/extensions/{libreoffice_ext}/",
-            f"/opt/libreoffice_ext/{libreoffice_ext}",
+    async def convert_with_libreoffice(
+        self, use_listener: bool = True, extra_args: Optional[List[str]] = None
+    ) -> str:
+        """Convert the input file to PDF, and return how it was converted.
+
+        Use the LibreOffice listener, if there is one, or else the LibreOffice command
+        line. If the listener fails, stop it, and fall back to the command line.
+        """
+        if self.libreoffice is not None and use_listener:
+            state = "warm" if self.libreoffice.conversions else "cold"
+            try:
+                startup_time = await self.libreoffice.connect()
+                if startup_time is not None:
+                    self.update_progress(
+                        f"LibreOffice listener started in {startup_time:.2f}s"
+                    )
+                await self.libreoffice.convert("/tmp/input_file", "/tmp/input_file.pdf")
+                return f"listener, {state}"
+            except Exception as e:
+                self.update_progress(
+                    f"LibreOffice listener failed ({e}), falling back to the command"
+                    " line"
+                )
+                await self.libreoffice.stop()
+                self.libreoffice = None
+
+        args = [
+            "libreoffice",
+            "--headless",
+            "--safe-mode",
+            *(extra_args or []),
+            "--convert-to",
+            "pdf",
+            "--outdir",
+            "/tmp",
+            "/tmp/input_file",
         ]
         await self.run_command(
-            unzip_args,
-            error_message="LibreOffice extension installation failed (unzipping)",
+            args,
+            error_message="Conversion to PDF with LibreOffice failed",
+            discard_stdout=True,
+        )
+        return "command line"
+
+    def setup_libreoffice_ext(self, libreoffice_ext: str) -> str:
+        """Get the LibreOffice argument that enables an extension.
+
+        Extensions are extracted at image build time, each one in its own read-only
+        directory. LibreOffice loads the extension by treating this directory as its
+        bundled extensions directory, so there is nothing to install per document.
+        """
+        start = time.perf_counter()
+        ext_dir = os.path.join(LIBREOFFICE_EXT_DIR, libreoffice_ext)
+        if not os.path.isdir(os.path.join(ext_dir, libreoffice_ext)):
+            raise errors.LibreofficeFailure()
+        self.update_progress(
+            f"Set up LibreOffice extension '{libreoffice_ext}' in"
+            f" {time.perf_counter() - start:.3f}s"
         )
+        return f"-env:BUNDLED_EXTENSIONS=file://{ext_dir}"
 
     def detect_mime_type(self, path: str) -> str:
         """Detect MIME types in a platform-agnostic type.
@@ -262,17 +386,33 @@ class DocumentToPixels(DangerzoneConverter):
         return mime_type
 
 
-async def main() -> None:
+def wipe_tmp() -> None:
+    """Remove the files of the previous document of a session from /tmp.
+
+    The files of the LibreOffice listener are kept, since it's still running.
+    """
+    for entry in os.scandir("/tmp"):
+        if is_listener_file(entry.path):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(entry.path)
+
+
+async def convert_document(
+    libreoffice: Optional[LibreOfficeListener], events: EventWriter
+) -> None:
+    """Convert the document in the stdin, and exit with its error code, if it fails."""
     try:
-        data = await DocumentToPixels.read_bytes()
+        with events.stage("receive"):
+            await DocumentToPixels.read_to_file("/tmp/input_file")
     except EOFError:
         sys.exit(1)
 
-    with open("/tmp/input_file", "wb") as f:
-        f.write(data)
-
     try:
-        converter = DocumentToPixels()
+        converter = DocumentToPixels(libreoffice, events)
         await converter.convert()
     except errors.ConversionException as e:
         await DocumentToPixels.write_bytes(str(e).encode(), file=sys.stderr)
@@ -286,5 +426,72 @@ async def main() -> None:
     await DocumentToPixels.write_bytes(converter.captured_output, file=sys.stderr)
 
 
+async def convert_session(
+    libreoffice: Optional[LibreOfficeListener], events: EventWriter
+) -> None:
+    """Convert the documents of a session, one after the other.
+
+    The status of every document is sent along with its pages, so that a document
+    that fails does not affect the rest. Its files are removed from /tmp before the
+    next document is received.
+    """
+    events.document = 0
+    while True:
+        try:
+            size = await DocumentToPixels.read_document_length()
+            if size is None:
+                break
+            events.document += 1
+            with events.stage("receive"):
+                await DocumentToPixels.read_to_file("/tmp/input_file", size=size)
+        except EOFError:
+            sys.exit(1)
+
+        converter = DocumentToPixels(libreoffice, events)
+        status = 0
+        try:
+            await converter.convert()
+        except errors.ConversionException as e:
+            await DocumentToPixels.write_bytes(str(e).encode(), file=sys.stderr)
+            status = e.error_code
+        except Exception as e:
+            await DocumentToPixels.write_bytes(str(e).encode(), file=sys.stderr)
+            status = errors.UnexpectedConversionError.error_code
+        await converter.write_document_end(status)
+        converter.frame_writer.close()
+        # If the listener failed, the rest of the documents are converted with the
+        # LibreOffice command line.
+        libreoffice = converter.libreoffice
+
+        # Write debug information
+        await DocumentToPixels.write_bytes(converter.captured_output, file=sys.stderr)
+        wipe_tmp()
+
+
+async def main() -> None:
+    events = EventWriter()
+    libreoffice = None
+    if libreoffice_listener_enabled():
+        # Start LibreOffice right away, so that its startup overlaps with receiving
+        # the document.
+        libreoffice = LibreOfficeListener()
+        try:
+            await libreoffice.start()
+        except Exception as e:
+            DocumentToPixels._write_text(
+                f"Could not start the LibreOffice listener: {e}\n", file=sys.stderr
+            )
+            libreoffice = None
+
+    try:
+        if session_enabled():
+            await convert_session(libreoffice, events)
+        else:
+            await convert_document(libreoffice, events)
+    finally:
+        if libreoffice is not None:
+            await libreoffice.stop()
+
+
 if __name__ == "__main__":
     sys.exit(asyncio.run(main()))
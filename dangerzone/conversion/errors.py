@@ -5,6 +5,7 @@ ERROR_SHIFT = 128
 MAX_PAGES = 10000
 MAX_PAGE_WIDTH = 10000
 MAX_PAGE_HEIGHT = 10000
+MAX_PAGE_DPI = 1200
 
 
 class ConverterProcException(Exception):
@@ -93,6 +94,34 @@ class PageCountMismatch(PagesException):
     )
 
 
+class PageDPIException(PagesException):
+    error_code = ERROR_SHIFT + 47
+    error_message = "A page has an invalid resolution."
+
+
+class NoSelectedPagesException(PagesException):
+    error_code = ERROR_SHIFT + 48
+    error_message = "None of the selected pages are in the document"
+
+
+class PageSelectionUnsupportedQubes(PagesException):
+    error_code = ERROR_SHIFT + 49
+    error_message = (
+        "Converting some of the pages of a document, or a preview of it, is not"
+        " supported on Qubes"
+    )
+
+
+class ProtocolException(ConversionException):
+    error_code = ERROR_SHIFT + 50
+    error_message = "The conversion process sent a malformed page"
+
+
+class UnsupportedProtocolException(ProtocolException):
+    error_code = ERROR_SHIFT + 51
+    error_message = "The conversion process uses an unsupported protocol version"
+
+
 class UnexpectedConversionError(ConversionException):
     error_code = ERROR_SHIFT + 100
     error_message = "Some unexpected error occurred while converting the document"
@@ -0,0 +1,84 @@
+"""Structured progress events, which the conversion process sends to the host.
+
+Events are written to the standard error, one per line, as a prefix followed by a
+JSON record. The standard error carries other output as well, e.g., from MuPDF,
+so the host treats any line without the prefix as plain text.
+
+In a session, every event also carries the (1-based) number of the document that
+it refers to.
+
+Events carry no text, since the host should never show text that comes from the
+sandbox to the user. The host describes every stage with its own text instead.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterator, Optional, TextIO
+
+# Environment variable that enables the events, if set to "1".
+EVENTS_ENV = "DANGERZONE_EVENTS"
+
+EVENT_PREFIX = b"DANGERZONE_EVENT "
+# Max size of an event line, in bytes. The host ignores any longer line.
+MAX_EVENT_SIZE = 1024
+
+# The stages of a conversion, in the order they happen.
+STAGES = ["receive", "mime", "libreoffice", "render"]
+# The start and end of a stage, and the rendering of a page within it.
+EVENT_TYPES = ["start", "end", "page"]
+
+
+def events_enabled() -> bool:
+    return os.environ.get(EVENTS_ENV) == "1"
+
+
+class EventWriter:
+    """Write events about the stages of a conversion, with monotonic timestamps.
+
+    The timestamps are the seconds since the writer was created. If the host has
+    not asked for events, nothing is written.
+    """
+
+    def __init__(self, file: TextIO = sys.stderr, enabled: Optional[bool] = None):
+        self.file = file
+        self.enabled = events_enabled() if enabled is None else enabled
+        self.start = time.monotonic()
+        # The number of the document that is being converted, in a session.
+        self.document: Optional[int] = None
+
+    def emit(
+        self,
+        event: str,
+        stage: str,
+        page: Optional[int] = None,
+        pages: Optional[int] = None,
+    ) -> None:
+        if not self.enabled:
+            return
+        record: Dict[str, Any] = {
+            "event": event,
+            "stage": stage,
+            "time": round(time.monotonic() - self.start, 6),
+        }
+        if self.document is not None:
+            record["document"] = self.document
+        if page is not None:
+            record["page"] = page
+        if pages is not None:
+            record["pages"] = pages
+        line = EVENT_PREFIX + json.dumps(record, separators=(",", ":")).encode()
+        # Write the whole line at once, so that it does not interleave with other
+        # output.
+        self.file.flush()
+        self.file.buffer.write(line + b"\n")
+        self.file.flush()
+
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Emit the start of a stage, and its end, if it completes."""
+        self.emit("start", stage)
+        yield
+        self.emit("end", stage)
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import time
+from typing import Any, Optional, Tuple
+
+# Environment variable that enables the LibreOffice listener, if set to "1".
+LIBREOFFICE_LISTENER_ENV = "DANGERZONE_LIBREOFFICE_LISTENER"
+
+# Directory with the LibreOffice extensions, which are extracted at image build time.
+LIBREOFFICE_EXT_DIR = "/opt/libreoffice_ext"
+
+# The listener accepts connections on a named pipe, since the sandbox has no
+# network. It also uses its own user profile, so that it never clashes with the
+# LibreOffice command line, which we fall back to if the listener fails.
+LISTENER_PIPE_NAME = "dangerzone_libreoffice"
+LISTENER_PROFILE_DIR = "/tmp/libreoffice_listener"
+LISTENER_PROFILE_URL = f"file://{LISTENER_PROFILE_DIR}"
+# The listener keeps its temporary files apart, so that they survive the wiping of
+# /tmp between the documents of a session.
+LISTENER_TMP_DIR = "/tmp/libreoffice_listener_tmp"
+LISTENER_UNO_URL = f"uno:pipe,name={LISTENER_PIPE_NAME};urp;StarOffice.ComponentContext"
+
+# Time (in seconds) that we wait for the listener to accept connections.
+LISTENER_START_TIMEOUT = 60
+LISTENER_CONNECT_INTERVAL = 0.2
+
+# The PDF export filter for each type of document. Presentations are drawings as
+# well, so they have to be checked first.
+PDF_EXPORT_FILTERS = {
+    "com.sun.star.text.GenericTextDocument": "writer_pdf_Export",
+    "com.sun.star.sheet.SpreadsheetDocument": "calc_pdf_Export",
+    "com.sun.star.presentation.PresentationDocument": "impress_pdf_Export",
+    "com.sun.star.drawing.DrawingDocument": "draw_pdf_Export",
+}
+
+
+def libreoffice_listener_enabled() -> bool:
+    return os.environ.get(LIBREOFFICE_LISTENER_ENV) == "1"
+
+
+def is_listener_file(path: str) -> bool:
+    """Check if a path in /tmp belongs to the listener, which is still running.
+
+    LibreOffice creates its named pipes in /tmp, regardless of the temporary
+    directory.
+    """
+    name = os.path.basename(path)
+    return path in (LISTENER_PROFILE_DIR, LISTENER_TMP_DIR) or (
+        name.startswith("OSL_PIPE_") and name.endswith(LISTENER_PIPE_NAME)
+    )
+
+
+def _properties(**kwargs: Any) -> Tuple[Any, ...]:
+    from com.sun.star.beans import PropertyValue
+
+    return tuple(
+        PropertyValue(Name=name, Value=value) for name, value in kwargs.items()
+    )
+
+
+class LibreOfficeListener:
+    """A headless LibreOffice instance, which converts documents to PDF over UNO.
+
+    Starting LibreOffice takes a few seconds in the sandbox, which dominates the
+    conversion time of short documents. The listener is started once, possibly
+    while the sandbox still receives the document, and then converts every
+    document that it's given, without paying for the startup again.
+    """
+
+    def __init__(self) -> None:
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.desktop: Any = None
+        self.start_time = 0.0
+        self.conversions = 0
+
+    async def start(self) -> None:
+        self.start_time = time.perf_counter()
+        os.makedirs(LISTENER_TMP_DIR, exist_ok=True)
+        self.proc = await asyncio.subprocess.create_subprocess_exec(
+            "libreoffice",
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--norestore",
+            "--safe-mode",
+            f"-env:UserInstallation={LISTENER_PROFILE_URL}",
+            f"--accept=pipe,name={LISTENER_PIPE_NAME};urp;",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            env={**os.environ, "TMPDIR": LISTENER_TMP_DIR},
+        )
+
+    def _connect(self) -> float:
+        """Connect to the listener, and return how long it took to start."""
+        import uno
+        from com.sun.star.connection import NoConnectException
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = self.start_time + LISTENER_START_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(LISTENER_UNO_URL)
+                break
+            except NoConnectException:
+                assert self.proc is not None
+                if self.proc.returncode is not None:
+                    raise RuntimeError("LibreOffice listener exited during startup")
+                if time.perf_counter() > deadline:
+                    raise RuntimeError("LibreOffice listener did not start in time")
+                time.sleep(LISTENER_CONNECT_INTERVAL)
+
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+        return time.perf_counter() - self.start_time
+
+    def _convert(self, input_path: str, output_path: str) -> None:
+        import uno
+
+        # Never run the macros of a document (NEVER_EXECUTE), or update its links
+        # (NO_UPDATE), just like the command line does.
+        load_props = _properties(
+            Hidden=True, ReadOnly=True, MacroExecutionMode=0, UpdateDocMode=0
+        )
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(input_path), "_blank", 0, load_props
+        )
+        if doc is None:
+            raise RuntimeError("LibreOffice listener could not load the document")
+        try:
+            for service, filter_name in PDF_EXPORT_FILTERS.items():
+                if doc.supportsService(service):
+                    break
+            else:
+                raise RuntimeError("LibreOffice listener cannot export the document")
+            doc.storeToURL(
+                uno.systemPathToFileUrl(output_path),
+                _properties(FilterName=filter_name),
+            )
+        finally:
+            doc.close(True)
+
+    async def connect(self) -> Optional[float]:
+        """Wait for the listener to start, and return how long it took.
+
+        If we have already connected to the listener, return None.
+        """
+        if self.desktop is not None:
+            return None
+        return await asyncio.to_thread(self._connect)
+
+    async def convert(self, input_path: str, output_path: str) -> None:
+        """Convert a document to PDF."""
+        await self.connect()
+        await asyncio.to_thread(self._convert, input_path, output_path)
+        self.conversions += 1
+
+    async def stop(self) -> None:
+        self.desktop = None
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+            await self.proc.wait()
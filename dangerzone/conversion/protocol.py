@@ -0,0 +1,184 @@
+"""The format in which the conversion process sends the pixels of pages to the host.
+
+Protocol v1 is a 2-byte page count, followed by the width and height of every page
+(2 bytes each), and its RGB pixels. Every page is rendered at the default DPI.
+
+Protocol v2 starts with a zero, which is never a valid page count in v1, and the
+protocol version, so that the host can tell the two apart. Then follows the page
+count, and for every page its (1-based) page number in the document, its width,
+height and DPI, which may differ from page to page, the format and compression of
+its pixels (2 bytes each), and the size of its pixels (4 bytes), followed by the
+pixels.
+
+The conversion process uses v2 only if the host asks for it, since hosts that
+predate it would reject it.
+
+In a session, the conversion process converts several documents in a row, and
+always uses protocol v2. The host sends every document as its size (8 bytes),
+followed by its contents, and closes the stream after the last one. The conversion
+process sends the pages of every document, followed by a zero, where the number of
+the next page would be, and the status of the document (2 bytes): zero if it was
+converted, or else its error code. A document can fail after some of its pages have
+been sent, in which case its status follows right after them. If it fails before
+its pages are sent, its page count is zero.
+"""
+
+import os
+import zlib
+from typing import Optional, Tuple, Union
+
+from .common import DOCUMENT_LENGTH_BYTES, encode_ints
+
+# Environment variables with the protocol version, and the compression of the pixels
+# in protocol v2.
+PROTOCOL_ENV = "DANGERZONE_PROTOCOL"
+COMPRESSION_ENV = "DANGERZONE_COMPRESSION"
+# Environment variable that starts a session, if set to "1".
+SESSION_ENV = "DANGERZONE_SESSION"
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+PROTOCOL_VERSIONS = [PROTOCOL_V1, PROTOCOL_V2]
+LENGTH_BYTES = 4
+
+# The pixel formats: RGB, grayscale, and black and white with one bit per pixel.
+# Each row of black and white pixels starts at a new byte.
+PIXEL_FORMAT_RGB = 0
+PIXEL_FORMAT_GRAY = 1
+PIXEL_FORMAT_BILEVEL = 2
+PIXEL_FORMATS = [PIXEL_FORMAT_RGB, PIXEL_FORMAT_GRAY, PIXEL_FORMAT_BILEVEL]
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSIONS = {"none": COMPRESSION_NONE, "zlib": COMPRESSION_ZLIB}
+
+# The fastest zlib level, since it gets most of the gains on rendered pages, which
+# are mostly background.
+ZLIB_LEVEL = 1
+
+# Translation tables between black and white pixels and binary digits.
+BILEVEL_TO_DIGITS = bytes.maketrans(b"\x00\xff", b"01")
+DIGITS_TO_BILEVEL = bytes.maketrans(b"01", b"\x00\xff")
+
+Pixels = Union[bytes, memoryview]
+
+
+def get_protocol() -> Tuple[int, int]:
+    """Get the protocol version and compression that the host has asked for."""
+    version = PROTOCOL_V1
+    if os.environ.get(PROTOCOL_ENV) == str(PROTOCOL_V2):
+        version = PROTOCOL_V2
+    compression = COMPRESSIONS.get(
+        os.environ.get(COMPRESSION_ENV, ""), COMPRESSION_NONE
+    )
+    return version, compression
+
+
+def session_enabled() -> bool:
+    return os.environ.get(SESSION_ENV) == "1"
+
+
+def pixels_size(pixel_format: int, width: int, height: int) -> int:
+    """Get the size of the (uncompressed) pixels of a page, in bytes."""
+    if pixel_format == PIXEL_FORMAT_RGB:
+        return width * height * 3
+    elif pixel_format == PIXEL_FORMAT_GRAY:
+        return width * height
+    else:
+        return (width + 7) // 8 * height
+
+
+def pack_bilevel(gray: bytes, width: int) -> bytes:
+    """Pack black and white pixels into one bit per pixel."""
+    digits = gray.translate(BILEVEL_TO_DIGITS)
+    padding = -width % 8
+    if padding:
+        digits = b"".join(
+            digits[i : i + width] + b"0" * padding for i in range(0, len(digits), width)
+        )
+    # Python parses binary numbers in linear time, which makes this much faster
+    # than packing the bits one by one.
+    return int(digits, 2).to_bytes(len(digits) // 8, "big")
+
+
+def unpack_bilevel(packed: Pixels, width: int, height: int) -> bytes:
+    """Unpack black and white pixels to one byte per pixel."""
+    row_bits = (width + 7) // 8 * 8
+    digits = bin(int.from_bytes(packed, "big"))[2:].zfill(row_bits * height).encode()
+    if row_bits != width:
+        digits = b"".join(
+            digits[i : i + width] for i in range(0, len(digits), row_bits)
+        )
+    return digits.translate(DIGITS_TO_BILEVEL)
+
+
+def pack_pixels(rgb: Pixels, width: int) -> Tuple[int, Pixels]:
+    """Pack RGB pixels in the smallest pixel format that keeps them intact."""
+    samples = bytes(rgb)
+    red = samples[0::3]
+    if red != samples[1::3] or red != samples[2::3]:
+        return PIXEL_FORMAT_RGB, rgb
+    if red.translate(None, b"\x00\xff"):
+        return PIXEL_FORMAT_GRAY, red
+    return PIXEL_FORMAT_BILEVEL, pack_bilevel(red, width)
+
+
+def encode_stream_header(version: int, page_count: int) -> bytes:
+    if version == PROTOCOL_V1:
+        return encode_ints([page_count])
+    return encode_ints([0, version, page_count])
+
+
+def encode_document_length(size: int) -> bytes:
+    return size.to_bytes(DOCUMENT_LENGTH_BYTES, "big", signed=False)
+
+
+def encode_document_end(status: int) -> bytes:
+    return encode_ints([0, status])
+
+
+def encode_page(
+    version: int,
+    compression: int,
+    number: int,
+    width: int,
+    height: int,
+    dpi: int,
+    rgb: Pixels,
+) -> Tuple[bytes, Pixels]:
+    """Encode a page, and return its header and payload."""
+    if version == PROTOCOL_V1:
+        return encode_ints([width, height]), rgb
+
+    pixel_format, pixels = pack_pixels(rgb, width)
+    if compression == COMPRESSION_ZLIB:
+        compressed = zlib.compress(pixels, ZLIB_LEVEL)
+        # Pixels that do not compress are sent as is, so that the host can expect
+        # that compressed pixels are always smaller.
+        if len(compressed) < len(pixels):
+            pixels = compressed
+        else:
+            compression = COMPRESSION_NONE
+    header = encode_ints([number, width, height, dpi, pixel_format, compression])
+    return header + len(pixels).to_bytes(LENGTH_BYTES, "big"), pixels
+
+
+def decompress_pixels(untrusted_payload: Pixels, size: int) -> Optional[bytes]:
+    """Decompress the pixels of a page, which must be exactly `size` bytes.
+
+    Never decompress more than that, so that a malicious payload cannot exhaust the
+    memory of the host. If the payload is not valid, return None.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        pixels = decompressor.decompress(untrusted_payload, size)
+    except zlib.error:
+        return None
+    if (
+        len(pixels) != size
+        or not decompressor.eof
+        or decompressor.unconsumed_tail
+        or decompressor.unused_data
+    ):
+        return None
+    return pixels
@@ -0,0 +1,214 @@
+import asyncio
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import sys
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+import fitz
+
+from . import errors
+from .common import DEFAULT_DPI, select_pages
+
+# Environment variable with the number of processes that render pages in parallel.
+RENDER_WORKERS_ENV = "DANGERZONE_RENDER_WORKERS"
+# Environment variables with the DPI profile, and a pixel budget that overrides the
+# one of the profile.
+DPI_PROFILE_ENV = "DANGERZONE_DPI_PROFILE"
+PIXEL_BUDGET_ENV = "DANGERZONE_PIXEL_BUDGET"
+# Environment variable with the pages to render, e.g., "1-5,10".
+PAGES_ENV = "DANGERZONE_PAGES"
+
+# Starting a worker and sending the pixels of a page back from it has a cost, which
+# is not worth it for documents with only a few pages per worker.
+MIN_PAGES_PER_WORKER = 4
+
+# The width, height, DPI and pixels of a rendered page.
+RenderedPage = Tuple[int, int, int, bytes]
+
+
+@dataclass(frozen=True)
+class DPIProfile:
+    """The max number of pixels of a page, and the bounds of its DPI."""
+
+    pixel_budget: int
+    min_dpi: int
+    max_dpi: int
+
+    def page_dpi(self, rect: fitz.Rect) -> int:
+        """Choose the DPI of a page, so that its pixels fit in the pixel budget.
+
+        The DPI may drop below the min DPI only if the page would otherwise exceed
+        the max page dimensions.
+        """
+        width = max(rect.width, 1) / 72  # in inches
+        height = max(rect.height, 1) / 72
+        dpi = int(math.sqrt(self.pixel_budget / (width * height)))
+        dpi = max(self.min_dpi, min(self.max_dpi, dpi))
+        # MuPDF may round the dimensions of the pixmap up, hence the extra pixel.
+        max_dim_dpi = min(
+            (errors.MAX_PAGE_WIDTH - 1) / width, (errors.MAX_PAGE_HEIGHT - 1) / height
+        )
+        return max(1, min(dpi, int(max_dim_dpi)))
+
+
+# The "standard" profile renders common page sizes, up to A3, at the default DPI,
+# and only lowers the DPI of larger pages.
+DPI_PROFILES: Dict[str, DPIProfile] = {
+    "fast": DPIProfile(pixel_budget=1_000_000, min_dpi=50, max_dpi=100),
+    "standard": DPIProfile(pixel_budget=4_500_000, min_dpi=72, max_dpi=DEFAULT_DPI),
+    "high": DPIProfile(pixel_budget=16_000_000, min_dpi=150, max_dpi=300),
+    # For thumbnails of documents, which are just good enough to triage them.
+    "preview": DPIProfile(pixel_budget=250_000, min_dpi=24, max_dpi=72),
+}
+DEFAULT_DPI_PROFILE = "standard"
+
+# The document that a worker process renders pages from, its DPI profile, and
+# whether it's an image.
+_worker_doc: Optional[fitz.Document] = None
+_worker_profile: Optional[DPIProfile] = DPI_PROFILES[DEFAULT_DPI_PROFILE]
+_worker_image = False
+
+
+def get_render_workers() -> int:
+    """Get the number of render workers, defaulting to one per CPU core."""
+    try:
+        workers = int(os.environ.get(RENDER_WORKERS_ENV, "0"))
+    except ValueError:
+        workers = 0
+    if workers > 0:
+        return workers
+    return os.cpu_count() or 1
+
+
+def get_dpi_profile() -> DPIProfile:
+    """Get the DPI profile, with the pixel budget that the host may have set."""
+    profile = DPI_PROFILES.get(
+        os.environ.get(DPI_PROFILE_ENV, ""), DPI_PROFILES[DEFAULT_DPI_PROFILE]
+    )
+    try:
+        pixel_budget = int(os.environ.get(PIXEL_BUDGET_ENV, "0"))
+    except ValueError:
+        pixel_budget = 0
+    if pixel_budget > 0:
+        profile = replace(profile, pixel_budget=pixel_budget)
+    return profile
+
+
+def native_image_dpi(page: fitz.Page) -> Optional[int]:
+    """Get the DPI that renders a page with as many pixels as the image it consists of.
+
+    If the page does not consist of a single image, return None.
+    """
+    images = page.get_image_info()
+    if len(images) != 1 or page.rect.width <= 0:
+        return None
+    # Allow for rounding errors, so that we never lose a pixel to them.
+    return max(1, math.floor(images[0]["width"] * 72 / page.rect.width + 0.01))
+
+
+def choose_dpi(
+    page: fitz.Page, profile: Optional[DPIProfile], image: bool = False
+) -> int:
+    """Choose the DPI of a page, and never upscale the frames of an image.
+
+    Without a DPI profile, every page is rendered at the default DPI.
+    """
+    if profile is None:
+        return DEFAULT_DPI
+    dpi = profile.page_dpi(page.rect)
+    if image:
+        dpi = min(dpi, native_image_dpi(page) or dpi)
+    return dpi
+
+
+def get_pages(page_count: int) -> List[int]:
+    """Get the (0-based) numbers of the pages to render, which the host may have set.
+
+    :raises errors.NoSelectedPagesException: if none of the pages are in the document
+    """
+    pages = select_pages(os.environ.get(PAGES_ENV), page_count)
+    if not pages:
+        raise errors.NoSelectedPagesException()
+    return pages
+
+
+def _init_worker(
+    filename: str, filetype: Optional[str], profile: Optional[DPIProfile], image: bool
+) -> None:
+    # The standard output of the conversion carries the pixels of the pages, in
+    # order. Workers must never write to it, so we redirect it to the standard error.
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    global _worker_doc, _worker_profile, _worker_image
+    _worker_doc = fitz.open(filename, filetype=filetype)
+    _worker_profile = profile
+    _worker_image = image
+
+
+def _render_page(number: int) -> RenderedPage:
+    assert _worker_doc is not None
+    page = _worker_doc[number]
+    dpi = choose_dpi(page, _worker_profile, _worker_image)
+    pix = page.get_pixmap(dpi=dpi)
+    return pix.width, pix.height, dpi, pix.samples
+
+
+async def render_pages(
+    doc: fitz.Document,
+    filename: str,
+    filetype: Optional[str] = None,
+    workers: int = 1,
+    profile: Optional[DPIProfile] = DPI_PROFILES[DEFAULT_DPI_PROFILE],
+    image: bool = False,
+    pages: Optional[Sequence[int]] = None,
+) -> AsyncIterator[RenderedPage]:
+    """Render the pages of a document to RGB pixels, and yield them in page order.
+
+    If the (0-based) numbers of some pages are given, render only those pages.
+
+    The DPI of every page is chosen by the DPI profile, based on the size of the page,
+    or is the default DPI if there's no profile.
+    If the document is a raster image, every page is a frame of the image, which is
+    rendered with at most as many pixels as the frame has. MuPDF can then decode it
+    straight to the final size, converted to RGB, and composited on white.
+
+    With more than one worker, every worker process opens the document on its own,
+    and renders a page at a time. Only a limited window of pages is in flight, so
+    that pages that are rendered out of order do not pile up in memory.
+    """
+    if pages is None:
+        pages = range(doc.page_count)
+    workers = min(workers, len(pages) // MIN_PAGES_PER_WORKER)
+    if workers < 2:
+        for number in pages:
+            page = doc[number]
+            dpi = choose_dpi(page, profile, image)
+            pix = page.get_pixmap(dpi=dpi)
+            yield pix.width, pix.height, dpi, pix.samples_mv
+        return
+
+    loop = asyncio.get_running_loop()
+    # Spawn the workers, instead of forking them, since the conversion process has
+    # running threads, which write to the standard streams.
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(filename, filetype, profile, image),
+    )
+    try:
+        window = 2 * workers
+        pending: Deque[asyncio.Future[RenderedPage]] = deque()
+        next_page = 0
+        while next_page < len(pages) or pending:
+            while next_page < len(pages) and len(pending) < window:
+                pending.append(
+                    loop.run_in_executor(executor, _render_page, pages[next_page])
+                )
+                next_page += 1
+            yield await pending.popleft()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
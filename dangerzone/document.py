@@ -4,10 +4,12 @@ import os
 import platform
 import re
 import secrets
+import time
 from pathlib import Path, PurePosixPath, PureWindowsPath
 from typing import Optional
 
 from . import errors, util
+from .conversion.common import parse_page_ranges
 
 SAFE_EXTENSION = "-safe.pdf"
 ARCHIVE_SUBDIR = "unsafe"
@@ -34,6 +36,9 @@ class Document:
         output_filename: Optional[str] = None,
         suffix: str = SAFE_EXTENSION,
         archive: bool = False,
+        pages: Optional[str] = None,
+        preview: bool = False,
+        priority: int = 0,
     ) -> None:
         # NOTE: See https://github.com/freedomofpress/dangerzone/pull/216#discussion_r1015449418
         self.id = secrets.token_urlsafe(6)[0:6]
@@ -53,6 +58,21 @@ class Document:
 
         self.archive_after_conversion = archive
 
+        # A preview is a quick, low resolution conversion without OCR, which is
+        # meant for thumbnails. It converts the first page, unless told otherwise.
+        self.preview = preview
+        if pages is None and preview:
+            pages = "1"
+        self._pages: Optional[str] = None
+        self.pages = pages
+
+        # Documents with a higher priority are converted first.
+        self.priority = priority
+        # When the document was queued for conversion, as a monotonic timestamp, and
+        # how long it waited until its conversion started, in seconds.
+        self.queued_at: Optional[float] = None
+        self.queue_wait: Optional[float] = None
+
     @staticmethod
     def normalize_filename(filename: str) -> str:
         return os.path.abspath(filename)
@@ -138,6 +158,20 @@ class Document:
         else:
             raise errors.SuffixNotApplicableException()
 
+    @property
+    def pages(self) -> Optional[str]:
+        """The pages to convert, e.g., "1-5,10", or None to convert every page."""
+        return self._pages
+
+    @pages.setter
+    def pages(self, pages: Optional[str]) -> None:
+        if pages is not None:
+            try:
+                parse_page_ranges(pages)
+            except ValueError as e:
+                raise errors.InvalidPageRangeException(str(e)) from e
+        self._pages = pages
+
     @property
     def archive_after_conversion(self) -> bool:
         return self._archive
@@ -202,9 +236,16 @@ class Document:
     def is_safe(self) -> bool:
         return self.state is Document.STATE_SAFE
 
+    def mark_as_queued(self) -> None:
+        self.queued_at = time.monotonic()
+        self.queue_wait = None
+
     def mark_as_converting(self) -> None:
         log.debug(f"Marking doc {self.id} as 'converting'")
         self.state = Document.STATE_CONVERTING
+        if self.queued_at is not None and self.queue_wait is None:
+            self.queue_wait = time.monotonic() - self.queued_at
+            log.info(f"[doc {self.id}] Waited {self.queue_wait:.2f}s in the queue")
 
     def mark_as_failed(self) -> None:
         log.debug(f"Marking doc {self.id} as 'failed'")
@@ -101,6 +101,13 @@ class SuffixNotApplicableException(DocumentFilenameException):
         super().__init__("Cannot set a suffix after setting an output filename")
 
 
+class InvalidPageRangeException(DocumentFilenameException):
+    """Exception for when the pages to convert are not a valid page range."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(f"{message}. Use page numbers and ranges, e.g., '1-5,10'")
+
+
 def handle_document_errors(func: F) -> F:
     """Decorator to log document-related errors and exit gracefully."""
 
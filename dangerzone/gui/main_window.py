@@ -36,6 +36,7 @@ else:
 from .. import errors
 from ..document import SAFE_EXTENSION, Document
 from ..isolation_provider.qubes import is_qubes_native_conversion
+from ..scheduling import schedule_documents
 from ..updater import (
     EmptyReport,
     ErrorReport,
@@ -1601,7 +1602,14 @@ class DocumentsListWidget(QtWidgets.QListWidget):
             self.thread_pool = ThreadPool(max_jobs)
             self.thread_pool_initized = True
 
-        for doc in self.docs_list:
+        documents = schedule_documents(
+            self.docs_list, self.dangerzone.settings.get("schedule")
+        )
+        # Queue every document before the first one starts, so that the time they
+        # wait in the queue is measured from the same point.
+        for doc in documents:
+            doc.mark_as_queued()
+        for doc in documents:
             task = ConvertTask(self.dangerzone, doc, self.get_ocr_lang())
             doc_widget = self.docs_list_widget_map[doc]
             task.update.connect(doc_widget.update_progress)
@@ -2,21 +2,61 @@ import contextlib
 import logging
 import os
 import platform
+import queue
 import signal
 import subprocess
 import sys
 import threading
+import time
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 from io import BytesIO
-from typing import IO, Callable, Iterator, Optional
+from types import TracebackType
+from typing import IO, Callable, Dict, Iterator, List, Optional, Tuple, Type, Union
 
 import fitz
 from colorama import Fore, Style
 
 from ..conversion import errors
 from ..conversion.common import DEFAULT_DPI, INT_BYTES
+from ..conversion.events import EVENTS_ENV, MAX_EVENT_SIZE
+from ..conversion.libreoffice import LIBREOFFICE_LISTENER_ENV
+from ..conversion.protocol import (
+    COMPRESSION_ENV,
+    COMPRESSION_NONE,
+    COMPRESSIONS,
+    LENGTH_BYTES,
+    PIXEL_FORMAT_BILEVEL,
+    PIXEL_FORMAT_RGB,
+    PIXEL_FORMATS,
+    PROTOCOL_ENV,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+    SESSION_ENV,
+    decompress_pixels,
+    encode_document_length,
+    pixels_size,
+    unpack_bilevel,
+)
+from ..conversion.render import (
+    DPI_PROFILE_ENV,
+    PAGES_ENV,
+    PIXEL_BUDGET_ENV,
+    RENDER_WORKERS_ENV,
+)
 from ..document import Document
+from ..settings import Settings
 from ..util import get_tessdata_dir, replace_control_chars
+from .images import (
+    find_blank_color,
+    insert_blank_page,
+    insert_image_page,
+    to_grayscale,
+)
+from .metrics import STAGE_TEXTS, ConversionEvent, StageTimings, parse_event
+from .ocr import OCREngine, OCRPool, get_ocr_workers, ocr_pixmap
+from .ocr_cache import OCRCache
+from .writer import SafePDFWriter
 
 log = logging.getLogger(__name__)
 
@@ -24,6 +64,23 @@ TIMEOUT_EXCEPTION = 15
 TIMEOUT_GRACE = 15
 TIMEOUT_FORCE = 5
 
+# Number of pages that can wait in the queue, until the host processes them.
+PAGE_QUEUE_SIZE = 4
+
+# Maximum size (in bytes) of the buffers that hold the pixels of pages, while they
+# wait in the queue. The reader can always use two buffers, one for the page that it
+# reads and one for the page that the host converts, even if they exceed this size.
+PAGE_BUFFERS_SIZE = 256 * 1024 * 1024
+MIN_PAGE_BUFFERS = 2
+
+# Interval (in seconds) in which the reader checks if it should stop, while it waits
+# for room in the queue.
+STOP_CHECK_INTERVAL = 0.1
+
+# Size (in bytes) of the chunks in which the input document is sent to the
+# conversion process.
+INPUT_CHUNK_SIZE = 1024 * 1024
+
 
 def _signal_process_group(p: subprocess.Popen, signo: int) -> None:
     """Send a signal to a process group."""
@@ -65,42 +122,590 @@ def read_bytes(f: IO[bytes], size: int, exact: bool = True) -> bytes:
     return buf
 
 
-def read_int(f: IO[bytes]) -> int:
-    """Read 2 bytes from a file-like object, and decode them as int."""
-    untrusted_int = f.read(INT_BYTES)
-    if len(untrusted_int) != INT_BYTES:
+def read_into(f: IO[bytes], buf: memoryview) -> None:
+    """Fill a buffer with bytes from a file-like object."""
+    pos = 0
+    while pos < len(buf):
+        n = f.readinto(buf[pos:])  # type: ignore [attr-defined]
+        if not n:
+            raise errors.ConverterProcException()
+        pos += n
+
+
+def read_int(f: IO[bytes], size: int = INT_BYTES) -> int:
+    """Read 2 bytes (by default) from a file-like object, and decode them as int."""
+    untrusted_int = f.read(size)
+    if len(untrusted_int) != size:
         raise errors.ConverterProcException()
     return int.from_bytes(untrusted_int, "big", signed=False)
 
 
+def read_stream_header(f: IO[bytes]) -> Tuple[int, int]:
+    """Read the protocol version and the number of pages of a conversion.
+
+    A conversion process that uses protocol v1 starts with the number of pages, which
+    is never zero. Later versions start with a zero and the protocol version.
+    """
+    n_pages = read_int(f)
+    if n_pages != 0:
+        return PROTOCOL_V1, n_pages
+    if read_int(f) != PROTOCOL_V2:
+        raise errors.UnsupportedProtocolException()
+    return PROTOCOL_V2, read_int(f)
+
+
+class DocumentFailed(Exception):
+    """The conversion process failed to convert a document of a session.
+
+    The conversion process has reported the failure, and moved on to the next
+    document, so the session can go on.
+    """
+
+    def __init__(self, error: Exception) -> None:
+        super().__init__(str(error))
+        self.error = error
+
+
+def read_document_status(f: IO[bytes]) -> None:
+    """Read the status of a document in a session, and raise its error, if it failed."""
+    status = read_int(f)
+    if status != 0:
+        raise DocumentFailed(errors.exception_from_error_code(status))
+
+
+def read_document_end(f: IO[bytes]) -> None:
+    """Read the end of a document in a session, after its last page."""
+    if read_int(f) != 0:
+        raise errors.ProtocolException()
+    read_document_status(f)
+
+
+def pixels_to_pixmap(
+    untrusted_data: Union[bytes, memoryview],
+    untrusted_width: int,
+    untrusted_height: int,
+    untrusted_dpi: int = DEFAULT_DPI,
+    channels: int = 3,
+) -> fitz.Pixmap:
+    """Create a pixmap from a byte array of RGB (or grayscale) pixels.
+
+    The DPI of the pixmap determines the size of the page that it's inserted to.
+    """
+    pixmap = fitz.Pixmap(
+        fitz.Colorspace(fitz.CS_RGB if channels == 3 else fitz.CS_GRAY),
+        fitz.IRect(0, 0, untrusted_width, untrusted_height),
+        False,
+    )
+    # Copy the pixels straight into the memory of the pixmap, since PyMuPDF cannot
+    # create a pixmap from a view into the buffers of the page reader.
+    pixmap.samples_mv[:] = untrusted_data
+    pixmap.set_dpi(untrusted_dpi, untrusted_dpi)
+    return pixmap
+
+
 def sanitize_debug_text(text: bytes) -> str:
     """Read all the buffer and return a sanitized version"""
     untrusted_text = text.decode("ascii", errors="replace")
     return replace_control_chars(untrusted_text, keep_newlines=True)
 
 
+class ReaderStopped(Exception):
+    """The page reader was asked to stop, while it waited for the host."""
+
+
+@dataclass
+class UntrustedPage:
+    """The pixels of a page, as sent by the conversion process.
+
+    The pixels are a view into a buffer that the reader reuses for subsequent pages,
+    so they are valid only until the next page is requested. They are either RGB, or
+    grayscale if the page has a single channel.
+    """
+
+    number: int
+    width: int
+    height: int
+    dpi: int
+    pixels: memoryview
+    buffer: bytearray
+    channels: int = 3
+
+
+@dataclass
+class ConversionStats:
+    """Timings and counters for the host side of a conversion."""
+
+    # Time spent reading pages from the conversion process.
+    read_time: float = 0.0
+    # Time the reader spent waiting for the host to make room in the queue.
+    read_blocked_time: float = 0.0
+    # Time spent converting pixels to PDF pages.
+    convert_time: float = 0.0
+    # Time the host spent waiting for the next page from the conversion process.
+    convert_starved_time: float = 0.0
+    # Time spent encoding the images of the pages without OCR, and writing the safe
+    # PDF to disk.
+    encode_time: float = 0.0
+    # Wall-clock time, from the first page until the safe PDF was written.
+    total_time: float = 0.0
+    # Number of blank pages, which were replaced with a page of a single color.
+    blank_pages: int = 0
+    # Number of pages that were stored as grayscale.
+    grayscale_pages: int = 0
+    # Number of bytes read from the conversion process.
+    read_bytes: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"read {self.read_bytes / 1024 / 1024:,.1f} MiB of pages"
+            f" in {self.read_time:.2f}s (blocked for {self.read_blocked_time:.2f}s),"
+            f" converted pages in {self.convert_time:.2f}s"
+            f" (starved for {self.convert_starved_time:.2f}s),"
+            f" total time {self.total_time:.2f}s,"
+            f" {self.blank_pages} blank page(s),"
+            f" {self.grayscale_pages} grayscale page(s)"
+        )
+
+
+class InputWriter:
+    """Send the input document to the conversion process, in a background thread.
+
+    The document is sent in chunks, so that the host never holds the whole document
+    in memory. Since this happens in the background, the host can wait for the
+    output of the conversion process in the meantime.
+
+    In a session, the document is preceded by its size, and the standard input is
+    left open for the next document.
+    """
+
+    def __init__(
+        self, f: IO[bytes], stdin: IO[bytes], size: Optional[int] = None
+    ) -> None:
+        self.f = f
+        self.stdin = stdin
+        self.size = size
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def join(self) -> None:
+        """Wait until the whole document has been sent, and raise any errors."""
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _write(self) -> None:
+        chunk = memoryview(bytearray(INPUT_CHUNK_SIZE))
+        remaining = self.size
+        try:
+            if self.size is not None:
+                self.stdin.write(encode_document_length(self.size))
+            while remaining is None or remaining > 0:
+                buf = (
+                    chunk if remaining is None else chunk[: min(remaining, len(chunk))]
+                )
+                n = self.f.readinto(buf)  # type: ignore [attr-defined]
+                if not n:
+                    if remaining is not None:
+                        raise IOError("The document was truncated while it was sent")
+                    break
+                self.stdin.write(buf[:n])
+                if remaining is not None:
+                    remaining -= n
+        except BrokenPipeError:
+            self.error = errors.ConverterProcException()
+        except BaseException as e:
+            self.error = e
+        finally:
+            # Always close the standard input, so that the conversion process does
+            # not wait for more data. If we failed to send the whole document, the
+            # conversion fails once we raise the error. In a session, the standard
+            # input is closed only once there are no more documents.
+            try:
+                if self.size is None or self.error is not None:
+                    self.stdin.close()
+                else:
+                    self.stdin.flush()
+            except BrokenPipeError:
+                if self.error is None:
+                    self.error = errors.ConverterProcException()
+
+
+class PageReader:
+    """Read pages from the conversion process in a background thread.
+
+    Reading the next page from the conversion process should not wait until the
+    host has converted the previous one. Else, the conversion process stalls on a
+    full pipe while the host works, and the host sits idle while the conversion
+    process renders the next page.
+
+    For this reason, a reader thread reads pages as soon as they are available, and
+    passes them to the host through a bounded queue. If the host falls behind, the
+    queue fills up and the reader stops reading, which in turn makes the conversion
+    process block on the pipe. This way, we don't keep in memory more pages than
+    the queue can hold.
+
+    Pages can be up to hundreds of megabytes each, so instead of allocating new
+    memory for every page, the reader reads the pixels into a set of buffers, which
+    are reused once the host is done with a page. A buffer grows only when a larger
+    page arrives. The total size of the buffers is capped as well, so that the
+    reader does not get too far ahead of the host when pages are very large.
+
+    Any error in the reader thread, e.g., a page that exceeds the maximum
+    dimensions, is raised in the thread that consumes the pages.
+    """
+
+    def __init__(
+        self,
+        f: IO[bytes],
+        n_pages: int,
+        stats: ConversionStats,
+        queue_size: int = PAGE_QUEUE_SIZE,
+        max_buffers_size: int = PAGE_BUFFERS_SIZE,
+        protocol: int = PROTOCOL_V1,
+        session: bool = False,
+    ) -> None:
+        self.f = f
+        self.n_pages = n_pages
+        self.stats = stats
+        self.protocol = protocol
+        # In a session, the conversion process may report that the document failed,
+        # in place of its next page.
+        self.session = session
+        # The number of the last page in the document, in protocol v2.
+        self.last_index = 0
+        self.queue: queue.Queue[Union[UntrustedPage, BaseException]] = queue.Queue(
+            maxsize=queue_size
+        )
+        self.max_buffers_size = max_buffers_size
+        self.free_buffers: queue.Queue[bytearray] = queue.Queue()
+        # The number and total size of the buffers. They are accessed only by the
+        # reader thread.
+        self.num_buffers = 0
+        self.buffers_size = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read_pages, daemon=True)
+
+    def __enter__(self) -> "PageReader":
+        self.thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        # If the consumer has stopped early, the reader may be waiting for room in
+        # the queue, so we have to tell it to stop. If it's blocked on I/O, it will
+        # stop once the conversion process is terminated.
+        self.stopped.set()
+        if exc_type is None:
+            self.thread.join()
+
+    def __iter__(self) -> Iterator[UntrustedPage]:
+        for _ in range(self.n_pages):
+            start = time.perf_counter()
+            item = self.queue.get()
+            self.stats.convert_starved_time += time.perf_counter() - start
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+            # The host has asked for the next page, so the reader can reuse the
+            # buffer of this one.
+            self.free_buffers.put(item.buffer)
+
+    def _put(self, item: Union[UntrustedPage, BaseException]) -> None:
+        start = time.perf_counter()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=STOP_CHECK_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        self.stats.read_blocked_time += time.perf_counter() - start
+
+    def _can_allocate(self, size: int) -> bool:
+        return (
+            self.num_buffers < MIN_PAGE_BUFFERS
+            or self.buffers_size + size <= self.max_buffers_size
+        )
+
+    def _get_buffer(self, size: int) -> bytearray:
+        """Get a buffer that can hold at least `size` bytes.
+
+        Reuse a free buffer, if there is one, or else allocate a new buffer, if it
+        fits in the size limit. Otherwise, wait until the host is done with a page.
+        """
+        start = time.perf_counter()
+        while True:
+            can_allocate = self._can_allocate(size)
+            try:
+                buffer = self.free_buffers.get(
+                    block=not can_allocate, timeout=STOP_CHECK_INTERVAL
+                )
+            except queue.Empty:
+                if self.stopped.is_set():
+                    raise ReaderStopped()
+                if not can_allocate:
+                    continue
+                buffer = bytearray()
+                self.num_buffers += 1
+            if len(buffer) >= size:
+                break
+            # The buffer is too small for this page, so we have to replace it with a
+            # larger one. If the larger one does not fit in the size limit, drop it
+            # altogether, and wait for another one.
+            self.num_buffers -= 1
+            self.buffers_size -= len(buffer)
+            if self._can_allocate(size):
+                # Allocate a new buffer, instead of resizing the existing one, since
+                # there may still be views into it.
+                buffer = bytearray(size)
+                self.num_buffers += 1
+                self.buffers_size += size
+                break
+        self.stats.read_blocked_time += time.perf_counter() - start
+        return buffer
+
+    def _read_dimensions(self) -> Tuple[int, int]:
+        width = read_int(self.f)
+        height = read_int(self.f)
+        if not (1 <= width <= errors.MAX_PAGE_WIDTH):
+            raise errors.MaxPageWidthException()
+        if not (1 <= height <= errors.MAX_PAGE_HEIGHT):
+            raise errors.MaxPageHeightException()
+        return width, height
+
+    def _read_dpi(self) -> int:
+        dpi = read_int(self.f)
+        if not (1 <= dpi <= errors.MAX_PAGE_DPI):
+            raise errors.PageDPIException()
+        return dpi
+
+    def _read_page(self, number: int) -> UntrustedPage:
+        if self.protocol == PROTOCOL_V2:
+            return self._read_page_v2(number)
+
+        # Protocol v1 has no DPI, since every page is rendered at the default one.
+        width, height = self._read_dimensions()
+        num_pixels = width * height * 3  # three color channels
+        buffer = self._get_buffer(num_pixels)
+        untrusted_pixels = memoryview(buffer)[:num_pixels]
+        read_into(self.f, untrusted_pixels)
+        self.stats.read_bytes += 2 * INT_BYTES + num_pixels
+        return UntrustedPage(
+            number, width, height, DEFAULT_DPI, untrusted_pixels, buffer
+        )
+
+    def _read_page_v2(self, number: int) -> UntrustedPage:
+        """Read a page whose pixels may be packed and compressed.
+
+        The pixels are decoded within the size limits of the page, and a page that
+        claims more or fewer pixels than its dimensions allow fails the conversion.
+        """
+        index = read_int(self.f)
+        if index == 0 and self.session:
+            read_document_status(self.f)
+            # The document was converted, but some of its pages are missing.
+            raise errors.ProtocolException()
+        # The pages are sent in the order they appear in the document.
+        if index <= self.last_index:
+            raise errors.ProtocolException()
+        self.last_index = index
+        width, height = self._read_dimensions()
+        dpi = self._read_dpi()
+        pixel_format = read_int(self.f)
+        compression = read_int(self.f)
+        length = read_int(self.f, LENGTH_BYTES)
+        if pixel_format not in PIXEL_FORMATS:
+            raise errors.ProtocolException()
+        if compression not in COMPRESSIONS.values():
+            raise errors.ProtocolException()
+        size = pixels_size(pixel_format, width, height)
+        if length != size if compression == COMPRESSION_NONE else length >= size:
+            raise errors.ProtocolException()
+
+        channels = 3 if pixel_format == PIXEL_FORMAT_RGB else 1
+        num_pixels = width * height * channels
+        buffer = self._get_buffer(num_pixels)
+        untrusted_pixels = memoryview(buffer)[:num_pixels]
+        if compression == COMPRESSION_NONE and pixel_format != PIXEL_FORMAT_BILEVEL:
+            read_into(self.f, untrusted_pixels)
+        else:
+            untrusted_payload = read_bytes(self.f, length)
+            if compression != COMPRESSION_NONE:
+                decompressed = decompress_pixels(untrusted_payload, size)
+                if decompressed is None:
+                    raise errors.ProtocolException()
+                untrusted_payload = decompressed
+            if pixel_format == PIXEL_FORMAT_BILEVEL:
+                untrusted_payload = unpack_bilevel(untrusted_payload, width, height)
+            untrusted_pixels[:] = untrusted_payload
+        self.stats.read_bytes += 6 * INT_BYTES + LENGTH_BYTES + length
+        return UntrustedPage(
+            number, width, height, dpi, untrusted_pixels, buffer, channels
+        )
+
+    def _read_pages(self) -> None:
+        try:
+            for number in range(1, self.n_pages + 1):
+                start = time.perf_counter()
+                blocked_time = self.stats.read_blocked_time
+                page = self._read_page(number)
+                # Do not count the time we waited for a free buffer as read time.
+                blocked_time = self.stats.read_blocked_time - blocked_time
+                self.stats.read_time += time.perf_counter() - start - blocked_time
+                self._put(page)
+        except BaseException as e:
+            self._put(e)
+
+
+@dataclass
+class ConversionSession:
+    """The documents that a conversion process converts, one after the other."""
+
+    documents: List[Document]
+    # The timings of the stages of every document in the sandbox.
+    timings: List[StageTimings] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.timings = [StageTimings() for _ in self.documents]
+
+    def get(self, number: Optional[int]) -> Optional[Tuple[Document, StageTimings]]:
+        """Get a document by its (1-based) number in the session, and its timings.
+
+        The events of a conversion process outside of a session carry no number, and
+        refer to its only document.
+        """
+        index = (number or 1) - 1
+        if not (0 <= index < len(self.documents)):
+            return None
+        return self.documents[index], self.timings[index]
+
+
 class IsolationProvider(ABC):
     """
     Abstracts an isolation provider
     """
 
-    def __init__(self, debug: bool = False) -> None:
+    def __init__(
+        self,
+        debug: bool = False,
+        ocr_workers: Optional[int] = None,
+        image_codec: Optional[str] = None,
+        image_quality: Optional[int] = None,
+        blank_page_threshold: Optional[float] = None,
+        ocr_cache: Optional[bool] = None,
+        render_workers: Optional[int] = None,
+        libreoffice_listener: Optional[bool] = None,
+        dpi_profile: Optional[str] = None,
+        pixel_budget: Optional[int] = None,
+        page_compression: Optional[str] = None,
+        metrics_sink: Optional[Callable[[Document, ConversionEvent], None]] = None,
+        session_size: Optional[int] = None,
+        parallel_conversions: Optional[int] = None,
+    ) -> None:
         self.debug = debug
-        if self.should_capture_stderr():
-            self.proc_stderr = subprocess.PIPE
-        else:
-            self.proc_stderr = subprocess.DEVNULL
+        # Options that are not given fall back to their settings.
+        settings = Settings()
+        if ocr_workers is None:
+            ocr_workers = settings.get("ocr_workers")
+        self.ocr_workers = get_ocr_workers(ocr_workers)
+        self.image_codec: str = image_codec or settings.get("image_codec")
+        self.image_quality: int = image_quality or settings.get("image_quality")
+        if blank_page_threshold is None:
+            blank_page_threshold = settings.get("blank_page_threshold")
+        self.blank_page_threshold: float = blank_page_threshold
+        if ocr_cache is None:
+            ocr_cache = settings.get("ocr_cache")
+        self.ocr_cache: bool = ocr_cache
+        self.ocr_cache_max_size: int = settings.get("ocr_cache_max_size")
+        # The number of processes that render pages in the sandbox, or None to let
+        # the sandbox decide.
+        self.render_workers: Optional[int] = render_workers or settings.get(
+            "render_workers"
+        )
+        if libreoffice_listener is None:
+            libreoffice_listener = settings.get("libreoffice_listener")
+        self.libreoffice_listener: bool = libreoffice_listener
+        # How the sandbox chooses the DPI of every page, and the max number of pixels
+        # of a page, or None to use the one of the DPI profile.
+        self.dpi_profile: str = dpi_profile or settings.get("dpi_profile")
+        self.pixel_budget: Optional[int] = pixel_budget or settings.get("pixel_budget")
+        # The protocol with which the sandbox sends pages to the host, and how it
+        # compresses their pixels.
+        self.protocol = PROTOCOL_V2
+        self.page_compression: str = (
+            page_compression
+            or settings.get("page_compression")
+            or self.default_page_compression()
+        )
+        # The OCR engines of every language that has been used so far. They are
+        # shared by all the documents that this provider converts, until they are
+        # closed.
+        self.ocr_engines: Dict[str, OCREngine] = {}
+        self.ocr_engines_lock = threading.Lock()
+        # Receives the progress events of the sandbox, as they arrive.
+        self.metrics_sink = metrics_sink
+        # The max number of documents that a single sandbox converts, one after the
+        # other.
+        self.session_size: int = session_size or settings.get("session_size")
+        # The max number of documents to convert in parallel, or None to let the
+        # isolation provider decide.
+        self.parallel_conversions: Optional[int] = parallel_conversions or settings.get(
+            "parallel_conversions"
+        )
+        # The progress callback of every document that is being converted. Documents
+        # may be converted in parallel, so each one reports its progress to its own
+        # callback, falling back to this one.
+        self.progress_callback: Optional[Callable] = None
+        self.progress_callbacks: Dict[str, Optional[Callable]] = {}
+        # The standard error of the sandbox carries its progress events, so it's
+        # always read, even if its debug output is not kept.
+        self.proc_stderr = subprocess.PIPE
+
+    def default_page_compression(self) -> str:
+        """Compress pages only when the link to the sandbox is slow, e.g., a VM."""
+        return "none"
 
     def should_capture_stderr(self) -> bool:
         return self.debug or getattr(sys, "dangerzone_dev", False)
 
+    def get_session_size(self) -> int:
+        return self.session_size
+
+    def group_documents(self, documents: List[Document]) -> List[List[Document]]:
+        """Split documents into sessions, keeping their order.
+
+        The documents of a session share the conversion process, so they must share
+        the options that it starts with as well, e.g., the pages to convert.
+        """
+        sessions: List[List[Document]] = []
+        for document in documents:
+            if (
+                sessions
+                and len(sessions[-1]) < self.get_session_size()
+                and self.get_conversion_env(document)
+                == self.get_conversion_env(sessions[-1][0])
+            ):
+                sessions[-1].append(document)
+            else:
+                sessions.append([document])
+        return sessions
+
     def convert(
         self,
         document: Document,
         ocr_lang: Optional[str],
         progress_callback: Optional[Callable] = None,
     ) -> None:
-        self.progress_callback = progress_callback
+        self.progress_callbacks[document.id] = progress_callback
+        if document.preview:
+            # Previews are meant to be quick, so they are never OCRed.
+            ocr_lang = None
         document.mark_as_converting()
         try:
             with self.doc_to_pixels_proc(document) as conversion_proc:
@@ -117,101 +722,300 @@ class IsolationProvider(ABC):
             )
             self.print_progress(document, True, str(e), 0)
             document.mark_as_failed()
+        self.progress_callbacks.pop(document.id, None)
+
+    def convert_session(
+        self,
+        documents: List[Document],
+        ocr_lang: Optional[str],
+        progress_callback: Optional[Callable] = None,
+    ) -> None:
+        """Convert documents one after the other, in as few conversion processes as
+        the session size allows.
+
+        The conversion process reports the failure of every document separately, and
+        moves on to the next one. If the host can no longer trust the state of the
+        conversion process, e.g., because it sent a malformed page, the process is
+        torn down, and a new one converts the rest of the documents.
+        """
+        for document in documents:
+            self.progress_callbacks[document.id] = progress_callback
+        pending = list(documents)
+        while pending:
+            session = ConversionSession(pending[: self.get_session_size()])
+            # The document that fails if the conversion process does, and the number
+            # of documents that the session has got to.
+            document = session.documents[0]
+            started = 0
+            try:
+                with self.doc_to_pixels_proc(document, session=session) as p:
+                    for document in session.documents:
+                        started += 1
+                        self.convert_in_session(document, ocr_lang, p)
+                    # Closing the standard input ends the session, and the conversion
+                    # process exits.
+                    assert p.stdin is not None
+                    p.stdin.close()
+                    with contextlib.suppress(subprocess.TimeoutExpired):
+                        p.wait(TIMEOUT_GRACE)
+            except errors.ConversionException as e:
+                self.fail_session_document(document, str(e))
+            except Exception as e:
+                log.exception(
+                    f"An exception occurred while converting document '{document.id}'"
+                )
+                self.fail_session_document(document, str(e))
+            pending = pending[max(started, 1) :]
+        for document in documents:
+            self.progress_callbacks.pop(document.id, None)
+
+    def fail_session_document(self, document: Document, error: str) -> None:
+        """Fail the document that a session has got to, if it's not safe already.
+
+        The session may fail after its last document has been converted, e.g., while
+        the conversion process exits, in which case no document fails.
+        """
+        if document.is_safe():
+            log.warning(f"The conversion session failed after document '{document.id}'")
+            return
+        self.print_progress(document, True, error, 0)
+        document.mark_as_failed()
+
+    def convert_in_session(
+        self, document: Document, ocr_lang: Optional[str], p: subprocess.Popen
+    ) -> None:
+        """Convert a document with the conversion process of a session."""
+        if document.preview:
+            # Previews are meant to be quick, so they are never OCRed.
+            ocr_lang = None
+        document.mark_as_converting()
+        try:
+            self.convert_with_proc(document, ocr_lang, p, session=True)
+        except DocumentFailed as e:
+            self.print_progress(document, True, str(e), 0)
+            document.mark_as_failed()
+            return
+        document.mark_as_safe()
+        if document.archive_after_conversion:
+            document.archive()
 
     def ocr_page(self, pixmap: fitz.Pixmap, ocr_lang: str) -> bytes:
         """Get a single page as pixels, OCR it, and return a PDF as bytes."""
-        return pixmap.pdfocr_tobytes(
-            compress=True,
-            language=ocr_lang,
-            tessdata=str(get_tessdata_dir()),
+        return ocr_pixmap(
+            pixmap,
+            ocr_lang,
+            str(get_tessdata_dir()),
+            self.image_codec,
+            self.image_quality,
         )
 
-    def pixels_to_pdf_page(
+    def start_ocr_cache(self, ocr_lang: Optional[str]) -> Optional[OCRCache]:
+        """Open the OCR cache, if the document will be OCRed and the cache is enabled."""
+        if not ocr_lang or not self.ocr_cache:
+            return None
+        return OCRCache(
+            self.ocr_cache_max_size,
+            ocr_lang,
+            str(get_tessdata_dir()),
+            self.image_codec,
+            self.image_quality,
+        )
+
+    def get_ocr_engine(self, ocr_lang: str) -> OCREngine:
+        """Get the OCR engine for a language, and start it if it's not running."""
+        with self.ocr_engines_lock:
+            engine = self.ocr_engines.get(ocr_lang)
+            if engine is None:
+                engine = OCREngine(
+                    self.ocr_workers,
+                    ocr_lang,
+                    str(get_tessdata_dir()),
+                    self.image_codec,
+                    self.image_quality,
+                )
+                self.ocr_engines[ocr_lang] = engine
+            return engine
+
+    def close_ocr_engines(self) -> None:
+        """Stop the workers of every OCR engine."""
+        with self.ocr_engines_lock:
+            engines = list(self.ocr_engines.values())
+            self.ocr_engines.clear()
+        for engine in engines:
+            engine.close()
+
+    def start_ocr_pool(
         self,
-        untrusted_data: bytes,
-        untrusted_width: int,
-        untrusted_height: int,
         ocr_lang: Optional[str],
-    ) -> fitz.Document:
-        """Convert a byte array of RGB pixels into a PDF page, optionally with OCR."""
-        pixmap = fitz.Pixmap(
-            fitz.Colorspace(fitz.CS_RGB),
-            untrusted_width,
-            untrusted_height,
-            untrusted_data,
-            False,
+        n_pages: int,
+        ocr_cache: Optional[OCRCache] = None,
+    ) -> Optional[OCRPool]:
+        """Start an OCR pool for a document, if OCR can run on more than one page."""
+        workers = min(self.ocr_workers, n_pages)
+        if not ocr_lang or workers < 2:
+            return None
+        return OCRPool(self.get_ocr_engine(ocr_lang), ocr_cache)
+
+    def convert_page(
+        self,
+        page: UntrustedPage,
+        ocr_lang: Optional[str],
+        safe_doc: SafePDFWriter,
+        ocr_pool: Optional[OCRPool],
+        stats: ConversionStats,
+        ocr_cache: Optional[OCRCache] = None,
+    ) -> None:
+        """Convert the pixels of a page, and add it to the safe PDF.
+
+        If there's an OCR pool, the page is queued there instead, and it's up to the
+        caller to add it to the safe PDF, once the pool returns it.
+        """
+        pixmap = pixels_to_pixmap(
+            page.pixels, page.width, page.height, page.dpi, page.channels
         )
-        pixmap.set_dpi(DEFAULT_DPI, DEFAULT_DPI)
+        blank_color = find_blank_color(pixmap, self.blank_page_threshold)
+        if blank_color is not None:
+            # Blank pages have nothing to OCR or compress, so we replace them with a
+            # page of their background color.
+            stats.blank_pages += 1
+            if ocr_pool is not None:
+                # Pass the page through the pool as well, to keep the page order.
+                page_doc = fitz.Document()
+                insert_blank_page(page_doc, pixmap, blank_color)
+                ocr_pool.add(page_doc.tobytes())
+            else:
+                safe_doc.insert_blank_page(pixmap, blank_color)
+            return
 
-        if ocr_lang:  # OCR the document
-            page_pdf_bytes = self.ocr_page(pixmap, ocr_lang)
-        else:  # Don't OCR
-            page_doc = fitz.Document()
-            page_doc.insert_file(pixmap)
-            page_pdf_bytes = page_doc.tobytes(deflate_images=True)
+        # Pages without colors are stored with a single channel, and are OCRed as
+        # grayscale, which is smaller and faster. The conversion process may have
+        # sent them with a single channel already.
+        if pixmap.n == 3:
+            pixmap = to_grayscale(pixmap) or pixmap
+        if pixmap.n == 1:
+            stats.grayscale_pages += 1
 
-        return fitz.open("pdf", page_pdf_bytes)
+        if ocr_pool is not None:
+            ocr_pool.submit(
+                pixmap.samples,
+                page.width,
+                page.height,
+                grayscale=pixmap.n == 1,
+                untrusted_dpi=page.dpi,
+            )
+        elif ocr_lang:
+            cache_key = None
+            page_pdf = None
+            if ocr_cache is not None:
+                cache_key = ocr_cache.key(
+                    pixmap.samples, page.width, page.height, pixmap.n == 1, page.dpi
+                )
+                page_pdf = ocr_cache.get(cache_key)
+            if page_pdf is None:
+                page_pdf = self.ocr_page(pixmap, ocr_lang)
+                if ocr_cache is not None and cache_key is not None:
+                    ocr_cache.put(cache_key, page_pdf)
+            safe_doc.insert_pdf(fitz.open("pdf", page_pdf))
+        else:
+            # Without OCR, add the pixels straight to the safe PDF, instead of
+            # creating a separate PDF for every page.
+            encode_start = time.perf_counter()
+            safe_doc.insert_pixmap(pixmap, self.image_codec, self.image_quality)
+            stats.encode_time += time.perf_counter() - encode_start
 
     def convert_with_proc(
         self,
         document: Document,
         ocr_lang: Optional[str],
         p: subprocess.Popen,
+        session: bool = False,
     ) -> None:
-        percentage = 0.0
         with open(document.input_filename, "rb") as f:
-            try:
-                assert p.stdin is not None
-                p.stdin.write(f.read())
-                p.stdin.close()
-            except BrokenPipeError:
-                raise errors.ConverterProcException()
+            assert p.stdin is not None
+            # In a session, the document is sent along with its size, so that the
+            # conversion process knows where it ends.
+            size = os.fstat(f.fileno()).st_size if session else None
+            writer = InputWriter(f, p.stdin, size)
+            writer.start()
 
             assert p.stdout
-            n_pages = read_int(p.stdout)
+            try:
+                protocol, n_pages = read_stream_header(p.stdout)
+            finally:
+                # The conversion process reads the whole document, before it sends
+                # anything back, so by now the writer has finished.
+                writer.join()
+            if session and protocol != PROTOCOL_V2:
+                raise errors.ProtocolException()
+            if session and n_pages == 0:
+                # The document failed before any of its pages were sent.
+                read_document_end(p.stdout)
             if n_pages == 0 or n_pages > errors.MAX_PAGES:
                 raise errors.MaxPagesException()
-            step = 100 / n_pages
 
-            safe_doc = fitz.Document()
+            stats = ConversionStats()
+            start = time.perf_counter()
+            ocr_cache = self.start_ocr_cache(ocr_lang)
+            ocr_pool = self.start_ocr_pool(ocr_lang, n_pages, ocr_cache)
+            reader = PageReader(
+                p.stdout, n_pages, stats, protocol=protocol, session=session
+            )
+            try:
+                with SafePDFWriter(document.output_filename) as safe_doc, reader:
 
-            for page in range(1, n_pages + 1):
-                searchable = "searchable " if ocr_lang else ""
-                text = (
-                    f"Converting page {page}/{n_pages} from pixels to {searchable}PDF"
-                )
-                self.print_progress(document, False, text, percentage)
-
-                width = read_int(p.stdout)
-                height = read_int(p.stdout)
-                if not (1 <= width <= errors.MAX_PAGE_WIDTH):
-                    raise errors.MaxPageWidthException()
-                if not (1 <= height <= errors.MAX_PAGE_HEIGHT):
-                    raise errors.MaxPageHeightException()
-
-                num_pixels = width * height * 3  # three color channels
-                untrusted_pixels = read_bytes(
-                    p.stdout,
-                    num_pixels,
-                )
+                    def insert_ocr_page() -> None:
+                        assert ocr_pool is not None
+                        safe_doc.insert_pdf(fitz.open("pdf", ocr_pool.pop()))
 
-                page_pdf = self.pixels_to_pdf_page(
-                    untrusted_pixels,
-                    width,
-                    height,
-                    ocr_lang,
-                )
-                safe_doc.insert_pdf(page_pdf)
+                    for page in reader:
+                        # Report the progress based on the pages that have been added
+                        # to the safe PDF, since OCR workers may finish out of order.
+                        percentage = safe_doc.page_count * 100 / n_pages
+                        searchable = "searchable " if ocr_lang else ""
+                        text = (
+                            f"Converting page {page.number}/{n_pages} from pixels to"
+                            f" {searchable}PDF"
+                        )
+                        self.print_progress(document, False, text, percentage)
+
+                        convert_start = time.perf_counter()
+                        self.convert_page(
+                            page, ocr_lang, safe_doc, ocr_pool, stats, ocr_cache
+                        )
+                        while ocr_pool is not None and ocr_pool.is_full():
+                            insert_ocr_page()
+                        stats.convert_time += time.perf_counter() - convert_start
 
-                percentage += step
+                    convert_start = time.perf_counter()
+                    while ocr_pool is not None and len(ocr_pool) > 0:
+                        insert_ocr_page()
+                    stats.convert_time += time.perf_counter() - convert_start
 
-        # Ensure nothing else is read after all bitmaps are obtained
-        p.stdout.close()
+                    # The document may still fail after its last page, in which case
+                    # the safe PDF is discarded.
+                    if session:
+                        read_document_end(p.stdout)
 
-        # Saving it with a different name first, because PyMuPDF cannot handle
-        # non-Unicode chars.
-        safe_doc.save(document.sanitized_output_filename)
-        os.replace(document.sanitized_output_filename, document.output_filename)
+                if not session:
+                    # Ensure nothing else is read after all bitmaps are obtained
+                    p.stdout.close()
+            finally:
+                if ocr_pool is not None:
+                    ocr_pool.close()
+
+        stats.total_time = time.perf_counter() - start
+        stats.encode_time += safe_doc.write_time
+        log.info(f"[doc {document.id}] Host-side stage timings: {stats.summary()}")
+        output_size = os.path.getsize(document.output_filename)
+        image_codec = self.image_codec
+        if image_codec != "lossless":
+            image_codec += f", quality {self.image_quality}"
+        log.info(
+            f"[doc {document.id}] Safe PDF is {output_size / 1024:,.1f} KiB"
+            f" ({image_codec}), encoded and written in {stats.encode_time:.2f}s"
+        )
+        if ocr_cache is not None:
+            log.info(f"[doc {document.id}] {ocr_cache.summary()}")
 
         # TODO handle leftover code input
         text = "Successfully converted document"
@@ -229,8 +1033,9 @@ class IsolationProvider(ABC):
             s += text
             log.info(s)
 
-        if self.progress_callback:
-            self.progress_callback(error, text, percentage)
+        callback = self.progress_callbacks.get(document.id, self.progress_callback)
+        if callback:
+            callback(error, text, percentage)
 
     def get_proc_exception(
         self, p: subprocess.Popen, timeout: int = TIMEOUT_EXCEPTION
@@ -251,6 +1056,31 @@ class IsolationProvider(ABC):
             )
         return errors.exception_from_error_code(error_code)
 
+    def get_conversion_env(
+        self, document: Document, session: bool = False
+    ) -> Dict[str, str]:
+        """Get the environment variables that configure the conversion of a document,
+        or of a session that starts with it."""
+        env = {}
+        if self.render_workers:
+            env[RENDER_WORKERS_ENV] = str(self.render_workers)
+        if self.libreoffice_listener:
+            env[LIBREOFFICE_LISTENER_ENV] = "1"
+        if document.preview:
+            env[DPI_PROFILE_ENV] = "preview"
+        else:
+            env[DPI_PROFILE_ENV] = self.dpi_profile
+            if self.pixel_budget:
+                env[PIXEL_BUDGET_ENV] = str(self.pixel_budget)
+        if document.pages:
+            env[PAGES_ENV] = document.pages
+        if session:
+            env[SESSION_ENV] = "1"
+        env[PROTOCOL_ENV] = str(self.protocol)
+        env[EVENTS_ENV] = "1"
+        env[COMPRESSION_ENV] = self.page_compression
+        return env
+
     @abstractmethod
     def requires_install(self) -> bool:
         """Whether this isolation provider needs an installation step"""
@@ -261,7 +1091,9 @@ class IsolationProvider(ABC):
         pass
 
     @abstractmethod
-    def start_doc_to_pixels_proc(self, document: Document) -> subprocess.Popen:
+    def start_doc_to_pixels_proc(
+        self, document: Document, session: bool = False
+    ) -> subprocess.Popen:
         pass
 
     @abstractmethod
@@ -318,12 +1150,18 @@ class IsolationProvider(ABC):
         timeout_exception: int = TIMEOUT_EXCEPTION,
         timeout_grace: int = TIMEOUT_GRACE,
         timeout_force: int = TIMEOUT_FORCE,
+        session: Optional[ConversionSession] = None,
     ) -> Iterator[subprocess.Popen]:
-        """Start a conversion process, pass it to the caller, and then clean it up."""
+        """Start a conversion process, pass it to the caller, and then clean it up.
+
+        In a session, the conversion process converts the documents of the session,
+        and is named after the first one.
+        """
         # Store the proc stderr in memory
         stderr = BytesIO()
-        p = self.start_doc_to_pixels_proc(document)
-        stderr_thread = self.start_stderr_thread(p, stderr)
+        p = self.start_doc_to_pixels_proc(document, session=session is not None)
+        session = session or ConversionSession([document])
+        stderr_thread = self.start_stderr_thread(p, stderr, session)
 
         if platform.system() != "Windows":
             assert os.getpgid(p.pid) != os.getpgid(os.getpid()), (
@@ -344,6 +1182,13 @@ class IsolationProvider(ABC):
                 # Wait for the thread to complete. If it's still alive, mention it in the debug log.
                 stderr_thread.join(timeout=1)
 
+            for doc, timings in zip(session.documents, session.timings):
+                if timings.starts:
+                    log.info(
+                        f"[doc {doc.id}] Sandbox stage timings: {timings.summary()}"
+                    )
+
+            if stderr_thread and self.should_capture_stderr():
                 debug_bytes = stderr.getvalue()
                 debug_log = sanitize_debug_text(debug_bytes)
 
@@ -356,15 +1201,51 @@ class IsolationProvider(ABC):
                     "----- DOC TO PIXELS LOG END -----"
                 )
 
+    def handle_event(
+        self, document: Document, event: ConversionEvent, timings: StageTimings
+    ) -> None:
+        """Report a progress event of the sandbox, as soon as it arrives."""
+        timings.add(event)
+        if self.metrics_sink is not None:
+            self.metrics_sink(document, event)
+        text = STAGE_TEXTS.get(event.stage)
+        if event.event == "start" and text:
+            # The sandbox reports the start of a stage before it sends any pages.
+            self.print_progress(document, False, text, 0)
+
     def start_stderr_thread(
-        self, process: subprocess.Popen, stderr: IO[bytes]
+        self,
+        process: subprocess.Popen,
+        stderr: IO[bytes],
+        session: Optional[ConversionSession] = None,
     ) -> Optional[threading.Thread]:
-        """Start a thread to read stderr from the process"""
+        """Start a thread to read stderr from the process.
+
+        Progress events are handled as they arrive, and the rest of the output is kept
+        only if it will be logged.
+        """
+        capture = self.should_capture_stderr()
 
         def _stream_stderr(process_stderr: IO[bytes]) -> None:
             try:
-                for line in process_stderr:
-                    stderr.write(line)
+                while True:
+                    # Never read a line that's longer than an event at once, so that
+                    # the sandbox cannot make us hold arbitrarily long lines.
+                    line = process_stderr.readline(MAX_EVENT_SIZE + 1)
+                    if not line:
+                        break
+                    event = parse_event(line)
+                    if event is not None and session is not None:
+                        try:
+                            target = session.get(event.document)
+                            if target is not None:
+                                self.handle_event(target[0], event, target[1])
+                        except Exception:
+                            # Keep reading, so that the sandbox never blocks on a
+                            # full pipe.
+                            log.exception("Could not handle a progress event")
+                    elif capture:
+                        stderr.write(line)
             except (ValueError, IOError) as e:
                 log.debug(f"Stderr stream closed: {e}")
 
@@ -4,10 +4,11 @@ import platform
 import shlex
 import subprocess
 import sys
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 from .. import container_utils, errors
-from ..container_utils import make_seccomp_json_accessible
+from ..container_utils import RuntimeResources, make_seccomp_json_accessible
+from ..conversion.render import RENDER_WORKERS_ENV
 from ..document import Document
 from ..podman.errors import CommandError
 from ..settings import Settings
@@ -32,10 +33,30 @@ if platform.system() == "Windows":
 else:
     startupinfo = None
 
+# The CPUs and memory that a single conversion needs, e.g., for LibreOffice, gVisor,
+# and the processes that render pages.
+CPUS_PER_CONVERSION = 2
+MEMORY_PER_CONVERSION = 1024**3
+# The host OCRs and writes the pages of every document that is being converted, so
+# parallel conversions are capped, no matter how large the machine is.
+MAX_PARALLEL_CONVERSIONS = 8
 
 log = logging.getLogger(__name__)
 
 
+def get_parallel_conversions(resources: RuntimeResources) -> int:
+    """Get how many documents to convert in parallel, based on the resources of the
+    containers."""
+    return max(
+        1,
+        min(
+            resources.cpus // CPUS_PER_CONVERSION,
+            resources.memory // MEMORY_PER_CONVERSION,
+            MAX_PARALLEL_CONVERSIONS,
+        ),
+    )
+
+
 class Container(IsolationProvider):
     @staticmethod
     def get_runtime_security_args() -> List[str]:
@@ -97,6 +118,7 @@ class Container(IsolationProvider):
         self,
         command: List[str],
         name: str,
+        env: Optional[Dict[str, str]] = None,
     ) -> subprocess.Popen:
         container_name = container_utils.expected_image_name()
         image_digest = container_utils.get_local_image_digest()
@@ -106,6 +128,11 @@ class Container(IsolationProvider):
         debug_args = []
         if self.debug:
             debug_args += ["-e", "RUNSC_DEBUG=1"]
+        env_args = []
+        for key, value in (env or {}).items():
+            env_args += ["-e", f"{key}={value}"]
+
+        resource_args = self.get_resource_args()
 
         enable_stdin = ["-i"]
         set_name = ["--name", name]
@@ -114,7 +141,9 @@ class Container(IsolationProvider):
         args = (
             ["run"]
             + security_args
+            + resource_args
             + debug_args
+            + env_args
             + prevent_leakage_args
             + enable_stdin
             + set_name
@@ -135,7 +164,9 @@ class Container(IsolationProvider):
         assert isinstance(proc, subprocess.Popen)
         return proc
 
-    def start_doc_to_pixels_proc(self, document: Document) -> subprocess.Popen:
+    def start_doc_to_pixels_proc(
+        self, document: Document, session: bool = False
+    ) -> subprocess.Popen:
         # Convert document to pixels
         command = [
             "/usr/bin/python3",
@@ -143,7 +174,8 @@ class Container(IsolationProvider):
             "dangerzone.conversion.doc_to_pixels",
         ]
         name = self.doc_to_pixels_container_name(document)
-        return self.exec_container(command, name=name)
+        env = self.get_conversion_env(document, session)
+        return self.exec_container(command, name=name, env=env)
 
     def terminate_doc_to_pixels_proc(
         self, document: Document, p: subprocess.Popen
@@ -192,7 +224,63 @@ class Container(IsolationProvider):
         if name in all_containers:
             log.warning(f"Container '{name}' did not stop gracefully")
 
+    def default_page_compression(self) -> str:
+        # On Windows and macOS, the pages cross the boundary of the Podman machine VM,
+        # which is much slower than a pipe.
+        if platform.system() in ("Windows", "Darwin"):
+            return "zlib"
+        return "none"
+
     def get_max_parallel_conversions(self) -> int:
-        # FIXME hardcoded 1 until length conversions are better handled
-        # https://github.com/freedomofpress/dangerzone/issues/257
-        return 1
+        if self.parallel_conversions:
+            return self.parallel_conversions
+        return get_parallel_conversions(container_utils.get_runtime_resources())
+
+    def get_container_limits(self) -> Tuple[Optional[int], Optional[int]]:
+        """Get the CPUs and memory of a container, or None if it's not limited.
+
+        When documents are converted in parallel, every container gets an even share
+        of the CPUs and memory, so that a large document cannot starve the rest.
+        Containers are never limited to less memory than a conversion needs, though.
+        """
+        settings = Settings()
+        cpus = settings.get("container_cpus")
+        memory = settings.get("container_memory")
+        parallel = self.get_max_parallel_conversions()
+        if parallel > 1:
+            resources = container_utils.get_runtime_resources()
+            cpus = cpus or max(resources.cpus // parallel, 1)
+            if resources.memory:
+                memory = memory or max(
+                    resources.memory // parallel, MEMORY_PER_CONVERSION
+                )
+        return cpus, memory
+
+    def get_resource_args(self) -> List[str]:
+        """Resource limits of a container, if the container runtime supports them."""
+        cpus, memory = self.get_container_limits()
+        if not cpus and not memory:
+            return []
+        resources = container_utils.get_runtime_resources()
+        args = []
+        if cpus and resources.can_limit_cpus:
+            args += ["--cpus", str(cpus)]
+        if memory and resources.can_limit_memory:
+            args += ["--memory", str(memory)]
+        if not args:
+            log.warning(
+                "The container runtime cannot limit the resources of containers, so"
+                " parallel conversions may slow each other down"
+            )
+        return args
+
+    def get_conversion_env(
+        self, document: Document, session: bool = False
+    ) -> Dict[str, str]:
+        env = super().get_conversion_env(document, session)
+        # Render as many pages in parallel as the CPUs of the container, instead of
+        # the CPUs of the machine.
+        cpus, _ = self.get_container_limits()
+        if cpus and RENDER_WORKERS_ENV not in env:
+            env[RENDER_WORKERS_ENV] = str(cpus)
+        return env
@@ -1,24 +1,111 @@
 import logging
+import os
 import subprocess
 import sys
-from typing import Callable, Optional
+from typing import Any, Callable, Optional
 
-from ..conversion.common import DangerzoneConverter
+from ..conversion import errors
+from ..conversion.common import (
+    DEFAULT_DPI,
+    DangerzoneConverter,
+    FrameWriter,
+    select_pages,
+)
+from ..conversion.events import EventWriter
+from ..conversion.protocol import (
+    encode_document_end,
+    encode_page,
+    encode_stream_header,
+    get_protocol,
+    session_enabled,
+)
+from ..conversion.render import PAGES_ENV
 from ..document import Document
 from .base import IsolationProvider, terminate_process_group
 
 log = logging.getLogger(__name__)
 
+# The pixel patterns of the pages that the Dummy provider sends. "solid" pages are
+# blank, "random" pages do not compress at all, "gray" pages are a gradient without
+# colors, and "text" pages are black lines on white, like a scanned document.
+DUMMY_PATTERNS = ["solid", "random", "gray", "text"]
 
-def dummy_script() -> None:
-    sys.stdin.buffer.read()
-    pages = 2
-    width = height = 9
-    DangerzoneConverter._write_int(pages)
-    for page in range(pages):
-        DangerzoneConverter._write_int(width)
-        DangerzoneConverter._write_int(height)
-        DangerzoneConverter._write_bytes(width * height * 3 * b"A")
+
+def dummy_pixels(pattern: str, width: int, height: int) -> bytes:
+    """Get the RGB pixels of a page with the given pattern."""
+    if pattern == "random":
+        return os.urandom(width * height * 3)
+    elif pattern == "gray":
+        row = bytes(x * 255 // max(width - 1, 1) for x in range(width) for _ in "rgb")
+        return row * height
+    elif pattern == "text":
+        # Words of 12 pixels, and lines of 8 pixels, every 24 pixels.
+        word = b"\x00" * 12 * 3 + b"\xff" * 4 * 3
+        line = (word * (width // 16 + 1))[: width * 3]
+        blank = b"\xff" * width * 3
+        rows = [line if y % 24 < 8 else blank for y in range(height)]
+        return b"".join(rows)
+    return width * height * 3 * b"A"
+
+
+def dummy_document(
+    writer: FrameWriter,
+    events: EventWriter,
+    pages: int,
+    width: int,
+    height: int,
+    pattern: str,
+) -> None:
+    """Send the pages of a document, as the conversion process does."""
+    protocol, compression = get_protocol()
+    selected_pages = select_pages(os.environ.get(PAGES_ENV), pages)
+    n_pages = len(selected_pages)
+    events.emit("start", "render", pages=n_pages)
+    writer._write(encode_stream_header(protocol, n_pages))
+    # Random pixels do not compress, so they are different for every page. The
+    # rest of the patterns are created once, so that creating them is not what
+    # benchmarks measure.
+    pixels = dummy_pixels(pattern, width, height)
+    for i, page in enumerate(selected_pages, start=1):
+        events.emit("page", "render", page=i, pages=n_pages)
+        if pattern == "random" and i > 1:
+            pixels = dummy_pixels(pattern, width, height)
+        writer._write(
+            *encode_page(
+                protocol, compression, page + 1, width, height, DEFAULT_DPI, pixels
+            )
+        )
+    events.emit("end", "render", pages=n_pages)
+
+
+def dummy_script(
+    pages: int = 2, width: int = 9, height: int = 9, pattern: str = "solid"
+) -> None:
+    writer = FrameWriter()
+    events = EventWriter()
+    if not session_enabled():
+        sys.stdin.buffer.read()
+        dummy_document(writer, events, pages, width, height, pattern)
+        return
+
+    # In a session, empty documents fail, so that we can check that the rest of the
+    # documents are not affected.
+    protocol, _ = get_protocol()
+    events.document = 0
+    while True:
+        size = DangerzoneConverter._read_document_length()
+        if size is None:
+            break
+        events.document += 1
+        DangerzoneConverter._read_to_file(os.devnull, size=size)
+        if size == 0:
+            error_code = errors.DocCorruptedException.error_code
+            writer._write(
+                encode_stream_header(protocol, 0) + encode_document_end(error_code)
+            )
+            continue
+        dummy_document(writer, events, pages, width, height, pattern)
+        writer._write(encode_document_end(0))
 
 
 class Dummy(IsolationProvider):
@@ -28,31 +115,48 @@ class Dummy(IsolationProvider):
     Useful for testing without the need to use docker.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        pages: int = 2,
+        width: int = 9,
+        height: int = 9,
+        pattern: str = "solid",
+        **kwargs: Any,
+    ) -> None:
         # Sanity check
         if not getattr(sys, "dangerzone_dev", False):
             raise Exception(
                 "Dummy isolation provider is UNSAFE and should never be "
                 + "called in a non-testing system."
             )
-        super().__init__()
+        if pattern not in DUMMY_PATTERNS:
+            raise ValueError(f"Unknown pixel pattern: {pattern}")
+        super().__init__(**kwargs)
+        self.pages = pages
+        self.width = width
+        self.height = height
+        self.pattern = pattern
 
     @staticmethod
     def requires_install() -> bool:
         return False
 
-    def start_doc_to_pixels_proc(self, document: Document) -> subprocess.Popen:
+    def start_doc_to_pixels_proc(
+        self, document: Document, session: bool = False
+    ) -> subprocess.Popen:
         cmd = [
             sys.executable,
             "-c",
             "from dangerzone.isolation_provider.dummy import dummy_script;"
-            " dummy_script()",
+            f" dummy_script({self.pages}, {self.width}, {self.height},"
+            f" {self.pattern!r})",
         ]
         return subprocess.Popen(
             cmd,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=self.proc_stderr,
+            env={**os.environ, **self.get_conversion_env(document, session)},
             start_new_session=True,
         )
 
@@ -62,4 +166,4 @@ class Dummy(IsolationProvider):
         terminate_process_group(p)
 
     def get_max_parallel_conversions(self) -> int:
-        return 1
+        return self.parallel_conversions or 1
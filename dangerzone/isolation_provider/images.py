@@ -0,0 +1,171 @@
+from typing import Optional, Tuple
+
+import fitz
+
+from ..conversion.protocol import pack_bilevel
+
+# The codecs with which the images of the safe PDF can be encoded:
+#
+# * lossless: Keep the exact pixels, compressed with Flate.
+# * jpeg: Encode the pixels as JPEG, which is much smaller for photos and scans,
+#   but introduces artifacts.
+# * auto: Pick one of the above for every page, based on its content.
+IMAGE_CODECS = ["lossless", "jpeg", "auto"]
+DEFAULT_IMAGE_CODEC = "lossless"
+DEFAULT_IMAGE_QUALITY = 85
+
+# With the "auto" codec, pages whose most common color covers less than this ratio
+# of the page are encoded as JPEG.
+AUTO_JPEG_MAX_BACKGROUND = 0.5
+
+# Number of pixels that we sample, in order to guess the background of a page.
+BACKGROUND_SAMPLES = 1000
+
+RGB = Tuple[int, int, int]
+WHITE: RGB = (255, 255, 255)
+
+
+def to_rgb(color: bytes) -> RGB:
+    """Get the RGB color of a pixel, which is either RGB or grayscale."""
+    if len(color) == 1:
+        return color[0], color[0], color[0]
+    return color[0], color[1], color[2]
+
+
+def to_grayscale(pixmap: fitz.Pixmap) -> Optional[fitz.Pixmap]:
+    """Convert an RGB pixmap to grayscale, if all of its pixels are gray."""
+    samples = pixmap.samples
+    red = samples[0::3]
+    if red != samples[1::3] or red != samples[2::3]:
+        return None
+    gray = fitz.Pixmap(
+        fitz.Colorspace(fitz.CS_GRAY), pixmap.width, pixmap.height, red, False
+    )
+    gray.set_dpi(pixmap.xres, pixmap.yres)
+    return gray
+
+
+def is_bilevel(pixmap: fitz.Pixmap) -> bool:
+    """Check if a pixmap is grayscale, and has only black and white pixels."""
+    return pixmap.n == 1 and not pixmap.samples.translate(None, b"\x00\xff")
+
+
+def pack_bits(pixmap: fitz.Pixmap) -> bytes:
+    """Pack the pixels of a black and white pixmap into one bit per pixel.
+
+    Each row starts at a new byte, as PDF images expect.
+    """
+    return pack_bilevel(pixmap.samples, pixmap.width)
+
+
+def estimate_background(pixmap: fitz.Pixmap) -> int:
+    """Estimate how many pixels of a page have its most common color.
+
+    Counting every color of a page is slow for photos, which have hundreds of
+    thousands of them. Instead, we look only at the green channel, which is the one
+    that contributes the most to brightness. We guess its most common value from a
+    sample of the pixels, and then count exactly how many pixels have it. This is an
+    upper bound of the pixels that have the background color.
+    """
+    green = pixmap.samples if pixmap.n == 1 else pixmap.samples[1::3]
+    sample = green[:: max(len(green) // BACKGROUND_SAMPLES, 1)]
+    value = max(set(sample), key=sample.count)
+    return green.count(value)
+
+
+def find_blank_color(pixmap: fitz.Pixmap, ink_threshold: float) -> Optional[RGB]:
+    """Return the background color of a blank page, or None if it's not blank.
+
+    A page is blank if the ratio of its pixels that differ from the background color
+    does not exceed the ink threshold.
+    """
+    num_pixels = pixmap.width * pixmap.height
+    max_ink = int(ink_threshold * num_pixels)
+    if max_ink == 0:
+        samples = pixmap.samples
+        if samples != samples[: pixmap.n] * num_pixels:
+            return None
+        return to_rgb(samples[: pixmap.n])
+
+    # If there are too many pixels without the background color, even by our
+    # estimate, the page is not blank.
+    if num_pixels - estimate_background(pixmap) > max_ink:
+        return None
+
+    # The page has very few colors, so counting them is fast.
+    ratio, color = pixmap.color_topusage()
+    if num_pixels - round(ratio * num_pixels) > max_ink:
+        return None
+    return to_rgb(color)
+
+
+def select_image_codec(pixmap: fitz.Pixmap, image_codec: str) -> str:
+    """Select how to encode the image of a page, either "lossless" or "jpeg"."""
+    if image_codec != "auto":
+        return image_codec
+    # Text and line art usually have a background color that covers most of the
+    # page. These pages compress well without any loss, whereas JPEG would blur
+    # their edges. Photos and scans have no such color, and compress much better as
+    # JPEG.
+    background = estimate_background(pixmap) / (pixmap.width * pixmap.height)
+    return "jpeg" if background < AUTO_JPEG_MAX_BACKGROUND else "lossless"
+
+
+def encode_jpeg(pixmap: fitz.Pixmap, image_quality: int) -> bytes:
+    return pixmap.tobytes("jpeg", jpg_quality=image_quality)
+
+
+def new_page(doc: fitz.Document, pixmap: fitz.Pixmap) -> fitz.Page:
+    """Append an empty page with the same size as a pixmap, based on its DPI."""
+    width = pixmap.width * 72 / pixmap.xres
+    height = pixmap.height * 72 / pixmap.yres
+    return doc.new_page(width=width, height=height)
+
+
+def insert_blank_page(doc: fitz.Document, pixmap: fitz.Pixmap, color: RGB) -> None:
+    """Append a page of a single color, with the same size as a pixmap."""
+    page = new_page(doc, pixmap)
+    if color != WHITE:
+        fill = [c / 255 for c in color]
+        page.draw_rect(page.rect, color=None, fill=fill, width=0)
+
+
+def insert_image_page(
+    doc: fitz.Document, pixmap: fitz.Pixmap, image_codec: str, image_quality: int
+) -> None:
+    """Append a page to a document, that consists of a single image.
+
+    The page has the same size as the image. The image is either encoded as JPEG
+    right away, or is kept as raw pixels, which are compressed losslessly when the
+    document is saved. Black and white images are stored with one bit per pixel.
+    """
+    page = new_page(doc, pixmap)
+    if select_image_codec(pixmap, image_codec) == "jpeg":
+        page.insert_image(page.rect, stream=encode_jpeg(pixmap, image_quality))
+    elif is_bilevel(pixmap):
+        # MuPDF cannot create 1-bit images, so we replace the pixels of the image
+        # with packed ones.
+        xref = page.insert_image(page.rect, pixmap=pixmap)
+        doc.update_stream(xref, pack_bits(pixmap))
+        doc.xref_set_key(xref, "BitsPerComponent", "1")
+        doc.xref_set_key(xref, "ColorSpace", "/DeviceGray")
+        doc.xref_set_key(xref, "DecodeParms", "null")
+    else:
+        page.insert_image(page.rect, pixmap=pixmap)
+
+
+def reencode_as_jpeg(
+    doc: fitz.Document, pixmap: fitz.Pixmap, image_quality: int
+) -> None:
+    """Re-encode as JPEG the image of a single-page PDF that was created from a pixmap.
+
+    This is useful for pages that are created by MuPDF itself, e.g., searchable PDF
+    pages, which always keep their images lossless.
+    """
+    jpeg = encode_jpeg(pixmap, image_quality)
+    for xref, _, width, height, *_ in doc[0].get_images():
+        if (width, height) != (pixmap.width, pixmap.height):
+            continue
+        doc.update_stream(xref, jpeg, compress=0)
+        doc.xref_set_key(xref, "Filter", "/DCTDecode")
+        doc.xref_set_key(xref, "DecodeParms", "null")
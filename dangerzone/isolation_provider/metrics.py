@@ -0,0 +1,118 @@
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ..conversion import errors
+from ..conversion.events import EVENT_PREFIX, EVENT_TYPES, MAX_EVENT_SIZE, STAGES
+
+# The progress text of the stages of a conversion, which the host shows once they
+# start. It's never taken from the sandbox.
+STAGE_TEXTS = {
+    "mime": "Detecting the format of the document",
+    "libreoffice": "Converting to PDF using LibreOffice",
+    "render": "Converting document to pixels",
+}
+# Max timestamp of an event, in seconds since the conversion process started.
+MAX_EVENT_TIME = 7 * 24 * 3600
+
+
+@dataclass
+class ConversionEvent:
+    """A progress event, as sent by the conversion process.
+
+    The fields have been validated, but their values still come from the conversion
+    process, so they should be treated as untrusted.
+    """
+
+    event: str
+    stage: str
+    # Seconds since the conversion process started, as reported by it.
+    time: float
+    # When the host received the event, as a monotonic timestamp.
+    received: float
+    page: Optional[int] = None
+    pages: Optional[int] = None
+    # The number of the document in a session, starting from 1.
+    document: Optional[int] = None
+
+
+def _parse_count(value: object) -> Optional[int]:
+    if value is None:
+        return None
+    if type(value) is not int or not (0 <= value <= errors.MAX_PAGES):
+        raise ValueError("Invalid page count")
+    return value
+
+
+def parse_event(untrusted_line: bytes) -> Optional[ConversionEvent]:
+    """Parse a line of the conversion output, if it's an event.
+
+    Return None if the line is not an event, or is not a valid one.
+    """
+    if len(untrusted_line) > MAX_EVENT_SIZE or not untrusted_line.startswith(
+        EVENT_PREFIX
+    ):
+        return None
+    try:
+        record = json.loads(untrusted_line[len(EVENT_PREFIX) :])
+        if not isinstance(record, dict):
+            return None
+        event = record.get("event")
+        stage = record.get("stage")
+        if event not in EVENT_TYPES or stage not in STAGES:
+            return None
+        timestamp = record.get("time")
+        if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)):
+            return None
+        if not (0 <= timestamp <= MAX_EVENT_TIME):
+            return None
+        return ConversionEvent(
+            event,
+            stage,
+            float(timestamp),
+            time.monotonic(),
+            page=_parse_count(record.get("page")),
+            pages=_parse_count(record.get("pages")),
+            document=_parse_count(record.get("document")),
+        )
+    except (ValueError, RecursionError):
+        return None
+
+
+@dataclass
+class StageTimings:
+    """Collect how long each stage of a conversion took in the sandbox."""
+
+    starts: Dict[str, float] = field(default_factory=dict)
+    durations: Dict[str, float] = field(default_factory=dict)
+    pages: int = 0
+    # The time between the rendering of consecutive pages.
+    page_times: List[float] = field(default_factory=list)
+    last_page: Optional[float] = None
+
+    def add(self, event: ConversionEvent) -> None:
+        if event.event == "start":
+            self.starts[event.stage] = event.time
+            if event.stage == "render":
+                self.last_page = event.time
+        elif event.event == "end" and event.stage in self.starts:
+            self.durations[event.stage] = event.time - self.starts[event.stage]
+        elif event.event == "page":
+            self.pages += 1
+            if self.last_page is not None:
+                self.page_times.append(event.time - self.last_page)
+            self.last_page = event.time
+
+    def summary(self) -> str:
+        parts = [
+            f"{stage} {self.durations[stage]:.2f}s"
+            for stage in STAGES
+            if stage in self.durations
+        ]
+        if self.page_times:
+            slowest = max(self.page_times)
+            parts.append(
+                f"{self.pages} page(s), slowest page took {slowest:.2f}s to render"
+            )
+        return ", ".join(parts) or "no events"
@@ -0,0 +1,221 @@
+import concurrent.futures
+import multiprocessing
+import os
+from collections import deque
+from typing import Deque, Optional
+
+import fitz
+
+from ..conversion.common import DEFAULT_DPI
+from .images import (
+    DEFAULT_IMAGE_CODEC,
+    DEFAULT_IMAGE_QUALITY,
+    reencode_as_jpeg,
+    select_image_codec,
+)
+from .ocr_cache import OCRCache
+
+
+def get_ocr_workers(ocr_workers: Optional[int] = None) -> int:
+    """Get the number of OCR worker processes, defaulting to one per CPU core."""
+    if ocr_workers:
+        return ocr_workers
+    return os.cpu_count() or 1
+
+
+def ocr_pixmap(
+    pixmap: fitz.Pixmap,
+    ocr_lang: str,
+    tessdata: str,
+    image_codec: str = DEFAULT_IMAGE_CODEC,
+    image_quality: int = DEFAULT_IMAGE_QUALITY,
+) -> bytes:
+    """OCR a pixmap, and return a searchable PDF page as bytes."""
+    page_pdf_bytes = pixmap.pdfocr_tobytes(
+        compress=True,
+        language=ocr_lang,
+        tessdata=tessdata,
+    )
+    if select_image_codec(pixmap, image_codec) != "jpeg":
+        return page_pdf_bytes
+
+    with fitz.open("pdf", page_pdf_bytes) as page_doc:
+        reencode_as_jpeg(page_doc, pixmap, image_quality)
+        return page_doc.tobytes()
+
+
+def ocr_pixels(
+    untrusted_data: bytes,
+    untrusted_width: int,
+    untrusted_height: int,
+    grayscale: bool,
+    ocr_lang: str,
+    tessdata: str,
+    image_codec: str,
+    image_quality: int,
+    untrusted_dpi: int = DEFAULT_DPI,
+) -> bytes:
+    """OCR a byte array of RGB or grayscale pixels, and return a searchable PDF page.
+
+    This function runs in the worker processes of the OCR pool.
+    """
+    try:
+        pixmap = fitz.Pixmap(
+            fitz.Colorspace(fitz.CS_GRAY if grayscale else fitz.CS_RGB),
+            untrusted_width,
+            untrusted_height,
+            untrusted_data,
+            False,
+        )
+        pixmap.set_dpi(untrusted_dpi, untrusted_dpi)
+        return ocr_pixmap(pixmap, ocr_lang, tessdata, image_codec, image_quality)
+    except Exception as e:
+        # MuPDF exceptions cannot be pickled, so we have to convert them to a plain
+        # exception, before sending them back to the main process.
+        raise RuntimeError(str(e)) from None
+
+
+class OCREngine:
+    """A set of OCR worker processes for a single language.
+
+    Starting a worker process and loading MuPDF in it takes a noticeable amount of
+    time, which adds up when converting many small documents. So, an engine is meant
+    to outlive a single document, and be reused for every document that is OCRed in
+    the same language. Its workers are started on demand, and are stopped when the
+    engine is closed.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        ocr_lang: str,
+        tessdata: str,
+        image_codec: str = DEFAULT_IMAGE_CODEC,
+        image_quality: int = DEFAULT_IMAGE_QUALITY,
+    ) -> None:
+        self.workers = workers
+        self.ocr_lang = ocr_lang
+        self.tessdata = tessdata
+        self.image_codec = image_codec
+        self.image_quality = image_quality
+        # Spawn the workers, instead of forking them, since forking a process with
+        # running threads (e.g., the GUI) is not safe. Spawned workers import the
+        # main module of this process, so the scripts that start Dangerzone must
+        # call main() only under an `if __name__ == "__main__"` guard. Frozen
+        # builds are handled by the freeze_support() call in dangerzone/__init__.py.
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def submit(
+        self,
+        untrusted_data: bytes,
+        untrusted_width: int,
+        untrusted_height: int,
+        grayscale: bool = False,
+        untrusted_dpi: int = DEFAULT_DPI,
+    ) -> concurrent.futures.Future[bytes]:
+        """Send a page to a worker for OCR."""
+        return self.executor.submit(
+            ocr_pixels,
+            untrusted_data,
+            untrusted_width,
+            untrusted_height,
+            grayscale,
+            self.ocr_lang,
+            self.tessdata,
+            self.image_codec,
+            self.image_quality,
+            untrusted_dpi,
+        )
+
+    def close(self) -> None:
+        """Stop the workers, discarding any pages that have not been OCRed yet."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class OCRPool:
+    """OCR the pages of a document in parallel, and return them in page order.
+
+    Tesseract and MuPDF hold the GIL for most of their work, so we OCR pages in the
+    worker processes of an OCR engine, which may be shared with other documents.
+    Pages are submitted in the order they are read from the conversion process, and
+    their results are returned in the same order, no matter which worker finishes
+    first.
+
+    The number of pages that can be in flight is bounded, so that we don't keep more
+    pixels in memory than the workers can process.
+
+    If there's an OCR cache, pages that are found there are not OCRed again, and
+    newly OCRed pages are stored there.
+    """
+
+    def __init__(self, engine: OCREngine, cache: Optional[OCRCache] = None) -> None:
+        self.engine = engine
+        self.max_pending = 2 * engine.workers
+        self.pending: Deque[concurrent.futures.Future[bytes]] = deque()
+        self.cache = cache
+        # The cache keys of the pending pages, or None for pages that must not be
+        # cached.
+        self.cache_keys: Deque[Optional[str]] = deque()
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def is_full(self) -> bool:
+        return len(self.pending) >= self.max_pending
+
+    def submit(
+        self,
+        untrusted_data: bytes,
+        untrusted_width: int,
+        untrusted_height: int,
+        grayscale: bool = False,
+        untrusted_dpi: int = DEFAULT_DPI,
+    ) -> None:
+        """Queue a page for OCR."""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(
+                untrusted_data,
+                untrusted_width,
+                untrusted_height,
+                grayscale,
+                untrusted_dpi,
+            )
+            page_pdf = self.cache.get(cache_key)
+            if page_pdf is not None:
+                self.add(page_pdf)
+                return
+
+        future = self.engine.submit(
+            untrusted_data, untrusted_width, untrusted_height, grayscale, untrusted_dpi
+        )
+        self.pending.append(future)
+        self.cache_keys.append(cache_key)
+
+    def add(self, page_pdf: bytes) -> None:
+        """Queue a page that needs no OCR, so that it's returned in page order."""
+        future: concurrent.futures.Future[bytes] = concurrent.futures.Future()
+        future.set_result(page_pdf)
+        self.pending.append(future)
+        self.cache_keys.append(None)
+
+    def pop(self) -> bytes:
+        """Wait for the earliest submitted page, and return it as a PDF."""
+        page_pdf = self.pending.popleft().result()
+        cache_key = self.cache_keys.popleft()
+        if self.cache is not None and cache_key is not None:
+            self.cache.put(cache_key, page_pdf)
+        return page_pdf
+
+    def close(self) -> None:
+        """Discard any pages that have not been OCRed yet.
+
+        The engine is left running, so that it can be used for other documents.
+        """
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.cache_keys.clear()
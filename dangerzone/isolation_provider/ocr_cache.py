@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import fitz
+
+from ..conversion.common import DEFAULT_DPI
+from ..util import get_cache_dir
+
+log = logging.getLogger(__name__)
+
+# Extension of the files that hold the cached pages.
+CACHE_ENTRY_SUFFIX = ".pdf"
+
+
+def get_ocr_cache_dir() -> Path:
+    """Get the directory of the OCR cache, e.g., ~/.cache/dangerzone/ocr on Linux."""
+    return get_cache_dir() / "ocr"
+
+
+def get_tessdata_version(ocr_lang: str, tessdata: str) -> str:
+    """Identify the version of the OCR engine and the language models.
+
+    Tesseract is bundled with MuPDF, so we use the PyMuPDF version for the former,
+    and the size and modification time of the language models for the latter.
+    """
+    versions = [fitz.VersionBind]
+    for lang in ocr_lang.split("+"):
+        try:
+            st = os.stat(Path(tessdata) / f"{lang}.traineddata")
+            versions.append(f"{lang}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            versions.append(f"{lang}:missing")
+    return ",".join(versions)
+
+
+def clear_ocr_cache() -> None:
+    """Remove every page from the OCR cache."""
+    shutil.rmtree(get_ocr_cache_dir(), ignore_errors=True)
+
+
+class OCRCache:
+    """Keep OCRed pages on disk, so that identical pages are not OCRed twice.
+
+    Every page is stored in a separate file, which is named after a hash of the
+    pixels of the page, its dimensions, and every parameter that affects the OCR
+    result, i.e., the OCR language, the DPI, the version of the OCR engine and its
+    language models, and the encoding of the page image.
+
+    Once the cache exceeds its maximum size, the least recently used pages are
+    evicted. We mark a page as used by updating the modification time of its file.
+
+    The cached pages hold the contents of the converted documents, so the cache is
+    opt-in, and it can be removed with `clear_ocr_cache()`.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ocr_lang: str,
+        tessdata: str,
+        image_codec: str,
+        image_quality: int,
+        directory: Optional[Path] = None,
+    ) -> None:
+        self.directory = directory or get_ocr_cache_dir()
+        self.max_size = max_size
+        self.params = (
+            f"lang={ocr_lang};"
+            f"tessdata={get_tessdata_version(ocr_lang, tessdata)};"
+            f"codec={image_codec};quality={image_quality}"
+        ).encode()
+        self.hits = 0
+        self.misses = 0
+        # An estimate of the size of the cache, which is computed once we store the
+        # first page, and is updated with the pages that we store.
+        self.size: Optional[int] = None
+
+    def key(
+        self,
+        untrusted_data: bytes,
+        untrusted_width: int,
+        untrusted_height: int,
+        grayscale: bool,
+        dpi: int = DEFAULT_DPI,
+    ) -> str:
+        h = hashlib.blake2b(self.params, digest_size=20)
+        h.update(f";{untrusted_width}x{untrusted_height};{dpi};{grayscale};".encode())
+        h.update(untrusted_data)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}{CACHE_ENTRY_SUFFIX}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get an OCRed page from the cache, and mark it as recently used."""
+        path = self._path(key)
+        try:
+            page_pdf = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return page_pdf
+
+    def put(self, key: str, page_pdf: bytes) -> None:
+        """Store an OCRed page in the cache, and evict old pages if needed."""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Write the page to a temporary file first, so that other conversions
+            # never read a partially written page.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(page_pdf)
+            os.replace(tmp_path, self._path(key))
+
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self._entries())
+            else:
+                self.size += len(page_pdf)
+            if self.size > self.max_size:
+                self.evict()
+        except OSError as e:
+            log.warning(f"Could not store OCRed page in the cache: {e}")
+
+    def _entries(self) -> List[Tuple[int, int, str]]:
+        """List the modification time, size and path of every cached page."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(CACHE_ENTRY_SUFFIX):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                # Another conversion may have evicted the page in the meantime.
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        return entries
+
+    def evict(self) -> None:
+        """Remove the least recently used pages, until the cache fits its size."""
+        entries = self._entries()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+    def summary(self) -> str:
+        return f"OCR cache hits: {self.hits}, misses: {self.misses}"
@@ -5,8 +5,9 @@ import subprocess
 import sys
 import zipfile
 from pathlib import Path
-from typing import IO, Callable, Optional
+from typing import IO, Any, Callable, Optional
 
+from ..conversion import errors
 from ..conversion.common import running_on_qubes
 from ..document import Document
 from ..updater.signatures import is_container_tar_bundled
@@ -18,6 +19,17 @@ log = logging.getLogger(__name__)
 class Qubes(IsolationProvider):
     """Uses a disposable qube for performing the conversion"""
 
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # Warn about the options that are ignored once, instead of every time they
+        # are looked up.
+        if self.parallel_conversions and self.parallel_conversions > 1:
+            log.warning("Converting documents in parallel is not supported on Qubes")
+        if self.session_size > 1:
+            log.warning(
+                "Converting multiple documents per sandbox is not supported on Qubes"
+            )
+
     @staticmethod
     def requires_install() -> bool:
         return False
@@ -25,7 +37,18 @@ class Qubes(IsolationProvider):
     def get_max_parallel_conversions(self) -> int:
         return 1
 
-    def start_doc_to_pixels_proc(self, document: Document) -> subprocess.Popen:
+    def get_session_size(self) -> int:
+        # The options of a conversion cannot be passed to a disposable qube, so it
+        # always converts a single document.
+        return 1
+
+    def start_doc_to_pixels_proc(
+        self, document: Document, session: bool = False
+    ) -> subprocess.Popen:
+        # The pages to convert cannot be passed to a disposable qube either, so fail
+        # the document, instead of converting all of its pages.
+        if document.pages or document.preview:
+            raise errors.PageSelectionUnsupportedQubes()
         dev_mode = getattr(sys, "dangerzone_dev", False) is True
         if dev_mode:
             # Use dz.ConvertDev RPC call instead, if we are in development mode.
@@ -0,0 +1,175 @@
+import contextlib
+import logging
+import os
+import time
+from types import TracebackType
+from typing import Optional, Type
+
+import fitz
+
+from ..util import replace_control_chars
+from .images import (
+    DEFAULT_IMAGE_CODEC,
+    DEFAULT_IMAGE_QUALITY,
+    RGB,
+    insert_blank_page,
+    insert_image_page,
+)
+
+log = logging.getLogger(__name__)
+
+# Number of converted pages that we keep in memory, before flushing them to disk.
+PAGES_PER_FLUSH = 50
+# Size of the raw pixels that we keep in memory, before flushing them to disk. Pages
+# that are inserted as pixels are compressed only when they are flushed, so large
+# pages are flushed sooner.
+BYTES_PER_FLUSH = 64 * 1024 * 1024
+
+
+class SafePDFWriter:
+    """Assemble the safe PDF on disk, a few pages at a time.
+
+    Keeping the whole safe PDF in memory until its last page has been converted means
+    that the memory of the host grows linearly with the number of pages. Instead, we
+    flush the converted pages to a partial file every few pages, using incremental
+    saves, and reopen it afterwards, so that PyMuPDF can drop the flushed objects from
+    memory. Once all pages have been added, the partial file is rewritten as a single
+    revision, and is moved to its final destination.
+
+    If the conversion fails, the partial file is removed.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        pages_per_flush: int = PAGES_PER_FLUSH,
+        bytes_per_flush: int = BYTES_PER_FLUSH,
+    ) -> None:
+        self.filename = filename
+        # Write the partial file with a sanitized name, because PyMuPDF cannot handle
+        # non-Unicode chars.
+        self.partial_filename = f"{replace_control_chars(filename)}.part"
+        self.pages_per_flush = pages_per_flush
+        self.bytes_per_flush = bytes_per_flush
+        self.page_count = 0
+        self.doc = fitz.Document()
+        self._unflushed_pages = 0
+        self._unflushed_bytes = 0
+        self._on_disk = False
+        # The number of times that pages were written to the partial file, each of
+        # which adds a revision to it.
+        self._revisions = 0
+        # Time spent writing pages to disk, including compressing their images.
+        self.write_time = 0.0
+
+    def __enter__(self) -> "SafePDFWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def insert_pdf(self, page_pdf: fitz.Document) -> None:
+        """Append the pages of a PDF to the safe PDF."""
+        self.doc.insert_pdf(page_pdf)
+        self.pages_added(page_pdf.page_count)
+
+    def insert_pixmap(
+        self,
+        pixmap: fitz.Pixmap,
+        image_codec: str = DEFAULT_IMAGE_CODEC,
+        image_quality: int = DEFAULT_IMAGE_QUALITY,
+    ) -> None:
+        """Append a page that consists of a single image."""
+        insert_image_page(self.doc, pixmap, image_codec, image_quality)
+        self.pages_added(size=pixmap.width * pixmap.height * pixmap.n)
+
+    def insert_blank_page(self, pixmap: fitz.Pixmap, color: RGB) -> None:
+        """Append a page of a single color, instead of the image of a blank page."""
+        insert_blank_page(self.doc, pixmap, color)
+        self.pages_added()
+
+    def pages_added(self, count: int = 1, size: int = 0) -> None:
+        """Account for pages that have been added directly to `self.doc`, along with
+        the size of their raw pixels, if any."""
+        self.page_count += count
+        self._unflushed_pages += count
+        self._unflushed_bytes += size
+        if (
+            self._unflushed_pages >= self.pages_per_flush
+            or self._unflushed_bytes >= self.bytes_per_flush
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the pages that are kept in memory to the partial file."""
+        if not self._unflushed_pages:
+            return
+
+        start = time.perf_counter()
+        # Compress any images that were inserted as raw pixels. Images that are
+        # already compressed are left as is.
+        if self._on_disk:
+            self.doc.save(
+                self.partial_filename,
+                incremental=True,
+                encryption=fitz.PDF_ENCRYPT_KEEP,
+                deflate_images=True,
+            )
+        else:
+            self.doc.save(self.partial_filename, deflate_images=True)
+            self._on_disk = True
+        self._revisions += 1
+
+        # Reopen the document, so that the objects we have just written are no longer
+        # kept in memory.
+        self.doc.close()
+        self.doc = fitz.open(self.partial_filename, filetype="pdf")
+        self._unflushed_pages = 0
+        self._unflushed_bytes = 0
+        self.write_time += time.perf_counter() - start
+
+    def close(self) -> None:
+        """Flush the remaining pages and move the safe PDF to its destination.
+
+        Every flush but the first appends an incremental update to the partial file,
+        which rewrites the page tree and the cross-reference table. Users should get
+        a PDF without this history, so if there is more than one revision, we save
+        the whole document once more, which also drops the objects that have been
+        replaced.
+        """
+        self.flush()
+        if self._revisions <= 1:
+            self.doc.close()
+            os.replace(self.partial_filename, self.filename)
+            return
+
+        start = time.perf_counter()
+        compact_filename = f"{self.partial_filename}.compact"
+        try:
+            self.doc.save(compact_filename, garbage=3, deflate=True)
+        except Exception:
+            with contextlib.suppress(OSError):
+                os.remove(compact_filename)
+            self.discard()
+            raise
+        self.doc.close()
+        os.replace(compact_filename, self.filename)
+        os.remove(self.partial_filename)
+        self.write_time += time.perf_counter() - start
+
+    def discard(self) -> None:
+        """Close the safe PDF and remove any pages that have been written so far."""
+        self.doc.close()
+        if self._on_disk:
+            try:
+                os.remove(self.partial_filename)
+            except OSError as e:
+                log.warning(f"Could not remove partial file: {e}")
@@ -8,6 +8,7 @@ import colorama
 from . import errors, util
 from .document import Document
 from .isolation_provider.base import IsolationProvider
+from .scheduling import queue_wait_summary, schedule_documents
 from .settings import Settings
 from .util import get_resource_path
 
@@ -38,8 +39,18 @@ class DangerzoneCore(object):
         input_filename: str,
         output_filename: Optional[str] = None,
         archive: bool = False,
+        pages: Optional[str] = None,
+        preview: bool = False,
+        priority: int = 0,
     ) -> None:
-        doc = Document(input_filename, output_filename, archive=archive)
+        doc = Document(
+            input_filename,
+            output_filename,
+            archive=archive,
+            pages=pages,
+            preview=preview,
+            priority=priority,
+        )
         self.add_document(doc)
 
     def add_document(self, doc: Document) -> None:
@@ -59,7 +70,10 @@ class DangerzoneCore(object):
         self.documents = []
 
     def convert_documents(
-        self, ocr_lang: Optional[str], stdout_callback: Optional[Callable] = None
+        self,
+        ocr_lang: Optional[str],
+        stdout_callback: Optional[Callable] = None,
+        schedule: Optional[str] = None,
     ) -> None:
         def convert_doc(document: Document) -> None:
             try:
@@ -75,9 +89,44 @@ class DangerzoneCore(object):
                 )
                 document.mark_as_failed()
 
+        def convert_session(documents: List[Document]) -> None:
+            try:
+                self.isolation_provider.convert_session(
+                    documents,
+                    ocr_lang,
+                    stdout_callback,
+                )
+
+            except Exception:
+                log.exception(
+                    "Unexpected error occurred while converting a session of"
+                    f" {len(documents)} documents"
+                )
+                for document in documents:
+                    if not (document.is_safe() or document.is_failed()):
+                        document.mark_as_failed()
+
+        documents = schedule_documents(
+            self.documents, schedule or self.settings.get("schedule")
+        )
+        for document in documents:
+            document.mark_as_queued()
+
         max_jobs = self.isolation_provider.get_max_parallel_conversions()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs) as executor:
-            executor.map(convert_doc, self.documents)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_jobs
+            ) as executor:
+                if self.isolation_provider.get_session_size() > 1:
+                    sessions = self.isolation_provider.group_documents(documents)
+                    executor.map(convert_session, sessions)
+                else:
+                    executor.map(convert_doc, documents)
+        finally:
+            # The OCR engines are shared by all the documents of the batch, so we
+            # stop them only once every document has been converted.
+            self.isolation_provider.close_ocr_engines()
+        log.info(queue_wait_summary(documents))
 
     def get_unconverted_documents(self) -> List[Document]:
         return [doc for doc in self.documents if doc.is_unconverted()]
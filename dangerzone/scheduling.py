@@ -0,0 +1,110 @@
+"""Order the documents of a batch before converting them.
+
+Documents are converted in the order they are scheduled, so a large document at the
+front of a batch delays every small document behind it. Scheduling the cheapest
+documents first gets most of the documents of a batch converted sooner.
+
+The cost of a document is a rough estimate of its number of pages, which is based
+on its size and type. The pages of PDFs are counted, if that's cheap. The host does
+not parse untrusted documents, though, so pages are counted by looking for page
+objects in the raw bytes of the PDF, and the estimate is used only for scheduling.
+"""
+
+import logging
+import math
+import mimetypes
+import os
+import re
+from typing import List, Optional
+
+from .conversion.common import select_pages
+from .document import Document
+
+log = logging.getLogger(__name__)
+
+# How to order the documents of a batch: in the order they were added, or the
+# cheapest ones first. Documents with a higher priority always go first.
+SCHEDULES = ["fifo", "shortest-first"]
+
+# Max size of a PDF whose pages are counted before the conversion, in bytes.
+MAX_PROBE_SIZE = 32 * 1024 * 1024
+# Rough size of a page of a document whose pages cannot be counted, in bytes.
+BYTES_PER_PAGE = 50 * 1024
+# The cost of converting a document with LibreOffice first, in pages.
+LIBREOFFICE_COST = 10
+
+# A page object of a PDF, e.g., "/Type /Page", but not "/Type /Pages".
+PAGE_OBJECT_RE = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+
+
+def probe_page_count(path: str) -> Optional[int]:
+    """Count the pages of a PDF from its raw bytes, if it's small enough.
+
+    Return None if the pages cannot be counted this way, e.g., if the page objects
+    are compressed.
+    """
+    try:
+        if os.path.getsize(path) > MAX_PROBE_SIZE:
+            return None
+        with open(path, "rb") as f:
+            data = f.read(MAX_PROBE_SIZE)
+    except OSError:
+        return None
+    if not data.startswith(b"%PDF-"):
+        return None
+    return len(PAGE_OBJECT_RE.findall(data)) or None
+
+
+def estimate_cost(document: Document) -> int:
+    """Estimate how many pages of a document will be converted."""
+    try:
+        size = os.path.getsize(document.input_filename)
+    except OSError:
+        # The conversion will fail soon enough.
+        return 0
+    size_pages = max(math.ceil(size / BYTES_PER_PAGE), 1)
+
+    mime_type, _ = mimetypes.guess_type(document.input_filename)
+    extra_cost = 0
+    if mime_type == "application/pdf":
+        pages = probe_page_count(document.input_filename) or size_pages
+    elif mime_type and mime_type.startswith("image/"):
+        pages = 1
+    elif mime_type == "application/epub+zip":
+        pages = size_pages
+    else:
+        pages = size_pages
+        extra_cost = LIBREOFFICE_COST
+
+    if document.pages:
+        pages = len(select_pages(document.pages, pages))
+    return pages + extra_cost
+
+
+def schedule_documents(documents: List[Document], schedule: str) -> List[Document]:
+    """Get the documents in the order they should be converted.
+
+    The documents with the highest priority go first, and then, depending on the
+    schedule, either the first ones that were added, or the cheapest ones.
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Unknown schedule: {schedule}")
+    if schedule == "fifo":
+        return sorted(documents, key=lambda doc: -doc.priority)
+    costs = {doc.id: estimate_cost(doc) for doc in documents}
+    for doc in documents:
+        log.debug(f"[doc {doc.id}] Estimated cost: {costs[doc.id]} page(s)")
+    return sorted(documents, key=lambda doc: (-doc.priority, costs[doc.id]))
+
+
+def queue_wait_summary(documents: List[Document]) -> str:
+    """Summarize how long the documents of a batch waited in the queue."""
+    waits = sorted(doc.queue_wait for doc in documents if doc.queue_wait is not None)
+    if not waits:
+        return "No documents waited in the queue"
+    median = waits[(len(waits) - 1) // 2]
+    p95 = waits[math.ceil(len(waits) * 0.95) - 1]
+    return (
+        f"{len(waits)} document(s) waited {median:.2f}s in the queue (median),"
+        f" {p95:.2f}s (p95), {waits[-1]:.2f}s (max)"
+    )
@@ -46,6 +46,41 @@ class Settings:
             "archive": True,
             "ocr": True,
             "ocr_language": "English",
+            "ocr_workers": None,  # one OCR worker per CPU core
+            "render_workers": None,  # one render worker per CPU core of the sandbox
+            # Convert Office documents with a LibreOffice instance that starts along
+            # with the sandbox.
+            "libreoffice_listener": False,
+            # How to choose the DPI of every page: one of "fast", "standard", "high".
+            "dpi_profile": "standard",
+            # Max number of pixels of a page, which overrides the one of the DPI
+            # profile.
+            "pixel_budget": None,
+            # How the sandbox compresses the pixels of pages: one of "none", "zlib",
+            # or None to compress them only if the sandbox runs in a VM.
+            "page_compression": None,
+            # Max number of documents that a single sandbox converts, one after the
+            # other, when converting a batch of documents from the command line.
+            "session_size": 1,
+            # Max number of documents to convert in parallel, or None to choose it
+            # based on the CPUs and memory that the sandboxes can use.
+            "parallel_conversions": None,
+            # The order in which the documents of a batch are converted: one of
+            # "fifo", "shortest-first".
+            "schedule": "shortest-first",
+            # The CPUs and memory (in bytes) of a sandbox, when documents are
+            # converted in parallel, or None to split them evenly between sandboxes.
+            "container_cpus": None,
+            "container_memory": None,
+            "image_codec": "lossless",  # one of "lossless", "jpeg", "auto"
+            "image_quality": 85,  # JPEG quality, from 1 to 100
+            # Max ratio of pixels that can differ from the background of a page,
+            # for the page to be considered blank.
+            "blank_page_threshold": 0.0,
+            # Keep OCRed pages on disk, so that identical pages are not OCRed twice.
+            # Disabled by default, since it keeps the contents of converted documents.
+            "ocr_cache": False,
+            "ocr_cache_max_size": 256 * 1024 * 1024,  # in bytes
             "open": True,
             "open_app": None,
             "safe_extension": SAFE_EXTENSION,
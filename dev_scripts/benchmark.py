@@ -0,0 +1,723 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+
+import fitz
+
+from dangerzone.conversion.common import DEFAULT_DPI
+from dangerzone.conversion.protocol import (
+    COMPRESSION_NONE,
+    COMPRESSION_ZLIB,
+    COMPRESSIONS,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+    encode_page,
+    encode_stream_header,
+)
+from dangerzone.conversion.render import render_pages
+from dangerzone.document import Document
+from dangerzone.isolation_provider.base import (
+    ConversionStats,
+    IsolationProvider,
+    PageReader,
+    pixels_to_pixmap,
+    read_bytes,
+    read_int,
+    read_stream_header,
+)
+from dangerzone.isolation_provider.dummy import DUMMY_PATTERNS, Dummy
+from dangerzone.isolation_provider.images import insert_image_page, to_grayscale
+from dangerzone.isolation_provider.ocr import OCREngine, OCRPool, get_ocr_workers
+from dangerzone.isolation_provider.writer import SafePDFWriter
+from dangerzone.util import get_tessdata_dir, get_version
+
+TEST_DOCS_DIR = pathlib.Path(__file__).parent.parent / "tests" / "test_docs"
+# The raster images among the test documents.
+IMAGE_SUFFIXES = [".bmp", ".gif", ".jpg", ".pbm", ".png", ".pnm", ".ppm", ".tif"]
+
+# The Dummy provider refuses to run outside of a development environment.
+sys.dangerzone_dev = True  # type: ignore [attr-defined]
+
+
+def start_dummy(args: argparse.Namespace) -> subprocess.Popen:
+    """Start a Dummy conversion process that sends pages with the given size."""
+    provider = Dummy(pages=args.pages, width=args.width, height=args.height)
+    # Send raw RGB pixels, so that reading them is what we measure.
+    provider.protocol = PROTOCOL_V1
+    provider.proc_stderr = subprocess.DEVNULL
+    p = provider.start_doc_to_pixels_proc(Document())
+    assert p.stdin is not None
+    p.stdin.close()
+    return p
+
+
+def ingest_alloc(p: subprocess.Popen) -> None:
+    """Read pages the way the host did before, with a new buffer per page."""
+    assert p.stdout is not None
+    n_pages = read_int(p.stdout)
+    for _ in range(n_pages):
+        width = read_int(p.stdout)
+        height = read_int(p.stdout)
+        read_int(p.stdout)  # DPI
+        pixels = read_bytes(p.stdout, width * height * 3)
+        fitz.Pixmap(fitz.Colorspace(fitz.CS_RGB), width, height, pixels, False)
+
+
+class AllocatingPageReader(PageReader):
+    """A page reader that allocates a new buffer for every page."""
+
+    def _get_buffer(self, size: int) -> bytearray:
+        # Drop the buffers that the host is done with, instead of reusing them.
+        while not self.free_buffers.empty():
+            self.free_buffers.get_nowait()
+        return bytearray(size)
+
+
+def ingest_reader_alloc(p: subprocess.Popen) -> None:
+    """Read pages in a background thread, with a new buffer per page."""
+    assert p.stdout is not None
+    n_pages = read_int(p.stdout)
+    with AllocatingPageReader(p.stdout, n_pages, ConversionStats()) as reader:
+        for page in reader:
+            pixels_to_pixmap(page.pixels, page.width, page.height)
+
+
+def ingest_reuse(p: subprocess.Popen) -> None:
+    """Read pages into the reusable buffers of the page reader."""
+    assert p.stdout is not None
+    n_pages = read_int(p.stdout)
+    with PageReader(p.stdout, n_pages, ConversionStats()) as reader:
+        for page in reader:
+            pixels_to_pixmap(page.pixels, page.width, page.height)
+
+
+INGEST_MODES: Dict[str, Callable[[subprocess.Popen], None]] = {
+    "alloc": ingest_alloc,
+    "reader-alloc": ingest_reader_alloc,
+    "reuse": ingest_reuse,
+}
+
+
+def benchmark_ingest(args: argparse.Namespace) -> None:
+    if args.mode is None:
+        # Run every mode in a separate process, so that their peak memory usage
+        # does not affect each other.
+        for mode in INGEST_MODES:
+            cmd = [sys.executable, __file__] + sys.argv[1:] + ["--mode", mode]
+            subprocess.run(cmd, check=True)
+        return
+
+    p = start_dummy(args)
+    start = time.perf_counter()
+    INGEST_MODES[args.mode](p)
+    elapsed = time.perf_counter() - start
+    p.wait()
+
+    size_mib = args.pages * args.width * args.height * 3 / 1024 / 1024
+    # On Linux, the maximum resident set size is reported in KiB.
+    peak_rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        f"{args.mode}: {args.pages / elapsed:.1f} pages/s,"
+        f" {size_mib / elapsed:.1f} MiB/s, peak RSS {peak_rss_mib:.1f} MiB"
+    )
+
+
+def render_test_docs() -> List[Tuple[bytes, int, int]]:
+    """Render the pages of the test documents that PyMuPDF can open."""
+    pages = []
+    for filename in sorted(TEST_DOCS_DIR.glob("sample-*")):
+        try:
+            doc = fitz.open(filename)
+        except Exception:
+            continue
+        with doc:
+            for page in doc:
+                pix = page.get_pixmap(dpi=DEFAULT_DPI)
+                pages.append((pix.samples, pix.width, pix.height))
+    return pages
+
+
+def pixels_to_pdf_page(
+    provider: IsolationProvider,
+    pixels: bytes,
+    width: int,
+    height: int,
+    ocr_lang: Optional[str],
+) -> fitz.Document:
+    """Convert the pixels of a page into a PDF, the way the host used to.
+
+    Every page was a PDF of its own, which was serialized and then parsed back, so
+    that it could be inserted into the safe PDF. This is the baseline that the
+    direct insertion of pages is measured against.
+    """
+    pixmap = pixels_to_pixmap(pixels, width, height)
+    pixmap = to_grayscale(pixmap) or pixmap
+    if ocr_lang:
+        page_pdf_bytes = provider.ocr_page(pixmap, ocr_lang)
+    else:
+        page_doc = fitz.Document()
+        insert_image_page(
+            page_doc, pixmap, provider.image_codec, provider.image_quality
+        )
+        page_pdf_bytes = page_doc.tobytes(deflate_images=True)
+    return fitz.open("pdf", page_pdf_bytes)
+
+
+def pages_round_trip(
+    provider: IsolationProvider,
+    safe_doc: SafePDFWriter,
+    pixels: bytes,
+    width: int,
+    height: int,
+) -> None:
+    """Create a PDF for the page, serialize it, and insert it into the safe PDF."""
+    page_pdf = pixels_to_pdf_page(provider, pixels, width, height, None)
+    safe_doc.insert_pdf(page_pdf)
+
+
+def pages_direct(
+    provider: IsolationProvider,
+    safe_doc: SafePDFWriter,
+    pixels: bytes,
+    width: int,
+    height: int,
+) -> None:
+    """Insert the page straight into the safe PDF.
+
+    The page goes through the same steps as in the round trip, i.e., pages without
+    colors are converted to grayscale, and the image is encoded with the codec of
+    the provider, so that only the way the page is inserted differs.
+    """
+    pixmap = pixels_to_pixmap(pixels, width, height)
+    pixmap = to_grayscale(pixmap) or pixmap
+    safe_doc.insert_pixmap(pixmap, provider.image_codec, provider.image_quality)
+
+
+PAGES_MODES: Dict[
+    str, Callable[[IsolationProvider, SafePDFWriter, bytes, int, int], None]
+] = {
+    "round-trip": pages_round_trip,
+    "direct": pages_direct,
+}
+
+
+def benchmark_pages(args: argparse.Namespace) -> None:
+    provider = Dummy()
+    pages = render_test_docs() * args.repeat
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mode, insert_page in PAGES_MODES.items():
+            output = pathlib.Path(tmpdir) / f"{mode}.pdf"
+            start = time.perf_counter()
+            with SafePDFWriter(str(output)) as safe_doc:
+                for pixels, width, height in pages:
+                    insert_page(provider, safe_doc, pixels, width, height)
+            elapsed = time.perf_counter() - start
+            size_mib = output.stat().st_size / 1024 / 1024
+            print(
+                f"{mode}: {len(pages) / elapsed:.1f} pages/s"
+                f" ({len(pages)} pages, {size_mib:.1f} MiB)"
+            )
+
+
+def ocr_document(engine: OCREngine, pages: List[Tuple[bytes, int, int]]) -> float:
+    """OCR the pages of a document, and return the average latency of a page."""
+    pool = OCRPool(engine)
+    submitted = []
+    latencies = []
+    try:
+        for pixels, width, height in pages:
+            submitted.append(time.perf_counter())
+            pool.submit(pixels, width, height)
+        for start in submitted:
+            pool.pop()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        pool.close()
+    return sum(latencies) / len(latencies)
+
+
+def benchmark_ocr(args: argparse.Namespace) -> None:
+    tessdata = str(get_tessdata_dir())
+    workers = get_ocr_workers(args.workers)
+    test_pages = render_test_docs()
+    pages = [test_pages[i % len(test_pages)] for i in range(args.pages)]
+
+    for mode in ("per-document", "shared"):
+        shared_engine = None
+        if mode == "shared":
+            shared_engine = OCREngine(workers, args.ocr_lang, tessdata)
+        latencies = []
+        start = time.perf_counter()
+        try:
+            for _ in range(args.docs):
+                # Without a shared engine, start a new one for every document, as
+                # the host did before.
+                engine = shared_engine or OCREngine(workers, args.ocr_lang, tessdata)
+                try:
+                    latencies.append(ocr_document(engine, pages))
+                finally:
+                    if engine is not shared_engine:
+                        engine.close()
+        finally:
+            if shared_engine is not None:
+                shared_engine.close()
+        elapsed = time.perf_counter() - start
+        n_pages = args.docs * args.pages
+        print(
+            f"{mode}: {n_pages / elapsed:.2f} pages/s, average page latency"
+            f" {sum(latencies) / len(latencies):.2f}s ({args.docs} documents of"
+            f" {args.pages} pages, {workers} workers)"
+        )
+
+
+# Conversion processes that send pages the way the sandbox does, either a field at
+# a time, each one from a thread of its own, as it did before, or as single frames.
+FRAMES_SCRIPTS = {
+    "per-field": """
+async def send_page(width, height, pixels):
+    await C.write_int(width)
+    await C.write_int(height)
+    await C.write_int(DEFAULT_DPI)
+    await C.write_bytes(pixels)
+""",
+    "frames": """
+writer = FrameWriter()
+
+async def send_page(width, height, pixels):
+    await writer.write_frame([width, height, DEFAULT_DPI], pixels)
+""",
+}
+FRAMES_MAIN = """
+import asyncio, sys
+from dangerzone.conversion.common import DEFAULT_DPI, FrameWriter
+from dangerzone.conversion.common import DangerzoneConverter as C
+{send_page}
+async def main(pages, width, height):
+    C._write_int(pages)
+    sys.stdout.flush()
+    pixels = width * height * 3 * b"A"
+    for _ in range(pages):
+        await send_page(width, height, pixels)
+    sys.stdout.flush()
+
+asyncio.run(main({pages}, {width}, {height}))
+"""
+
+
+def benchmark_frames(args: argparse.Namespace) -> None:
+    for mode in list(FRAMES_SCRIPTS) + ["dummy"]:
+        if mode == "dummy":
+            # The Dummy provider sends frames synchronously.
+            p = start_dummy(args)
+        else:
+            script = FRAMES_MAIN.format(
+                send_page=FRAMES_SCRIPTS[mode],
+                pages=args.pages,
+                width=args.width,
+                height=args.height,
+            )
+            p = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE)
+        start = time.perf_counter()
+        ingest_reuse(p)
+        elapsed = time.perf_counter() - start
+        p.wait()
+        size_mib = args.pages * args.width * args.height * 3 / 1024 / 1024
+        print(
+            f"{mode}: {args.pages / elapsed:,.0f} pages/s,"
+            f" {size_mib / elapsed:,.1f} MiB/s"
+        )
+
+
+def create_test_doc(filename: str, n_pages: int) -> None:
+    """Create a PDF with the given number of pages, taken from the test documents."""
+    with fitz.open() as doc:
+        while doc.page_count < n_pages:
+            for src_filename in sorted(TEST_DOCS_DIR.glob("sample-*.pdf")):
+                with fitz.open(src_filename) as src:
+                    doc.insert_pdf(src, to_page=n_pages - doc.page_count - 1)
+                if doc.page_count >= n_pages:
+                    break
+        doc.save(filename)
+
+
+async def render_doc(filename: str, workers: int) -> None:
+    """Render the pages of a document, and write them out, as the sandbox does."""
+    with fitz.open(filename) as doc, open(os.devnull, "wb") as out:
+        async for _, _, _, pixels in render_pages(doc, filename, workers=workers):
+            out.write(pixels)
+
+
+def benchmark_render(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = str(pathlib.Path(tmpdir) / "doc.pdf")
+        create_test_doc(filename, args.pages)
+        for workers in args.workers:
+            start = time.perf_counter()
+            asyncio.run(render_doc(filename, workers))
+            elapsed = time.perf_counter() - start
+            print(f"{workers} workers: {args.pages / elapsed:.1f} pages/s")
+
+
+async def render_image(filename: str, image: bool) -> int:
+    """Render the frames of an image, as the sandbox does, and return their size."""
+    size = 0
+    with fitz.open(filename) as doc:
+        async for _, _, _, pixels in render_pages(doc, filename, image=image):
+            size += len(pixels)
+    return size
+
+
+def benchmark_images(args: argparse.Namespace) -> None:
+    filenames = sorted(
+        f for f in TEST_DOCS_DIR.glob("sample-*.*") if f.suffix in IMAGE_SUFFIXES
+    )
+    for filename in filenames:
+        results = []
+        for image in [False, True]:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                size = asyncio.run(render_image(str(filename), image))
+            elapsed = (time.perf_counter() - start) / args.repeat
+            results.append(f"{elapsed * 1000:.1f}ms, {size / 1024:,.0f} KiB")
+        print(f"{filename.name}: as page {results[0]}, as image {results[1]}")
+
+
+# The protocol versions and compressions with which the sandbox can send pages.
+PROTOCOL_MODES = {
+    "v1": (PROTOCOL_V1, COMPRESSION_NONE),
+    "v2": (PROTOCOL_V2, COMPRESSION_NONE),
+    "v2-zlib": (PROTOCOL_V2, COMPRESSION_ZLIB),
+}
+
+
+def send_pages(
+    f: IO[bytes], pages: List[Tuple[bytes, int, int]], protocol: int, compression: int
+) -> None:
+    """Encode pages and send them, as the sandbox does."""
+    f.write(encode_stream_header(protocol, len(pages)))
+    for number, (pixels, width, height) in enumerate(pages, start=1):
+        for data in encode_page(
+            protocol, compression, number, width, height, DEFAULT_DPI, pixels
+        ):
+            f.write(data)
+    f.close()
+
+
+def benchmark_protocol(args: argparse.Namespace) -> None:
+    pages = render_test_docs() * args.repeat
+    for mode, (protocol, compression) in PROTOCOL_MODES.items():
+        r, w = os.pipe()
+        stats = ConversionStats()
+        with open(r, "rb") as stdout, open(w, "wb") as stdin:
+            start = time.perf_counter()
+            sender = threading.Thread(
+                target=send_pages, args=(stdin, pages, protocol, compression)
+            )
+            sender.start()
+            version, n_pages = read_stream_header(stdout)
+            with PageReader(stdout, n_pages, stats, protocol=version) as reader:
+                for page in reader:
+                    pixels_to_pixmap(
+                        page.pixels, page.width, page.height, page.dpi, page.channels
+                    )
+            sender.join()
+            elapsed = time.perf_counter() - start
+
+        wire_mib = stats.read_bytes / 1024 / 1024
+        # Assume that the transfer does not overlap with encoding and decoding, which
+        # is the worst case.
+        link_time = elapsed + wire_mib / args.bandwidth
+        print(
+            f"{mode}: {wire_mib:,.1f} MiB on the wire, {elapsed:.2f}s"
+            f" ({link_time:.2f}s over a {args.bandwidth:,} MiB/s link)"
+        )
+
+
+def best_time(func: Callable[[], None], repeat: int) -> float:
+    """Run a function a few times, and get its fastest run, which is the least noisy."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def suite_result(name: str, pages: int, size: int, elapsed: float) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "pages": pages,
+        "seconds": round(elapsed, 4),
+        "pages_per_s": round(pages / elapsed, 2),
+        "mib_per_s": round(size / 1024 / 1024 / elapsed, 2),
+    }
+
+
+def suite_convert(args: argparse.Namespace, tmpdir: str) -> List[Dict[str, Any]]:
+    """Convert a document end to end with the Dummy provider, for every pixel
+    pattern and protocol mode.
+
+    This goes through the same path as a real conversion, i.e., sending the document
+    to the conversion process, reading its pages, and writing the safe PDF.
+    """
+    compression_names = {value: name for name, value in COMPRESSIONS.items()}
+    input_filename = str(TEST_DOCS_DIR / "sample-pdf.pdf")
+    size = args.pages * args.width * args.height * 3
+    results = []
+    for pattern in DUMMY_PATTERNS:
+        for mode, (protocol, compression) in PROTOCOL_MODES.items():
+            provider = Dummy(
+                pages=args.pages,
+                width=args.width,
+                height=args.height,
+                pattern=pattern,
+                page_compression=compression_names[compression],
+            )
+            provider.protocol = protocol
+            output = pathlib.Path(tmpdir) / f"convert-{pattern}-{mode}.pdf"
+
+            def convert() -> None:
+                output.unlink(missing_ok=True)
+                doc = Document(input_filename, str(output))
+                provider.convert(doc, None)
+                if not doc.is_safe():
+                    raise RuntimeError(f"Could not convert a {pattern} document")
+
+            elapsed = best_time(convert, args.repeat)
+            results.append(
+                suite_result(f"convert/{pattern}/{mode}", args.pages, size, elapsed)
+            )
+    return results
+
+
+def suite_pdf_pages(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Convert the pages of the test documents to PDF pages, with and without OCR."""
+    provider = Dummy()
+    test_pages = render_test_docs()
+    results = []
+    for ocr_lang, n_pages in [(None, len(test_pages)), (args.ocr_lang, args.ocr_pages)]:
+        name = f"pixels_to_pdf_page/{ocr_lang or 'no-ocr'}"
+        pages = test_pages[:n_pages]
+        size = sum(len(pixels) for pixels, _, _ in pages)
+
+        def convert() -> None:
+            for pixels, width, height in pages:
+                pixels_to_pdf_page(provider, pixels, width, height, ocr_lang)
+
+        try:
+            elapsed = best_time(convert, args.repeat)
+        except Exception as e:
+            # OCR needs Tesseract and its language data, which may be missing.
+            results.append({"name": name, "skipped": str(e)})
+            continue
+        results.append(suite_result(name, len(pages), size, elapsed))
+    return results
+
+
+def compare_results(
+    baseline: Dict[str, Any], results: List[Dict[str, Any]], threshold: float
+) -> List[str]:
+    """Compare the results with those of a previous run, and get the regressions."""
+    previous = {r["name"]: r for r in baseline["results"] if "skipped" not in r}
+    regressions = []
+    for result in results:
+        old = previous.get(result["name"])
+        if "skipped" in result or old is None:
+            continue
+        change = result["pages_per_s"] / old["pages_per_s"] - 1
+        print(
+            f"{result['name']}: {old['pages_per_s']:,.2f} -> "
+            f"{result['pages_per_s']:,.2f} pages/s ({change:+.1%})"
+        )
+        if change < -threshold:
+            regressions.append(result["name"])
+    return regressions
+
+
+def benchmark_suite(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = suite_convert(args, tmpdir) + suite_pdf_pages(args)
+
+    for result in results:
+        if "skipped" in result:
+            print(f"{result['name']}: skipped ({result['skipped']})")
+        else:
+            print(
+                f"{result['name']}: {result['pages_per_s']:,.2f} pages/s,"
+                f" {result['mib_per_s']:,.2f} MiB/s"
+            )
+
+    report = {
+        "version": get_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "options": {
+            "pages": args.pages,
+            "width": args.width,
+            "height": args.height,
+            "repeat": args.repeat,
+            "ocr_lang": args.ocr_lang,
+            "ocr_pages": args.ocr_pages,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared to {baseline['version']} ({baseline['timestamp']}):")
+        regressions = compare_results(baseline, results, args.threshold / 100)
+        if regressions:
+            sys.exit(f"Slower by more than {args.threshold}%: {', '.join(regressions)}")
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description="Benchmark the host side of a conversion, using the Dummy provider",
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_ingest = subparsers.add_parser(
+        "ingest", help="Benchmark reading pixels from the conversion process"
+    )
+    parser_ingest.add_argument("--pages", type=int, default=20)
+    parser_ingest.add_argument("--width", type=int, default=5000)
+    parser_ingest.add_argument("--height", type=int, default=5000)
+    parser_ingest.add_argument("--mode", choices=INGEST_MODES.keys())
+    parser_ingest.set_defaults(func=benchmark_ingest)
+
+    parser_pages = subparsers.add_parser(
+        "pages",
+        help="Benchmark adding the pages of the test documents to the safe PDF,"
+        " without OCR",
+    )
+    parser_pages.add_argument(
+        "--repeat", type=int, default=5, help="Times to add each page (default: 5)"
+    )
+    parser_pages.set_defaults(func=benchmark_pages)
+
+    parser_ocr = subparsers.add_parser(
+        "ocr",
+        help="Benchmark OCRing a batch of documents, with an OCR engine per document"
+        " or a shared one",
+    )
+    parser_ocr.add_argument("--docs", type=int, default=10)
+    parser_ocr.add_argument("--pages", type=int, default=2, help="Pages per document")
+    parser_ocr.add_argument("--ocr-lang", default="eng")
+    parser_ocr.add_argument("--workers", type=int)
+    parser_ocr.set_defaults(func=benchmark_ocr)
+
+    parser_render = subparsers.add_parser(
+        "render",
+        help="Benchmark rendering the pages of a document to pixels, as the sandbox"
+        " does, with a different number of workers",
+    )
+    parser_render.add_argument("--pages", type=int, default=200)
+    parser_render.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, os.cpu_count() or 1],
+        help="Number of workers to try (default: 1 2 4 and one per CPU core)",
+    )
+    parser_render.set_defaults(func=benchmark_render)
+
+    parser_frames = subparsers.add_parser(
+        "frames",
+        help="Benchmark sending pages out of the conversion process, a field at a"
+        " time or as single frames",
+    )
+    parser_frames.add_argument("--pages", type=int, default=5000)
+    parser_frames.add_argument("--width", type=int, default=100)
+    parser_frames.add_argument("--height", type=int, default=100)
+    parser_frames.set_defaults(func=benchmark_frames)
+
+    parser_images = subparsers.add_parser(
+        "images",
+        help="Benchmark rendering the test images to pixels, as the sandbox does,"
+        " either as pages or as images",
+    )
+    parser_images.add_argument(
+        "--repeat", type=int, default=20, help="Times to render each image"
+    )
+    parser_images.set_defaults(func=benchmark_images)
+
+    parser_protocol = subparsers.add_parser(
+        "protocol",
+        help="Benchmark sending the pages of the test documents to the host, with"
+        " each protocol version and compression",
+    )
+    parser_protocol.add_argument(
+        "--repeat", type=int, default=5, help="Times to send each page (default: 5)"
+    )
+    parser_protocol.add_argument(
+        "--bandwidth",
+        type=int,
+        default=200,
+        help="Bandwidth of the link between the sandbox and the host, in MiB/s"
+        " (default: 200)",
+    )
+    parser_protocol.set_defaults(func=benchmark_protocol)
+
+    parser_suite = subparsers.add_parser(
+        "suite",
+        help="Benchmark end-to-end conversions with the Dummy provider, and the"
+        " conversion of pixels to PDF pages, with and without OCR. The results can"
+        " be saved as JSON, and compared with those of a previous release",
+    )
+    parser_suite.add_argument("--pages", type=int, default=50)
+    parser_suite.add_argument("--width", type=int, default=1275)
+    parser_suite.add_argument("--height", type=int, default=1650)
+    parser_suite.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Times to run each benchmark, keeping the fastest run (default: 3)",
+    )
+    parser_suite.add_argument("--ocr-lang", default="eng")
+    parser_suite.add_argument(
+        "--ocr-pages", type=int, default=5, help="Pages to OCR (default: 5)"
+    )
+    parser_suite.add_argument("--output", help="Save the results to a JSON file")
+    parser_suite.add_argument(
+        "--compare", help="Compare the results with those of a previous JSON file"
+    )
+    parser_suite.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="Fail if a benchmark is slower than in the compared results by more"
+        " than this percentage (default: 10)",
+    )
+    parser_suite.set_defaults(func=benchmark_suite)
+
+    return parser.parse_args(argv[1:])
+
+
+def main() -> None:
+    args = parse_args(sys.argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
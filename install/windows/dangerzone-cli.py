@@ -1,3 +1,4 @@
 import dangerzone
 
-dangerzone.main()
+if __name__ == "__main__":
+    dangerzone.main()
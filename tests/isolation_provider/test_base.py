@@ -0,0 +1,353 @@
+import io
+import os
+import time
+import zlib
+from typing import List, Tuple, Type
+
+import pytest
+from pytest_mock import MockerFixture
+
+from dangerzone.conversion import errors
+from dangerzone.conversion.common import DEFAULT_DPI, INT_BYTES, encode_ints
+from dangerzone.conversion.protocol import (
+    COMPRESSION_NONE,
+    COMPRESSION_ZLIB,
+    PIXEL_FORMAT_BILEVEL,
+    PIXEL_FORMAT_GRAY,
+    PIXEL_FORMAT_RGB,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+    encode_document_end,
+    encode_page,
+    encode_stream_header,
+)
+from dangerzone.isolation_provider.base import (
+    INPUT_CHUNK_SIZE,
+    ConversionStats,
+    DocumentFailed,
+    InputWriter,
+    PageReader,
+    read_document_end,
+    read_into,
+    read_stream_header,
+)
+from dangerzone.isolation_provider.dummy import Dummy
+from dangerzone.settings import Settings
+
+
+def encode_pages(pages: List[Tuple[int, int, bytes]]) -> io.BytesIO:
+    """Encode pages the same way as the conversion process does."""
+    stream = io.BytesIO()
+    for width, height, pixels in pages:
+        stream.write(width.to_bytes(INT_BYTES, "big"))
+        stream.write(height.to_bytes(INT_BYTES, "big"))
+        stream.write(pixels)
+    stream.seek(0)
+    return stream
+
+
+def test_page_reader_order() -> None:
+    pages = [(2, 1, bytes([i]) * 6) for i in range(10)]
+    stats = ConversionStats()
+    with PageReader(encode_pages(pages), len(pages), stats, queue_size=2) as reader:
+        # Copy the pixels, since they are valid only until we get the next page.
+        read_pages = [(p.number, bytes(p.pixels)) for p in reader]
+
+    assert [number for number, _ in read_pages] == list(range(1, 11))
+    assert [pixels for _, pixels in read_pages] == [pixels for _, _, pixels in pages]
+    assert stats.read_time > 0
+
+
+def test_page_reader_reuses_buffers() -> None:
+    # Pages grow in size, and then shrink again.
+    sizes = [1, 1, 1, 4, 4, 2, 2, 1, 1, 1]
+    pages = [(size, 1, bytes([i]) * size * 3) for i, size in enumerate(sizes)]
+    buffers = set()
+    with PageReader(encode_pages(pages), len(pages), ConversionStats(), 1) as reader:
+        for page, (_, _, pixels) in zip(reader, pages):
+            assert page.pixels == pixels
+            buffers.add(id(page.buffer))
+
+    # The reader uses three buffers (one in the queue, one in the host and one in
+    # the reader thread), and should replace each one only when a larger page
+    # arrives.
+    assert len(buffers) <= 3 * 2
+
+
+def test_page_reader_backpressure() -> None:
+    pages = [(1, 1, b"AAA")] * 5
+    stats = ConversionStats()
+    with PageReader(encode_pages(pages), len(pages), stats, queue_size=1) as reader:
+        # The reader must not read more pages than the queue can hold, until we
+        # consume them.
+        time.sleep(0.5)
+        assert reader.queue.qsize() == 1
+        assert len(list(reader)) == 5
+
+    assert stats.read_blocked_time > 0
+
+
+@pytest.mark.parametrize(
+    "width,height,exception",
+    [
+        (0, 1, errors.MaxPageWidthException),
+        (errors.MAX_PAGE_WIDTH + 1, 1, errors.MaxPageWidthException),
+        (1, 0, errors.MaxPageHeightException),
+        (1, errors.MAX_PAGE_HEIGHT + 1, errors.MaxPageHeightException),
+    ],
+)
+def test_page_reader_max_dimensions(
+    width: int, height: int, exception: Type[Exception]
+) -> None:
+    pages = [(1, 1, b"AAA"), (width, height, b"")]
+    with pytest.raises(exception):
+        with PageReader(encode_pages(pages), 2, ConversionStats()) as reader:
+            assert next(iter(reader)).number == 1
+            list(reader)
+
+
+def test_page_reader_truncated() -> None:
+    pages = [(1, 1, b"AAA"), (1, 1, b"A")]
+    with pytest.raises(errors.ConverterProcException):
+        with PageReader(encode_pages(pages), 2, ConversionStats()) as reader:
+            list(reader)
+
+
+def test_page_reader_stop_early() -> None:
+    pages = [(1, 1, b"AAA")] * 5
+    reader = PageReader(encode_pages(pages), len(pages), ConversionStats(), 1)
+    with pytest.raises(RuntimeError):
+        with reader:
+            next(iter(reader))
+            raise RuntimeError("Consumer failed")
+
+    # The reader should stop waiting for room in the queue, once the consumer stops.
+    reader.thread.join(timeout=5)
+    assert not reader.thread.is_alive()
+
+
+def test_page_reader_max_buffers_size() -> None:
+    pages = [(1, 1, b"AAA")] * 5
+    stats = ConversionStats()
+    reader = PageReader(encode_pages(pages), len(pages), stats, max_buffers_size=6)
+    with reader:
+        # The reader must not read more pages than its buffers can hold, even if
+        # there's room in the queue.
+        time.sleep(0.5)
+        assert reader.queue.qsize() == 2
+        assert len(list(reader)) == 5
+
+    assert reader.num_buffers == 2
+    assert stats.read_blocked_time > 0
+
+
+def read_v2_pages(stream: bytes, n_pages: int) -> List[Tuple[int, int, bytes]]:
+    stats = ConversionStats()
+    pages = []
+    with PageReader(io.BytesIO(stream), n_pages, stats, protocol=PROTOCOL_V2) as r:
+        for page in r:
+            pages.append((page.width, page.channels, bytes(page.pixels)))
+    assert stats.read_bytes == len(stream)
+    return pages
+
+
+@pytest.mark.parametrize("compression", [COMPRESSION_NONE, COMPRESSION_ZLIB])
+def test_page_reader_v2(compression: int) -> None:
+    def gray_to_rgb(gray: bytes) -> bytes:
+        return bytes(value for value in gray for _ in range(3))
+
+    # Pages with repeated rows, so that they can be compressed.
+    rgb = bytes(range(64 * 3)) * 4
+    gray = bytes(range(64)) * 4
+    bilevel = (b"\x00\xff\xff" * 3 + b"\x00") * 30
+    pages = [(64, 4, rgb), (64, 4, gray_to_rgb(gray)), (10, 30, gray_to_rgb(bilevel))]
+    stream = b"".join(
+        b"".join(encode_page(PROTOCOL_V2, compression, i + 1, w, h, 72, pixels))
+        for i, (w, h, pixels) in enumerate(pages)
+    )
+
+    assert read_v2_pages(stream, 3) == [(64, 3, rgb), (64, 1, gray), (10, 1, bilevel)]
+
+
+def encode_v2_page(
+    index: int, pixel_format: int, compression: int, payload: bytes, dpi: int = 72
+) -> bytes:
+    header = encode_ints([index, 4, 4, dpi, pixel_format, compression])
+    return header + len(payload).to_bytes(4, "big") + payload
+
+
+def test_page_reader_dpi() -> None:
+    # Protocol v1 has no DPI, so the pages have the default one.
+    with PageReader(encode_pages([(1, 1, b"AAA")]), 1, ConversionStats()) as r:
+        assert next(iter(r)).dpi == DEFAULT_DPI
+
+    page = encode_v2_page(1, PIXEL_FORMAT_GRAY, COMPRESSION_NONE, b"A" * 16)
+    with PageReader(io.BytesIO(page), 1, ConversionStats(), protocol=PROTOCOL_V2) as r:
+        assert next(iter(r)).dpi == 72
+
+
+@pytest.mark.parametrize("dpi", [0, errors.MAX_PAGE_DPI + 1])
+def test_page_reader_invalid_dpi(dpi: int) -> None:
+    page = encode_v2_page(1, PIXEL_FORMAT_GRAY, COMPRESSION_NONE, b"A" * 16, dpi)
+    with pytest.raises(errors.PageDPIException):
+        read_v2_pages(page, 1)
+
+
+@pytest.mark.parametrize(
+    "page",
+    [
+        # The pages must be in order.
+        encode_v2_page(1, PIXEL_FORMAT_GRAY, COMPRESSION_NONE, b"A" * 16),
+        encode_v2_page(0, PIXEL_FORMAT_GRAY, COMPRESSION_NONE, b"A" * 16),
+        # Unknown pixel format and compression.
+        encode_v2_page(2, 3, COMPRESSION_NONE, b"A" * 16),
+        encode_v2_page(2, PIXEL_FORMAT_GRAY, 2, b"A" * 16),
+        # Pixels that do not match the dimensions of the page.
+        encode_v2_page(2, PIXEL_FORMAT_RGB, COMPRESSION_NONE, b"A" * 16),
+        encode_v2_page(2, PIXEL_FORMAT_BILEVEL, COMPRESSION_NONE, b"A" * 16),
+        encode_v2_page(
+            2, PIXEL_FORMAT_GRAY, COMPRESSION_ZLIB, zlib.compress(b"A" * 17)
+        ),
+        # Compressed pixels that are not smaller, or that are corrupted.
+        encode_v2_page(2, PIXEL_FORMAT_GRAY, COMPRESSION_ZLIB, b"A" * 16),
+        encode_v2_page(2, PIXEL_FORMAT_GRAY, COMPRESSION_ZLIB, b"A" * 12),
+    ],
+)
+def test_page_reader_v2_malformed(page: bytes) -> None:
+    first = encode_v2_page(1, PIXEL_FORMAT_GRAY, COMPRESSION_NONE, b"A" * 16)
+    with pytest.raises(errors.ProtocolException):
+        read_v2_pages(first + page, 2)
+
+
+def test_page_reader_v2_decompression_bomb() -> None:
+    """The reader must never decompress more pixels than the page can have."""
+    payload = zlib.compress(b"\x00" * 100 * 1024 * 1024)
+    page = encode_ints([1, 1000, 1000, 72, PIXEL_FORMAT_RGB, COMPRESSION_ZLIB])
+    page += len(payload).to_bytes(4, "big") + payload
+    with pytest.raises(errors.ProtocolException):
+        read_v2_pages(page, 1)
+
+
+def test_page_reader_session() -> None:
+    """A document of a session can fail after some of its pages have been sent."""
+    page = encode_v2_page(1, PIXEL_FORMAT_GRAY, COMPRESSION_NONE, b"A" * 16)
+    stream = io.BytesIO(
+        page + encode_document_end(errors.MaxPageWidthException.error_code)
+    )
+    with pytest.raises(DocumentFailed) as e:
+        with PageReader(
+            stream, 2, ConversionStats(), protocol=PROTOCOL_V2, session=True
+        ) as reader:
+            for _ in reader:
+                pass
+    assert isinstance(e.value.error, errors.MaxPageWidthException)
+
+    # A document that succeeds must not have fewer pages than it claims.
+    stream = io.BytesIO(page + encode_document_end(0))
+    with pytest.raises(errors.ProtocolException):
+        with PageReader(
+            stream, 2, ConversionStats(), protocol=PROTOCOL_V2, session=True
+        ) as reader:
+            for _ in reader:
+                pass
+
+
+def test_read_document_end() -> None:
+    read_document_end(io.BytesIO(encode_document_end(0)))
+    with pytest.raises(DocumentFailed, match="corrupted"):
+        code = errors.DocCorruptedException.error_code
+        read_document_end(io.BytesIO(encode_document_end(code)))
+    with pytest.raises(errors.ProtocolException):
+        read_document_end(io.BytesIO(encode_ints([1, 0])))
+
+
+@pytest.mark.parametrize("protocol", [PROTOCOL_V1, PROTOCOL_V2])
+def test_read_stream_header(protocol: int) -> None:
+    stream = io.BytesIO(encode_stream_header(protocol, 3))
+    assert read_stream_header(stream) == (protocol, 3)
+
+
+def test_read_stream_header_unsupported() -> None:
+    with pytest.raises(errors.UnsupportedProtocolException):
+        read_stream_header(io.BytesIO(encode_ints([0, 3, 1])))
+
+
+def test_read_into() -> None:
+    buf = bytearray(6)
+    read_into(io.BytesIO(b"ABCDEF"), memoryview(buf))
+    assert buf == b"ABCDEF"
+
+    with pytest.raises(errors.ConverterProcException):
+        read_into(io.BytesIO(b"ABC"), memoryview(buf))
+
+
+def test_input_writer() -> None:
+    data = os.urandom(INPUT_CHUNK_SIZE * 3 + 100)
+    r, w = os.pipe()
+    with open(r, "rb") as stdout, open(w, "wb") as stdin:
+        writer = InputWriter(io.BytesIO(data), stdin)
+        writer.start()
+        # The pipe holds much less than the document, so the writer must send it
+        # while we read it.
+        assert stdout.read() == data
+        writer.join()
+        assert stdin.closed
+
+
+def test_input_writer_broken_pipe() -> None:
+    r, w = os.pipe()
+    os.close(r)
+    with open(w, "wb") as stdin:
+        writer = InputWriter(io.BytesIO(b"A" * INPUT_CHUNK_SIZE), stdin)
+        writer.start()
+        with pytest.raises(errors.ConverterProcException):
+            writer.join()
+
+
+class FailingFile(io.BytesIO):
+    def readinto(self, b: bytearray) -> int:  # type: ignore [override]
+        raise OSError("Read error")
+
+
+def test_input_writer_read_error() -> None:
+    stdin = io.BytesIO()
+    writer = InputWriter(FailingFile(), stdin)
+    writer.start()
+    with pytest.raises(OSError, match="Read error"):
+        writer.join()
+    # The conversion process must not wait for more data.
+    assert stdin.closed
+
+
+def test_input_writer_session() -> None:
+    """In a session, documents are sent with their size, over the same stdin."""
+    documents = [b"", os.urandom(INPUT_CHUNK_SIZE + 100), b"ABC"]
+    stdin = io.BytesIO()
+    for document in documents:
+        writer = InputWriter(io.BytesIO(document), stdin, len(document))
+        writer.start()
+        writer.join()
+        assert not stdin.closed
+
+    stream = io.BytesIO(stdin.getvalue())
+    for document in documents:
+        assert int.from_bytes(stream.read(8), "big") == len(document)
+        assert stream.read(len(document)) == document
+    assert stream.read() == b""
+
+
+def test_input_writer_session_truncated() -> None:
+    stdin = io.BytesIO()
+    writer = InputWriter(io.BytesIO(b"ABC"), stdin, 4)
+    writer.start()
+    with pytest.raises(IOError):
+        writer.join()
+    # The conversion process must not wait for the rest of the document.
+    assert stdin.closed
+
+
+def test_provider_reads_settings_once(mocker: MockerFixture) -> None:
+    """The options of a provider fall back to the settings, which are read once."""
+    settings_init = mocker.spy(Settings, "__init__")
+    Dummy()
+    assert settings_init.call_count == 1
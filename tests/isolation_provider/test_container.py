@@ -6,8 +6,14 @@ from pytest_mock import MockerFixture
 from pytest_subprocess import FakeProcess
 
 from dangerzone import errors
-from dangerzone.container_utils import expected_image_name, init_podman_command
-from dangerzone.isolation_provider.container import Container
+from dangerzone.container_utils import (
+    RuntimeResources,
+    expected_image_name,
+    init_podman_command,
+)
+from dangerzone.conversion.render import RENDER_WORKERS_ENV
+from dangerzone.document import Document
+from dangerzone.isolation_provider.container import MEMORY_PER_CONVERSION, Container
 from dangerzone.isolation_provider.qubes import is_qubes_native_conversion
 from dangerzone.podman import machine
 from dangerzone.updater import SignatureError, UpdaterError
@@ -60,3 +66,53 @@ class TestContainerTermination(IsolationProviderTermination):
         if platform.system() != "Linux":
             m = machine.PodmanMachineManager()
             m.stop()
+
+
+@pytest.mark.parametrize(
+    "cpus,memory,expected",
+    [
+        (1, 16 * 1024**3, 1),
+        (32, 64 * 1024**3, 8),
+        (32, 3 * 1024**3, 3),
+        (8, 0, 1),
+    ],
+)
+def test_parallel_conversions(
+    cpus: int, memory: int, expected: int, mocker: MockerFixture
+) -> None:
+    resources = RuntimeResources(cpus, memory, True, True)
+    mocker.patch(
+        "dangerzone.container_utils.get_runtime_resources", return_value=resources
+    )
+    assert Container().get_max_parallel_conversions() == expected
+    assert Container(parallel_conversions=2).get_max_parallel_conversions() == 2
+
+
+def test_resource_args(sample_pdf: str, mocker: MockerFixture) -> None:
+    resources = RuntimeResources(16, 16 * 1024**3, True, True)
+    mocker.patch(
+        "dangerzone.container_utils.get_runtime_resources", return_value=resources
+    )
+    doc = Document(sample_pdf)
+
+    # A single conversion at a time is not limited.
+    provider = Container(parallel_conversions=1)
+    assert provider.get_resource_args() == []
+    assert RENDER_WORKERS_ENV not in provider.get_conversion_env(doc)
+
+    provider = Container(parallel_conversions=4)
+    assert provider.get_resource_args() == ["--cpus", "4", "--memory", str(4 * 1024**3)]
+    assert provider.get_conversion_env(doc)[RENDER_WORKERS_ENV] == "4"
+
+    # Containers are never limited to less memory than a conversion needs.
+    provider = Container(parallel_conversions=32)
+    assert provider.get_resource_args() == [
+        "--cpus",
+        "1",
+        "--memory",
+        str(MEMORY_PER_CONVERSION),
+    ]
+
+    # Limits that the container runtime does not support are skipped.
+    resources.can_limit_memory = False
+    assert provider.get_resource_args() == ["--cpus", "1"]
@@ -1,11 +1,27 @@
+import concurrent.futures
 import os
+import platform
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+from typing import Any, Dict, List
 
+import fitz
 import pytest
 from pytest_mock import MockerFixture
 
 from dangerzone.conversion import errors
-from dangerzone.isolation_provider.base import IsolationProvider
-from dangerzone.isolation_provider.dummy import Dummy
+from dangerzone.conversion.protocol import PROTOCOL_V1, PROTOCOL_V2, SESSION_ENV
+from dangerzone.document import Document
+from dangerzone.isolation_provider.base import (
+    ConversionStats,
+    IsolationProvider,
+    PageReader,
+    read_stream_header,
+)
+from dangerzone.isolation_provider.dummy import DUMMY_PATTERNS, Dummy
 
 from .base import IsolationProviderTermination
 
@@ -31,3 +47,256 @@ class TestDummyTermination(IsolationProviderTermination):
             return_value=errors.DocFormatUnsupported(),
         )
         super().test_failed(provider, mocker)
+
+
+def peak_rss_kib(input_filename: str, output_filename: str, pages: int) -> int:
+    """Convert a document with random pixels in a new process, and get its peak RSS."""
+    script = textwrap.dedent(
+        f"""
+        import resource, sys
+
+        sys.dangerzone_dev = True
+
+        from dangerzone.document import Document
+        from dangerzone.isolation_provider.dummy import DUMMY_PATTERNS, Dummy
+
+        provider = Dummy(pages={pages}, width=150, height=150, pattern="random")
+        doc = Document({input_filename!r}, {output_filename!r})
+        provider.convert(doc, None)
+        assert doc.is_safe()
+        print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        """
+    )
+    env = {**os.environ, "DANGERZONE_MODE": "cli"}
+    proc = subprocess.run(
+        [sys.executable, "-c", script], env=env, capture_output=True, check=True
+    )
+    peak_rss = int(proc.stdout.split()[-1])
+    # On macOS, the peak RSS is reported in bytes instead of kibibytes.
+    if platform.system() == "Darwin":
+        peak_rss //= 1024
+    return peak_rss
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows", reason="the resource module is Unix-only"
+)
+def test_bounded_memory(sample_pdf: str, tmp_path: Path) -> None:
+    output_filename = str(tmp_path / "safe.pdf")
+    few_pages_rss = peak_rss_kib(sample_pdf, output_filename, pages=100)
+    many_pages_rss = peak_rss_kib(sample_pdf, output_filename, pages=1000)
+
+    # The extra 900 pages amount to ~60MiB of incompressible image data. If the whole
+    # safe PDF was kept in memory, the peak RSS would grow by at least as much.
+    assert many_pages_rss - few_pages_rss < 20 * 1024
+
+
+@pytest.mark.parametrize(
+    "pattern,blank_page_threshold,blank_pages",
+    [("solid", 0, 3), ("random", 0, 0), ("random", 1, 3)],
+)
+def test_blank_pages(
+    pattern: str,
+    blank_page_threshold: float,
+    blank_pages: int,
+    sample_pdf: str,
+    tmp_path: Path,
+) -> None:
+    output_filename = str(tmp_path / "safe.pdf")
+    provider = Dummy(
+        pages=3, pattern=pattern, blank_page_threshold=blank_page_threshold
+    )
+    doc = Document(sample_pdf, output_filename)
+    provider.convert(doc, None)
+    assert doc.is_safe()
+
+    with fitz.open(output_filename) as safe_doc:
+        assert safe_doc.page_count == 3
+        # Blank pages must not have any images.
+        images = sum(len(page.get_images()) for page in safe_doc)
+        assert images == 3 - blank_pages
+
+
+def test_page_throughput() -> None:
+    """Pages must be streamed as frames, without a per-field overhead."""
+    provider = Dummy(pages=5000, width=10, height=10)
+    # Nothing reads the progress events of the conversion process here.
+    provider.proc_stderr = subprocess.DEVNULL
+    p = provider.start_doc_to_pixels_proc(Document())
+    assert p.stdin is not None and p.stdout is not None
+    p.stdin.close()
+
+    start = time.perf_counter()
+    protocol, n_pages = read_stream_header(p.stdout)
+    with PageReader(p.stdout, n_pages, ConversionStats(), protocol=protocol) as reader:
+        pages = sum(1 for _ in reader)
+    elapsed = time.perf_counter() - start
+    assert p.wait() == 0
+
+    assert pages == 5000
+    # Small pages stream at several thousand pages/s on a single core. Leave a wide
+    # margin for slow runners.
+    assert pages / elapsed > 500
+
+
+@pytest.mark.parametrize(
+    "protocol,page_compression",
+    [(PROTOCOL_V1, "none"), (PROTOCOL_V2, "none"), (PROTOCOL_V2, "zlib")],
+)
+def test_protocol(
+    protocol: int, page_compression: str, sample_pdf: str, tmp_path: Path
+) -> None:
+    """The host must accept pages in every protocol version and compression."""
+    output_filename = str(tmp_path / "safe.pdf")
+    provider = Dummy(pages=3, page_compression=page_compression)
+    provider.protocol = protocol
+    doc = Document(sample_pdf, output_filename)
+    provider.convert(doc, None)
+    assert doc.is_safe()
+    with fitz.open(output_filename) as safe_doc:
+        assert safe_doc.page_count == 3
+
+
+@pytest.mark.parametrize("pattern", DUMMY_PATTERNS)
+def test_patterns(pattern: str, sample_pdf: str, tmp_path: Path) -> None:
+    output_filename = str(tmp_path / "safe.pdf")
+    provider = Dummy(pages=2, width=50, height=60, pattern=pattern)
+    provider.protocol = PROTOCOL_V2
+    doc = Document(sample_pdf, output_filename)
+    provider.convert(doc, None)
+    assert doc.is_safe()
+    with fitz.open(output_filename) as safe_doc:
+        assert safe_doc.page_count == 2
+
+
+def test_unknown_pattern() -> None:
+    with pytest.raises(ValueError):
+        Dummy(pattern="foo")
+
+
+def test_session(sample_pdf: str, tmp_path: Path, mocker: MockerFixture) -> None:
+    """Documents are converted in sessions, and fail independently of each other."""
+    empty_pdf = tmp_path / "empty.pdf"
+    empty_pdf.touch()
+    inputs = [sample_pdf, str(empty_pdf), sample_pdf, sample_pdf]
+    documents = [
+        Document(input_filename, str(tmp_path / f"safe-{i}.pdf"))
+        for i, input_filename in enumerate(inputs)
+    ]
+    provider = Dummy(pages=3, session_size=3)
+    start_proc = mocker.spy(provider, "start_doc_to_pixels_proc")
+
+    sessions = provider.group_documents(documents)
+    assert [len(session) for session in sessions] == [3, 1]
+    for session in sessions:
+        provider.convert_session(session, None)
+
+    assert start_proc.call_count == 2
+    assert [doc.is_safe() for doc in documents] == [True, False, True, True]
+    assert documents[1].is_failed()
+    for i in [0, 2, 3]:
+        with fitz.open(documents[i].output_filename) as safe_doc:
+            assert safe_doc.page_count == 3
+
+
+def test_session_restart(
+    sample_pdf: str, tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """If the conversion process of a session fails, a new one converts the rest."""
+    documents = [
+        Document(sample_pdf, str(tmp_path / f"safe-{i}.pdf")) for i in range(3)
+    ]
+    provider = Dummy(pages=3, session_size=3)
+    convert_with_proc = provider.convert_with_proc
+
+    def fail_first(document: Document, *args: Any, **kwargs: Any) -> None:
+        if document is documents[0]:
+            raise errors.ProtocolException()
+        convert_with_proc(document, *args, **kwargs)
+
+    mocker.patch.object(provider, "convert_with_proc", side_effect=fail_first)
+    start_proc = mocker.spy(provider, "start_doc_to_pixels_proc")
+    provider.convert_session(documents, None)
+
+    assert start_proc.call_count == 2
+    assert [doc.is_safe() for doc in documents] == [False, True, True]
+
+
+def test_session_fails_after_conversion(
+    sample_pdf: str, tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """Documents that have been converted stay safe, even if their session fails."""
+    documents = [
+        Document(sample_pdf, str(tmp_path / f"safe-{i}.pdf")) for i in range(2)
+    ]
+    provider = Dummy(pages=3, session_size=2)
+    convert_in_session = provider.convert_in_session
+
+    def fail_last(document: Document, *args: Any) -> None:
+        convert_in_session(document, *args)
+        if document is documents[-1]:
+            raise errors.ProtocolException()
+
+    mocker.patch.object(provider, "convert_in_session", side_effect=fail_last)
+    provider.convert_session(documents, None)
+    assert all(doc.is_safe() for doc in documents)
+
+
+def test_convert_without_session(
+    sample_pdf: str, tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """Only batches of documents are converted in sessions."""
+    provider = Dummy(pages=3, session_size=3)
+    convert_session = mocker.spy(provider, "convert_session")
+    doc = Document(sample_pdf, str(tmp_path / "safe.pdf"))
+    provider.convert(doc, None)
+    assert doc.is_safe()
+    convert_session.assert_not_called()
+    assert SESSION_ENV not in provider.get_conversion_env(doc)
+    assert provider.get_conversion_env(doc, session=True)[SESSION_ENV] == "1"
+
+
+def test_session_preview(
+    sample_pdf: str, tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """Previews are never OCRed, even if they are converted in a session."""
+    documents = [
+        Document(sample_pdf, str(tmp_path / f"safe-{i}.pdf"), preview=True)
+        for i in range(2)
+    ]
+    provider = Dummy(pages=3, pattern="text", session_size=2)
+    ocr_page = mocker.patch.object(provider, "ocr_page")
+    get_ocr_engine = mocker.patch.object(provider, "get_ocr_engine")
+
+    assert provider.group_documents(documents) == [documents]
+    provider.convert_session(documents, "eng")
+
+    assert all(doc.is_safe() for doc in documents)
+    ocr_page.assert_not_called()
+    get_ocr_engine.assert_not_called()
+
+
+def test_parallel_progress(sample_pdf: str, tmp_path: Path) -> None:
+    """Documents that are converted in parallel report progress to their own
+    callbacks."""
+    documents = [
+        Document(sample_pdf, str(tmp_path / f"safe-{i}.pdf")) for i in range(4)
+    ]
+    provider = Dummy(pages=3, parallel_conversions=4)
+    assert provider.get_max_parallel_conversions() == 4
+    progress: Dict[str, List[str]] = {doc.id: [] for doc in documents}
+
+    def convert(document: Document) -> None:
+        provider.convert(
+            document,
+            None,
+            lambda error, text, percentage: progress[document.id].append(text),
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(convert, documents))
+
+    assert all(doc.is_safe() for doc in documents)
+    for doc in documents:
+        assert progress[doc.id].count("Successfully converted document") == 1
+    assert provider.progress_callbacks == {}
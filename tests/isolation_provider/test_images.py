@@ -0,0 +1,153 @@
+import os
+from typing import Optional
+
+import fitz
+import pytest
+
+from dangerzone.conversion.common import DEFAULT_DPI
+from dangerzone.isolation_provider.images import (
+    RGB,
+    find_blank_color,
+    insert_blank_page,
+    insert_image_page,
+    is_bilevel,
+    reencode_as_jpeg,
+    select_image_codec,
+    to_grayscale,
+)
+
+
+def create_pixmap(pixels: bytes, width: int = 100, height: int = 100) -> fitz.Pixmap:
+    pixmap = fitz.Pixmap(fitz.Colorspace(fitz.CS_RGB), width, height, pixels, False)
+    pixmap.set_dpi(DEFAULT_DPI, DEFAULT_DPI)
+    return pixmap
+
+
+def page_image_filter(doc: fitz.Document) -> str:
+    xref = doc[0].get_images()[0][0]
+    return doc.xref_get_key(xref, "Filter")[1]
+
+
+@pytest.mark.parametrize(
+    "image_codec,pixels,expected",
+    [
+        ("lossless", os.urandom(100 * 100 * 3), "lossless"),
+        ("jpeg", b"\xff" * 100 * 100 * 3, "jpeg"),
+        # A page with a white background, and a few lines of "text".
+        ("auto", b"\xff" * 100 * 90 * 3 + b"\x00" * 100 * 10 * 3, "lossless"),
+        # A page that looks like a photo.
+        ("auto", os.urandom(100 * 100 * 3), "jpeg"),
+    ],
+)
+def test_select_image_codec(image_codec: str, pixels: bytes, expected: str) -> None:
+    assert select_image_codec(create_pixmap(pixels), image_codec) == expected
+
+
+def page_with_ink(ink_pixels: int) -> bytes:
+    """Create a white page with some black pixels, spread across the page."""
+    pixels = bytearray(b"\xff" * 100 * 100 * 3)
+    for i in range(ink_pixels):
+        pixel = i * 997 % (100 * 100)
+        pixels[pixel * 3 : pixel * 3 + 3] = b"\x00\x00\x00"
+    return bytes(pixels)
+
+
+@pytest.mark.parametrize(
+    "pixels,ink_threshold,expected",
+    [
+        (b"\x10\x20\x30" * 100 * 100, 0, (0x10, 0x20, 0x30)),
+        (page_with_ink(0), 0, (255, 255, 255)),
+        (page_with_ink(1), 0, None),
+        (page_with_ink(10), 0.001, (255, 255, 255)),
+        (page_with_ink(11), 0.001, None),
+        (os.urandom(100 * 100 * 3), 0.5, None),
+    ],
+)
+def test_find_blank_color(
+    pixels: bytes, ink_threshold: float, expected: Optional[RGB]
+) -> None:
+    assert find_blank_color(create_pixmap(pixels), ink_threshold) == expected
+
+
+@pytest.mark.parametrize("color", [(255, 255, 255), (0x10, 0x20, 0x30)])
+def test_insert_blank_page(color: RGB) -> None:
+    pixmap = create_pixmap(bytes(color) * 100 * 100)
+    doc = fitz.Document()
+    insert_blank_page(doc, pixmap, color)
+
+    assert not doc[0].get_images()
+    rendered = doc[0].get_pixmap(dpi=DEFAULT_DPI)
+    assert rendered.samples == pixmap.samples
+
+
+@pytest.mark.parametrize(
+    "image_codec,expected", [("lossless", "/FlateDecode"), ("jpeg", "/DCTDecode")]
+)
+def test_insert_image_page(image_codec: str, expected: str) -> None:
+    pixmap = create_pixmap(os.urandom(100 * 200 * 3), width=100, height=200)
+    doc = fitz.Document()
+    insert_image_page(doc, pixmap, image_codec, 85)
+    doc = fitz.open("pdf", doc.tobytes(deflate_images=True))
+
+    assert doc[0].rect == fitz.Rect(0, 0, 48, 96)
+    assert page_image_filter(doc) == expected
+
+
+def test_reencode_as_jpeg() -> None:
+    pixmap = create_pixmap(os.urandom(100 * 100 * 3))
+    doc = fitz.Document()
+    insert_image_page(doc, pixmap, "lossless", 85)
+    doc = fitz.open("pdf", doc.tobytes(deflate_images=True))
+    lossless_size = len(doc.tobytes())
+
+    reencode_as_jpeg(doc, pixmap, 50)
+    doc = fitz.open("pdf", doc.tobytes())
+    assert page_image_filter(doc) == "/DCTDecode"
+    assert len(doc.tobytes()) < lossless_size
+    # The page must still be rendered, with roughly the same colors.
+    rendered = doc[0].get_pixmap(dpi=DEFAULT_DPI)
+    assert (rendered.width, rendered.height) == (100, 100)
+
+
+@pytest.mark.parametrize(
+    "pixels,grayscale",
+    [
+        (bytes(i // 3 % 256 for i in range(100 * 100 * 3)), True),
+        (b"\x10\x10\x11" + b"\x10" * (100 * 100 - 1) * 3, False),
+        (os.urandom(100 * 100 * 3), False),
+    ],
+)
+def test_to_grayscale(pixels: bytes, grayscale: bool) -> None:
+    gray = to_grayscale(create_pixmap(pixels))
+    if not grayscale:
+        assert gray is None
+    else:
+        assert gray is not None
+        assert gray.n == 1
+        assert gray.samples == pixels[::3]
+        assert gray.xres == DEFAULT_DPI
+
+
+# Rows of 100 pixels need padding to a whole byte, whereas rows of 96 do not.
+@pytest.mark.parametrize("width", [100, 96])
+def test_insert_bilevel_page(width: int) -> None:
+    pixels = bytes(0 if i % 7 < 3 else 255 for i in range(width * 100))
+    pixmap = fitz.Pixmap(fitz.Colorspace(fitz.CS_GRAY), width, 100, pixels, False)
+    pixmap.set_dpi(DEFAULT_DPI, DEFAULT_DPI)
+    assert is_bilevel(pixmap)
+
+    doc = fitz.Document()
+    insert_image_page(doc, pixmap, "lossless", 85)
+    doc = fitz.open("pdf", doc.tobytes(deflate_images=True))
+
+    xref = doc[0].get_images()[0][0]
+    assert doc.xref_get_key(xref, "BitsPerComponent")[1] == "1"
+    rendered = doc[0].get_pixmap(dpi=DEFAULT_DPI, colorspace=fitz.csGRAY)
+    assert rendered.samples == pixels
+
+
+def test_is_bilevel() -> None:
+    gray = fitz.Pixmap(fitz.Colorspace(fitz.CS_GRAY), 2, 1, b"\x00\x80", False)
+    assert not is_bilevel(gray)
+    rgb = create_pixmap(b"\x00\xff\x00" * 100 * 100)
+    assert not is_bilevel(rgb)
@@ -0,0 +1,111 @@
+import io
+import json
+from pathlib import Path
+from typing import List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from dangerzone.conversion.events import EVENT_PREFIX, MAX_EVENT_SIZE, EventWriter
+from dangerzone.document import Document
+from dangerzone.isolation_provider.dummy import Dummy
+from dangerzone.isolation_provider.metrics import (
+    STAGE_TEXTS,
+    ConversionEvent,
+    StageTimings,
+    parse_event,
+)
+
+
+def write_events(enabled: bool = True) -> List[bytes]:
+    stderr = io.TextIOWrapper(io.BytesIO())
+    events = EventWriter(stderr, enabled=enabled)
+    with events.stage("mime"):
+        pass
+    events.emit("page", "render", page=1, pages=2)
+    stderr.flush()
+    return stderr.buffer.getvalue().splitlines(keepends=True)
+
+
+def test_parse_event() -> None:
+    lines = write_events()
+    events = [parse_event(line) for line in lines]
+    assert [(e.event, e.stage) for e in events if e] == [
+        ("start", "mime"),
+        ("end", "mime"),
+        ("page", "render"),
+    ]
+    assert events[2] and (events[2].page, events[2].pages) == (1, 2)
+    assert write_events(enabled=False) == []
+
+
+def event_line(**record: object) -> bytes:
+    return EVENT_PREFIX + json.dumps(record).encode() + b"\n"
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        b"Some output of MuPDF\n",
+        EVENT_PREFIX + b"not json\n",
+        EVENT_PREFIX + b"[]\n",
+        event_line(event="foo", stage="mime", time=1),
+        event_line(event="start", stage="foo", time=1),
+        event_line(event="start", stage="mime", time=-1),
+        event_line(event="start", stage="mime", time="1"),
+        event_line(event="start", stage="mime", time=True),
+        event_line(event="page", stage="render", time=1, page=-1),
+        event_line(event="page", stage="render", time=1, pages=10**9),
+        event_line(event="start", stage="mime", time=1, text="A" * MAX_EVENT_SIZE),
+        EVENT_PREFIX + b"[" * 1000 + b"\n",
+    ],
+)
+def test_parse_event_invalid(line: bytes) -> None:
+    assert parse_event(line) is None
+
+
+def test_handle_event_text(mocker: MockerFixture) -> None:
+    """The progress text of a stage is the host's, and never the sandbox's."""
+    provider = Dummy()
+    print_progress = mocker.patch.object(provider, "print_progress")
+    document = Document()
+    for line in [
+        event_line(event="start", stage="mime", time=1, text="\x1b[31mEvil"),
+        event_line(event="start", stage="receive", time=1, text="Evil"),
+        event_line(event="end", stage="mime", time=1, text="Evil"),
+    ]:
+        event = parse_event(line)
+        assert event is not None
+        provider.handle_event(document, event, StageTimings())
+
+    print_progress.assert_called_once_with(document, False, STAGE_TEXTS["mime"], 0)
+
+
+def test_stage_timings() -> None:
+    timings = StageTimings()
+    for event, stage, time in [
+        ("start", "mime", 0.0),
+        ("end", "mime", 0.5),
+        ("start", "render", 1.0),
+        ("page", "render", 1.5),
+        ("page", "render", 3.5),
+        ("end", "render", 4.0),
+    ]:
+        timings.add(ConversionEvent(event, stage, time, 0.0))
+    assert timings.summary() == (
+        "mime 0.50s, render 3.00s, 2 page(s), slowest page took 2.00s to render"
+    )
+    assert StageTimings().summary() == "no events"
+
+
+def test_metrics_sink(sample_pdf: str, tmp_path: Path) -> None:
+    events = []
+    provider = Dummy(pages=3, metrics_sink=lambda doc, event: events.append(event))
+    provider.convert(Document(sample_pdf, str(tmp_path / "safe.pdf")), None)
+    assert [(e.event, e.page) for e in events] == [
+        ("start", None),
+        ("page", 1),
+        ("page", 2),
+        ("page", 3),
+        ("end", None),
+    ]
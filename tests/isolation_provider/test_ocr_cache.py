@@ -0,0 +1,98 @@
+import os
+from pathlib import Path
+
+from dangerzone.isolation_provider.dummy import Dummy
+from dangerzone.isolation_provider.ocr import OCREngine, OCRPool
+from dangerzone.isolation_provider.ocr_cache import OCRCache
+
+PIXELS = b"\x00\xff" * 50 * 100
+
+
+def create_cache(tmp_path: Path, max_size: int = 1024, **kwargs: str) -> OCRCache:
+    params = {"ocr_lang": "eng", "image_codec": "lossless"}
+    params.update(kwargs)
+    return OCRCache(
+        max_size,
+        params["ocr_lang"],
+        str(tmp_path / "tessdata"),
+        params["image_codec"],
+        85,
+        directory=tmp_path / "ocr",
+    )
+
+
+def test_disabled_by_default() -> None:
+    # The cache keeps the contents of the converted documents, so it's opt-in.
+    assert Dummy().start_ocr_cache("eng") is None
+    assert Dummy(ocr_cache=True).start_ocr_cache("eng") is not None
+
+
+def test_key(tmp_path: Path) -> None:
+    cache = create_cache(tmp_path)
+    key = cache.key(PIXELS, 100, 100, True)
+    assert key == create_cache(tmp_path).key(PIXELS, 100, 100, True)
+
+    # Anything that affects the OCR result must change the key.
+    assert key != cache.key(PIXELS[::-1], 100, 100, True)
+    assert key != cache.key(PIXELS, 50, 200, True)
+    assert key != cache.key(PIXELS, 100, 100, False)
+    assert key != create_cache(tmp_path, ocr_lang="deu").key(PIXELS, 100, 100, True)
+    assert key != create_cache(tmp_path, image_codec="jpeg").key(PIXELS, 100, 100, True)
+
+    # Updating the language models must change the key as well.
+    (tmp_path / "tessdata").mkdir()
+    (tmp_path / "tessdata" / "eng.traineddata").write_bytes(b"model")
+    assert key != create_cache(tmp_path).key(PIXELS, 100, 100, True)
+
+
+def test_get_put(tmp_path: Path) -> None:
+    cache = create_cache(tmp_path)
+    key = cache.key(PIXELS, 100, 100, True)
+    assert cache.get(key) is None
+    cache.put(key, b"page")
+    assert cache.get(key) == b"page"
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.summary() == "OCR cache hits: 1, misses: 1"
+
+
+def test_evict_least_recently_used(tmp_path: Path) -> None:
+    cache = create_cache(tmp_path, max_size=300)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, b"x" * 100)
+        # Make sure that the pages have distinct modification times.
+        os.utime(cache.directory / f"{key}.pdf", ns=(i * 10**9, i * 10**9))
+
+    # Using a page marks it as recently used, so it must survive the eviction.
+    assert cache.get("a") is not None
+    cache.put("d", b"x" * 100)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.get("d") is not None
+    assert cache.size == 300
+
+
+def test_put_error(tmp_path: Path) -> None:
+    """Failing to store a page must not fail the conversion."""
+    (tmp_path / "ocr").write_bytes(b"not a directory")
+    cache = create_cache(tmp_path)
+    cache.put("a", b"page")
+    assert cache.get("a") is None
+
+
+def test_pool_uses_cache(tmp_path: Path) -> None:
+    cache = create_cache(tmp_path)
+    key = cache.key(PIXELS, 100, 100, True)
+    cache.put(key, b"cached page")
+
+    engine = OCREngine(1, "eng", str(tmp_path / "tessdata"))
+    pool = OCRPool(engine, cache=cache)
+    try:
+        # The page is in the cache, so it must not reach the OCR workers.
+        pool.submit(PIXELS, 100, 100, grayscale=True)
+        assert pool.pop() == b"cached page"
+        assert cache.hits == 1
+    finally:
+        pool.close()
+        engine.close()
@@ -1,3 +1,4 @@
+import logging
 import os
 import pathlib
 import subprocess
@@ -23,7 +24,9 @@ elif os.environ.get("DUMMY_CONVERSION", False):
 class QubesWait(Qubes):
     """Qubes isolation provider that blocks until the disposable qube has started."""
 
-    def start_doc_to_pixels_proc(self, document: Document) -> subprocess.Popen:
+    def start_doc_to_pixels_proc(
+        self, document: Document, session: bool = False
+    ) -> subprocess.Popen:
         # Check every 100ms if the disposable qube has started. Qubes gives us no
         # way to figure this out, but `qrexec-client-vm` has an interesting
         # property. It will start a vchan server **only** once the disposable qube
@@ -35,7 +38,7 @@ class QubesWait(Qubes):
         # since it's test code, we can live with it.
         #
         # [1]: https://www.qubes-os.org/doc/qrexec-internals/#domx-invoke-execution-of-qubes-service-qubesservice-in-domy
-        proc = super().start_doc_to_pixels_proc(document)
+        proc = super().start_doc_to_pixels_proc(document, session)
         for i in range(300):
             for p in pathlib.Path(f"/proc/{proc.pid}/fd").iterdir():
                 if str(p.resolve()).startswith("/dev/xen"):
@@ -52,6 +55,23 @@ def provider() -> QubesWait:
     return QubesWait()
 
 
+def test_unsupported_options(
+    sample_pdf: str, tmp_path: pathlib.Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    provider = Qubes(session_size=3, parallel_conversions=2)
+    for _ in range(3):
+        assert provider.get_session_size() == 1
+        assert provider.get_max_parallel_conversions() == 1
+    # The options that are ignored are reported only once.
+    warnings = [r for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 2
+
+    # A document cannot be converted only partly, so it fails.
+    doc = Document(sample_pdf, str(tmp_path / "safe.pdf"), preview=True)
+    provider.convert(doc, None)
+    assert doc.is_failed()
+
+
 class TestQubes(IsolationProviderTest):
     def test_out_of_ram(
         self,
@@ -0,0 +1,120 @@
+import platform
+import subprocess
+import sys
+from pathlib import Path
+from typing import List
+
+import fitz
+import pytest
+
+from dangerzone.conversion.common import DEFAULT_DPI
+from dangerzone.isolation_provider.base import pixels_to_pixmap
+from dangerzone.isolation_provider.dummy import Dummy
+from dangerzone.isolation_provider.images import insert_image_page, to_grayscale
+from dangerzone.isolation_provider.writer import BYTES_PER_FLUSH, SafePDFWriter
+
+
+def render_pages(filename: Path) -> List[bytes]:
+    with fitz.open(filename) as doc:
+        return [page.get_pixmap(dpi=DEFAULT_DPI).samples for page in doc]
+
+
+def test_insert_pixmap(sample_pdf: str, tmp_path: Path) -> None:
+    """Inserting pixels directly must look the same as inserting a PDF per page."""
+    with fitz.open(sample_pdf) as doc:
+        pages = [page.get_pixmap(dpi=DEFAULT_DPI) for page in doc]
+
+    direct = tmp_path / "direct.pdf"
+    with SafePDFWriter(str(direct), pages_per_flush=1) as safe_doc:
+        for pix in pages:
+            pixmap = pixels_to_pixmap(pix.samples, pix.width, pix.height)
+            # Convert pages without colors to grayscale, like the round trip does.
+            gray_pixmap = to_grayscale(pixmap)
+            safe_doc.insert_pixmap(gray_pixmap if gray_pixmap is not None else pixmap)
+
+    round_trip = tmp_path / "round-trip.pdf"
+    with SafePDFWriter(str(round_trip), pages_per_flush=1) as safe_doc:
+        for pix in pages:
+            pixmap = pixels_to_pixmap(pix.samples, pix.width, pix.height)
+            page_doc = fitz.Document()
+            insert_image_page(page_doc, to_grayscale(pixmap) or pixmap, "lossless", 85)
+            page_pdf = fitz.open("pdf", page_doc.tobytes(deflate_images=True))
+            safe_doc.insert_pdf(page_pdf)
+
+    assert render_pages(direct) == render_pages(round_trip)
+    # The images must be compressed, as if they were inserted as PDFs.
+    assert direct.stat().st_size < round_trip.stat().st_size * 1.1
+
+
+def test_insert_pixmap_dpi(tmp_path: Path) -> None:
+    """The size of a page must not depend on the DPI that it was rendered with."""
+    filename = tmp_path / "safe.pdf"
+    with SafePDFWriter(str(filename)) as safe_doc:
+        for dpi in [50, DEFAULT_DPI]:
+            # A page of 2x1 inches.
+            pixels = b"\x80" * (dpi * 2 * dpi * 3)
+            pixmap = pixels_to_pixmap(pixels, dpi * 2, dpi, dpi)
+            safe_doc.insert_pixmap(pixmap)
+
+    with fitz.open(filename) as doc:
+        assert [page.rect for page in doc] == [fitz.Rect(0, 0, 144, 72)] * 2
+
+
+# Insert 40 distinct pages of 2000x2000 pixels (about 460 MiB of raw pixels), and
+# report how much the peak memory of the process grew, in MiB.
+MEMORY_SCRIPT = """
+import resource
+import sys
+
+from dangerzone.isolation_provider.base import pixels_to_pixmap
+from dangerzone.isolation_provider.dummy import dummy_pixels
+from dangerzone.isolation_provider.writer import SafePDFWriter
+
+pixels = dummy_pixels("gray", 2000, 2000)
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+with SafePDFWriter(sys.argv[1]) as safe_doc:
+    for i in range(1, 41):
+        pixels = bytes([i]) + pixels[1:]
+        safe_doc.insert_pixmap(pixels_to_pixmap(pixels, 2000, 2000))
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print((after - before) // 1024)
+"""
+
+
+@pytest.mark.skipif(platform.system() != "Linux", reason="Measures RSS on Linux")
+def test_memory_is_bounded(tmp_path: Path) -> None:
+    """Pages that are inserted as pixels must not pile up in memory."""
+    output = subprocess.run(
+        [sys.executable, "-c", MEMORY_SCRIPT, str(tmp_path / "safe.pdf")],
+        check=True,
+        stdout=subprocess.PIPE,
+        cwd=Path(__file__).parents[2],
+    ).stdout
+    assert int(output) < 2 * BYTES_PER_FLUSH // 1024**2 + 100
+    with fitz.open(tmp_path / "safe.pdf") as doc:
+        assert doc.page_count == 40
+
+
+@pytest.mark.parametrize("pages_per_flush", [1, 10])
+def test_single_revision(pages_per_flush: int, tmp_path: Path) -> None:
+    """The safe PDF must not keep the incremental updates of the partial file."""
+    filename = tmp_path / "safe.pdf"
+    with SafePDFWriter(str(filename), pages_per_flush=pages_per_flush) as safe_doc:
+        for i in range(6):
+            safe_doc.insert_pixmap(pixels_to_pixmap(bytes([i * 40]) * 30, 5, 2))
+
+    assert filename.read_bytes().count(b"%%EOF") == 1
+    assert not list(tmp_path.glob("*.part*"))
+    with fitz.open(filename) as doc:
+        assert doc.page_count == 6
+
+
+def test_flush_by_size(tmp_path: Path) -> None:
+    filename = tmp_path / "safe.pdf"
+    pixmap = pixels_to_pixmap(b"\x80" * 30, 5, 2)
+    with SafePDFWriter(str(filename), bytes_per_flush=60) as safe_doc:
+        safe_doc.insert_pixmap(pixmap)
+        assert safe_doc._unflushed_bytes == 30
+        safe_doc.insert_pixmap(pixmap)
+        assert safe_doc._unflushed_bytes == 0
+        assert filename.with_suffix(".pdf.part").exists()
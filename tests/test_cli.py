@@ -5,6 +5,7 @@ import copy
 import os
 import platform
 import shutil
+import subprocess
 import sys
 import tempfile
 import time
@@ -22,6 +23,7 @@ from strip_ansi import strip_ansi
 from dangerzone import errors
 from dangerzone.cli import cli_main, display_banner
 from dangerzone.document import ARCHIVE_SUBDIR, SAFE_EXTENSION
+from dangerzone.isolation_provider.ocr_cache import OCRCache
 from dangerzone.isolation_provider.qubes import is_qubes_native_conversion
 
 from .conftest import for_each_doc, for_each_external_doc
@@ -348,6 +350,127 @@ class TestCliConversion(TestCliBasic):
         result = self.run_cli([sample_pdf, "--ocr-lang", "eng"])
         result.assert_success()
 
+    def test_ocr_workers(self, sample_pdf: str) -> None:
+        result = self.run_cli([sample_pdf, "--ocr-lang", "eng", "--ocr-workers", "2"])
+        result.assert_success()
+
+    def test_invalid_ocr_workers(self, sample_pdf: str) -> None:
+        result = self.run_cli([sample_pdf, "--ocr-workers", "0"])
+        result.assert_failure()
+
+    @pytest.mark.parametrize("image_codec", ["lossless", "jpeg", "auto"])
+    def test_image_codec(self, image_codec: str, sample_pdf: str) -> None:
+        result = self.run_cli(
+            [sample_pdf, "--image-codec", image_codec, "--image-quality", "50"]
+        )
+        result.assert_success()
+
+    @pytest.mark.parametrize(
+        "args", [["--image-codec", "png"], ["--image-quality", "0"]]
+    )
+    def test_invalid_image_codec(self, args: list[str], sample_pdf: str) -> None:
+        result = self.run_cli([sample_pdf, *args])
+        result.assert_failure()
+
+    def test_clear_ocr_cache(self, mocker: MockerFixture, tmp_path: Path) -> None:
+        mocker.patch(
+            "dangerzone.isolation_provider.ocr_cache.get_cache_dir",
+            return_value=tmp_path,
+        )
+        (tmp_path / "ocr").mkdir()
+        (tmp_path / "ocr" / "page.pdf").write_bytes(b"page")
+
+        result = self.run_cli(["--clear-ocr-cache"])
+        result.assert_success()
+        assert not (tmp_path / "ocr").exists()
+
+    def test_ocr_cache(
+        self, sample_pdf: str, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        mocker.patch(
+            "dangerzone.isolation_provider.ocr_cache.get_cache_dir",
+            return_value=tmp_path,
+        )
+        # The OCR cache is opt-in.
+        result = self.run_cli([sample_pdf, "--ocr-lang", "eng"])
+        result.assert_success()
+        assert not (tmp_path / "ocr").exists()
+
+        result = self.run_cli([sample_pdf, "--ocr-lang", "eng", "--no-ocr-cache"])
+        result.assert_success()
+        assert not (tmp_path / "ocr").exists()
+
+    def test_ocr_cache_reuse(
+        self, sample_pdf: str, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        mocker.patch(
+            "dangerzone.isolation_provider.ocr_cache.get_cache_dir",
+            return_value=tmp_path,
+        )
+        put = mocker.spy(OCRCache, "put")
+        args = [sample_pdf, "--ocr-lang", "eng", "--ocr-cache"]
+        if os.environ.get("DUMMY_CONVERSION", False):
+            # Blank pages are never OCRed, so send pages with text.
+            args += ["--unsafe-dummy-pattern", "text"]
+
+        def convert(output_filename: Path) -> list[bytes]:
+            result = self.run_cli([*args, "--output-filename", str(output_filename)])
+            result.assert_success()
+            with fitz.open(output_filename) as doc:
+                return [page.get_pixmap().samples for page in doc]
+
+        first = convert(tmp_path / "first.pdf")
+        entries = sorted((tmp_path / "ocr").iterdir())
+        assert entries and put.call_count == len(entries)
+
+        # Converting the same document again takes every page from the cache.
+        assert convert(tmp_path / "second.pdf") == first
+        assert sorted((tmp_path / "ocr").iterdir()) == entries
+        assert put.call_count == len(entries)
+
+        result = self.run_cli(["--clear-ocr-cache"])
+        result.assert_success()
+        assert not (tmp_path / "ocr").exists()
+
+    def test_libreoffice_listener(self, sample_doc: str, tmp_path: Path) -> None:
+        output_filename = str(tmp_path / "safe.pdf")
+        result = self.run_cli(
+            [sample_doc, "--libreoffice-listener", "--output-filename", output_filename]
+        )
+        result.assert_success()
+
+    def test_pages(self, sample_pdf: str, tmp_path: Path) -> None:
+        output_filename = str(tmp_path / "safe.pdf")
+        result = self.run_cli(
+            [sample_pdf, "--pages", "2-", "--output-filename", output_filename]
+        )
+        result.assert_success()
+        with fitz.open(output_filename) as doc:
+            assert doc.page_count == 1
+
+    def test_pages_invalid(self, sample_pdf: str) -> None:
+        result = self.run_cli([sample_pdf, "--pages", "3-1"])
+        result.assert_failure(message="Invalid page range: '3-1'")
+
+    @pytest.mark.parametrize("args", [["--pages", "2-"], ["--preview"]])
+    def test_pages_qubes(
+        self, args: list[str], sample_pdf: str, mocker: MockerFixture
+    ) -> None:
+        mocker.patch("dangerzone.cli.is_qubes_native_conversion", return_value=True)
+        mocker.patch.dict(os.environ, {"DUMMY_CONVERSION": ""})
+        result = self.run_cli([sample_pdf, *args])
+        result.assert_failure(message="not supported on Qubes")
+
+    def test_preview(self, sample_pdf: str, tmp_path: Path) -> None:
+        output_filename = str(tmp_path / "safe.pdf")
+        result = self.run_cli(
+            [sample_pdf, "--preview", "--ocr-lang", "eng"]
+            + ["--output-filename", output_filename]
+        )
+        result.assert_success()
+        with fitz.open(output_filename) as doc:
+            assert doc.page_count == 1
+
     @pytest.mark.parametrize(
         "filename,",
         [
@@ -387,6 +510,18 @@ class TestCliConversion(TestCliBasic):
         # file.
         assert len(os.listdir(tmp_path)) == 2 * len(filenames) + 1
 
+    def test_bulk_session(self, tmp_path: Path, sample_pdf: str) -> None:
+        file_paths = []
+        for filename in ["1.pdf", "2.pdf", "3.pdf"]:
+            doc_path = str(tmp_path / filename)
+            shutil.copyfile(sample_pdf, doc_path)
+            file_paths.append(doc_path)
+
+        result = self.run_cli(file_paths + ["--session-size", "2"])
+        result.assert_success()
+        for doc_path in file_paths:
+            assert os.path.exists(doc_path.replace(".pdf", "-safe.pdf"))
+
     def test_bulk_fail_on_output_filename(
         self, tmp_path: Path, sample_pdf: str
     ) -> None:
@@ -428,6 +563,33 @@ class TestCliConversion(TestCliBasic):
         result = self.run_cli(["--unsafe-dummy-conversion", *file_paths])
         result.assert_success()
 
+    def test_dev_script_ocr(self, tmp_path: Path, sample_pdf: str) -> None:
+        """The OCR workers must not run the script that started them."""
+        doc_path = str(tmp_path / "doc.pdf")
+        shutil.copyfile(sample_pdf, doc_path)
+        script = Path(__file__).parents[1] / "dev_scripts" / "dangerzone-cli"
+        p = subprocess.run(
+            [
+                sys.executable,
+                str(script),
+                "--unsafe-dummy-conversion",
+                "--unsafe-dummy-pattern",
+                "text",
+                "--ocr-lang",
+                "eng",
+                "--ocr-workers",
+                "2",
+                doc_path,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=120,
+        )
+        output = strip_ansi(p.stdout.decode())
+        assert p.returncode == 0, output
+        assert output.count("Assigning ID") == 1
+        assert os.path.exists(str(tmp_path / "doc-safe.pdf"))
+
 
 class TestExtraFormats(TestCli):
     @for_each_external_doc("*hwp*")
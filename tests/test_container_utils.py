@@ -1,3 +1,4 @@
+import json
 import pathlib
 import subprocess
 from typing import Any
@@ -199,3 +200,45 @@ def test_clear_old_images_deletes_digests(mocker: MockerFixture) -> None:
 
     # Check that we removed the old images
     mock_podman.return_value.run.assert_any_call(["rmi", "--force", *old_digests_full])
+
+
+def test_parse_runtime_info() -> None:
+    podman_info = {
+        "host": {
+            "cpus": 8,
+            "memTotal": 16 * 1024**3,
+            "cgroupControllers": ["cpu", "io", "memory", "pids"],
+        }
+    }
+    assert container_utils.parse_runtime_info(podman_info) == (
+        container_utils.RuntimeResources(8, 16 * 1024**3, True, True)
+    )
+    # Rootless Podman on cgroups v1 cannot limit the resources of containers.
+    podman_info["host"]["cgroupControllers"] = []
+    assert container_utils.parse_runtime_info(podman_info) == (
+        container_utils.RuntimeResources(8, 16 * 1024**3, False, False)
+    )
+
+    docker_info = {"NCPU": 4, "MemTotal": 1024**3, "CpuCfsQuota": True}
+    assert container_utils.parse_runtime_info(docker_info) == (
+        container_utils.RuntimeResources(4, 1024**3, True, False)
+    )
+
+
+def test_get_runtime_resources_fallback(mocker: MockerFixture) -> None:
+    mock_podman = mocker.patch("dangerzone.container_utils.init_podman_command")
+    mock_podman.return_value.run.return_value = "not json"
+    mocker.patch("os.cpu_count", return_value=4)
+    container_utils.query_runtime_resources.cache_clear()
+    resources = container_utils.get_runtime_resources()
+    assert resources == container_utils.RuntimeResources(4, 0)
+
+    # The fallback is not cached, so the container runtime is asked again, and its
+    # resources are cached once it reports them.
+    info = {"NCPU": 8, "MemTotal": 1024**3}
+    mock_podman.return_value.run.return_value = json.dumps(info)
+    for _ in range(2):
+        resources = container_utils.get_runtime_resources()
+        assert resources == container_utils.RuntimeResources(8, 1024**3)
+    assert mock_podman.return_value.run.call_count == 2
+    container_utils.query_runtime_resources.cache_clear()
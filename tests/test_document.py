@@ -200,3 +200,21 @@ def test_mark_as_failed(sample_pdf: str) -> None:
     assert d.is_failed()
     assert not d.is_safe()
     assert not d.is_unconverted()
+
+
+@pytest.mark.parametrize("pages", ["1", "1-5,10", " 2 - 3 , 7-", "3-3"])
+def test_pages(sample_pdf: str, pages: str) -> None:
+    assert Document(sample_pdf, pages=pages).pages == pages
+
+
+@pytest.mark.parametrize("pages", ["", "0", "a", "3-1", "-3", "1,,2", "1-2-3"])
+def test_pages_invalid(sample_pdf: str, pages: str) -> None:
+    with pytest.raises(errors.InvalidPageRangeException):
+        Document(sample_pdf, pages=pages)
+
+
+def test_preview(sample_pdf: str) -> None:
+    assert Document(sample_pdf).pages is None
+    # Previews convert only the first page, unless told otherwise.
+    assert Document(sample_pdf, preview=True).pages == "1"
+    assert Document(sample_pdf, preview=True, pages="2-3").pages == "2-3"
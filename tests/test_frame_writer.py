@@ -0,0 +1,104 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+from dangerzone.conversion.common import DangerzoneConverter, FrameWriter
+from dangerzone.conversion.protocol import encode_document_length
+
+PAGES: List[Tuple[int, int, int, bytes]] = [
+    (2, 1, 150, b"ABCDEF"),
+    (1, 1, 72, b"\x00\x01\x02"),
+    (3, 2, 300, os.urandom(18)),
+]
+
+
+def write_per_field(path: Path) -> None:
+    """Write the pages the way the conversion process used to, a field at a time."""
+    with open(path, "w") as f:
+        DangerzoneConverter._write_int(len(PAGES), file=f)
+        for width, height, dpi, pixels in PAGES:
+            DangerzoneConverter._write_int(width, file=f)
+            DangerzoneConverter._write_int(height, file=f)
+            DangerzoneConverter._write_int(dpi, file=f)
+            DangerzoneConverter._write_bytes(pixels, file=f)
+
+
+def write_frames(path: Path) -> None:
+    async def write(writer: FrameWriter) -> None:
+        await writer.write_frame([len(PAGES)])
+        for width, height, dpi, pixels in PAGES:
+            await writer.write_frame([width, height, dpi], memoryview(pixels))
+
+    with open(path, "w") as f:
+        writer = FrameWriter(f)
+        try:
+            asyncio.run(write(writer))
+        finally:
+            writer.close()
+
+
+def test_frame_writer(tmp_path: Path) -> None:
+    write_per_field(tmp_path / "fields")
+    write_frames(tmp_path / "frames")
+    assert (tmp_path / "frames").read_bytes() == (tmp_path / "fields").read_bytes()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Windows has no os.writev()")
+def test_frame_writer_partial_writes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Frames must be written in full, even if the OS writes a few bytes at a time."""
+    writev = os.writev
+
+    def short_writev(fd: int, buffers: List[memoryview]) -> int:
+        data = b"".join(buffers)[:5]
+        return writev(fd, [data])
+
+    monkeypatch.setattr(os, "writev", short_writev)
+    write_per_field(tmp_path / "fields")
+    write_frames(tmp_path / "frames")
+    assert (tmp_path / "frames").read_bytes() == (tmp_path / "fields").read_bytes()
+
+
+def test_frame_writer_flushes_stream(tmp_path: Path) -> None:
+    """Whatever is buffered in the stream must be written before a frame."""
+    path = tmp_path / "stream"
+    with open(path, "w") as f:
+        DangerzoneConverter._write_int(1, file=f)
+        writer = FrameWriter(f)
+        writer._write_frame([2], b"A")
+        DangerzoneConverter._write_int(3, file=f)
+    assert path.read_bytes() == b"\x00\x01\x00\x02A\x00\x03"
+
+
+def test_read_session_documents(tmp_path: Path) -> None:
+    documents = [b"ABC", b"", os.urandom(3 * 1024 * 1024)]
+    stdin_path = tmp_path / "stdin"
+    with open(stdin_path, "wb") as f:
+        for document in documents:
+            f.write(encode_document_length(len(document)) + document)
+
+    with open(stdin_path) as stdin:
+        for i, document in enumerate(documents):
+            size = DangerzoneConverter._read_document_length(file=stdin)
+            assert size == len(document)
+            path = tmp_path / f"document-{i}"
+            DangerzoneConverter._read_to_file(str(path), file=stdin, size=size)
+            assert path.read_bytes() == document
+        # The host closes the stdin after the last document.
+        assert DangerzoneConverter._read_document_length(file=stdin) is None
+
+
+def test_read_session_documents_truncated(tmp_path: Path) -> None:
+    stdin_path = tmp_path / "stdin"
+    stdin_path.write_bytes(encode_document_length(10) + b"ABC")
+    with open(stdin_path) as stdin:
+        size = DangerzoneConverter._read_document_length(file=stdin)
+        with pytest.raises(EOFError):
+            DangerzoneConverter._read_to_file(
+                str(tmp_path / "document"), file=stdin, size=size
+            )
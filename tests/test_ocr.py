@@ -1,4 +1,9 @@
+import fitz
+from pytest_mock import MockerFixture
+
+from dangerzone.conversion.common import DEFAULT_DPI
 from dangerzone.isolation_provider.dummy import Dummy
+from dangerzone.isolation_provider.ocr import OCREngine, OCRPool, ocr_pixmap
 from dangerzone.logic import DangerzoneCore
 from dangerzone.util import get_tessdata_dir
 
@@ -14,3 +19,46 @@ def test_ocr_ommisions() -> None:
     # Ensure that both the available languages and the ones we offer to the user are the
     # same.
     assert available_langs == offered_langs
+
+
+def test_ocr_pool_page_order(sample_pdf: str) -> None:
+    # Render the pages of a trusted sample document, and OCR them in parallel.
+    doc = fitz.open(sample_pdf)
+    pixmaps = [page.get_pixmap(dpi=DEFAULT_DPI) for page in doc]
+    tessdata = str(get_tessdata_dir())
+
+    engine = OCREngine(workers=2, ocr_lang="eng", tessdata=tessdata)
+    try:
+        # OCR the document twice, to check that the engine can be reused.
+        for _ in range(2):
+            pool = OCRPool(engine)
+            try:
+                for pixmap in pixmaps:
+                    pool.submit(pixmap.samples, pixmap.width, pixmap.height)
+                parallel = [fitz.open("pdf", pool.pop())[0].get_text() for _ in pixmaps]
+            finally:
+                pool.close()
+    finally:
+        engine.close()
+
+    # The pages must be returned in the order they were submitted, with the same
+    # text as if they were OCRed one after the other.
+    serial = []
+    for pixmap in pixmaps:
+        pixmap.set_dpi(DEFAULT_DPI, DEFAULT_DPI)
+        page_pdf = fitz.open("pdf", ocr_pixmap(pixmap, "eng", tessdata))
+        serial.append(page_pdf[0].get_text())
+    assert parallel == serial
+
+
+def test_ocr_engines_are_reused(mocker: MockerFixture) -> None:
+    provider = Dummy()
+    engine = provider.get_ocr_engine("eng")
+    assert provider.get_ocr_engine("eng") is engine
+    assert provider.get_ocr_engine("deu") is not engine
+
+    # The engines must be stopped once a batch of documents has been converted.
+    close = mocker.spy(OCREngine, "close")
+    DangerzoneCore(provider).convert_documents(ocr_lang="eng")
+    assert close.call_count == 2
+    assert provider.ocr_engines == {}
@@ -0,0 +1,93 @@
+import os
+from typing import Optional, Tuple
+
+import pytest
+
+from dangerzone.conversion.common import encode_ints
+from dangerzone.conversion.protocol import (
+    COMPRESSION_ENV,
+    COMPRESSION_NONE,
+    COMPRESSION_ZLIB,
+    PIXEL_FORMAT_BILEVEL,
+    PIXEL_FORMAT_GRAY,
+    PIXEL_FORMAT_RGB,
+    PROTOCOL_ENV,
+    PROTOCOL_V1,
+    PROTOCOL_V2,
+    decompress_pixels,
+    encode_page,
+    get_protocol,
+    pack_bilevel,
+    pack_pixels,
+    pixels_size,
+    unpack_bilevel,
+)
+
+
+@pytest.mark.parametrize("width", [1, 7, 8, 9, 16, 21])
+def test_pack_bilevel(width: int) -> None:
+    height = 5
+    gray = bytes(0 if value < 128 else 255 for value in os.urandom(width * height))
+    packed = pack_bilevel(gray, width)
+    assert len(packed) == pixels_size(PIXEL_FORMAT_BILEVEL, width, height)
+    assert unpack_bilevel(packed, width, height) == gray
+
+
+def test_pack_pixels() -> None:
+    rgb = b"\x01\x02\x03" * 4
+    assert pack_pixels(rgb, 2) == (PIXEL_FORMAT_RGB, rgb)
+    gray = b"\x01\x01\x01\x80\x80\x80" * 2
+    assert pack_pixels(gray, 2) == (PIXEL_FORMAT_GRAY, b"\x01\x80" * 2)
+    bilevel = b"\x00\x00\x00\xff\xff\xff" * 2
+    assert pack_pixels(bilevel, 2) == (PIXEL_FORMAT_BILEVEL, b"\x40\x40")
+
+
+def test_encode_page_v1() -> None:
+    """Protocol v1 must stay the same, for hosts that predate v2."""
+    pixels = b"\x01\x02\x03" * 4
+    header, payload = encode_page(PROTOCOL_V1, COMPRESSION_ZLIB, 1, 2, 2, 150, pixels)
+    assert header == encode_ints([2, 2])
+    assert payload == pixels
+
+
+def test_encode_page_incompressible() -> None:
+    pixels = os.urandom(16 * 16 * 3)
+    header, payload = encode_page(PROTOCOL_V2, COMPRESSION_ZLIB, 1, 16, 16, 150, pixels)
+    # The pixels are sent as is, since they are not smaller once compressed.
+    assert header[8:12] == encode_ints([PIXEL_FORMAT_RGB, COMPRESSION_NONE])
+    assert payload == pixels
+
+
+def test_decompress_pixels() -> None:
+    header, payload = encode_page(
+        PROTOCOL_V2, COMPRESSION_ZLIB, 1, 100, 100, 150, b"\x10\x20\x30" * 10000
+    )
+    assert decompress_pixels(payload, 30000) == b"\x10\x20\x30" * 10000
+    # Payloads with more or fewer pixels, or with trailing data, are not valid.
+    assert decompress_pixels(payload, 29999) is None
+    assert decompress_pixels(payload, 30001) is None
+    assert decompress_pixels(bytes(payload) + b"A", 30000) is None
+    assert decompress_pixels(b"A" * 100, 30000) is None
+
+
+@pytest.mark.parametrize(
+    "protocol,compression,expected",
+    [
+        (None, None, (PROTOCOL_V1, COMPRESSION_NONE)),
+        ("2", None, (PROTOCOL_V2, COMPRESSION_NONE)),
+        ("2", "zlib", (PROTOCOL_V2, COMPRESSION_ZLIB)),
+        ("3", "foo", (PROTOCOL_V1, COMPRESSION_NONE)),
+    ],
+)
+def test_get_protocol(
+    protocol: Optional[str],
+    compression: Optional[str],
+    expected: Tuple[int, int],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    for name, value in [(PROTOCOL_ENV, protocol), (COMPRESSION_ENV, compression)]:
+        if value is None:
+            monkeypatch.delenv(name, raising=False)
+        else:
+            monkeypatch.setenv(name, value)
+    assert get_protocol() == expected
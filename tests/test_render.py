@@ -0,0 +1,206 @@
+import asyncio
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import fitz
+import pytest
+
+from dangerzone.conversion import errors
+from dangerzone.conversion.common import DEFAULT_DPI, parse_page_ranges, select_pages
+from dangerzone.conversion.render import (
+    DPI_PROFILE_ENV,
+    DPI_PROFILES,
+    PAGES_ENV,
+    PIXEL_BUDGET_ENV,
+    RENDER_WORKERS_ENV,
+    DPIProfile,
+    get_dpi_profile,
+    get_pages,
+    get_render_workers,
+    render_pages,
+)
+
+from .conftest import test_docs_dir
+
+# Page sizes in points.
+A4 = fitz.paper_rect("a4")
+A0 = fitz.paper_rect("a0")
+RECEIPT = fitz.Rect(0, 0, 3 * 72, 4 * 72)
+
+
+def render(
+    filename: str,
+    workers: int = 1,
+    image: bool = False,
+    pages: Optional[List[int]] = None,
+    profile: Optional[DPIProfile] = DPI_PROFILES["standard"],
+) -> List[Tuple[int, int, int, bytes]]:
+    async def collect() -> List[Tuple[int, int, int, bytes]]:
+        with fitz.open(filename) as doc:
+            return [
+                (width, height, dpi, bytes(pixels))
+                async for width, height, dpi, pixels in render_pages(
+                    doc,
+                    filename,
+                    workers=workers,
+                    profile=profile,
+                    image=image,
+                    pages=pages,
+                )
+            ]
+
+    return asyncio.run(collect())
+
+
+def test_render_pages_order(tmp_path: Path) -> None:
+    # Create a document whose pages have distinct sizes, so that any reordering
+    # would show.
+    filename = str(tmp_path / "pages.pdf")
+    with fitz.open() as doc:
+        for i in range(12):
+            page = doc.new_page(width=100 + i * 10, height=100)
+            page.insert_text((10, 50), f"Page {i + 1}")
+        doc.save(filename)
+
+    serial = render(filename, workers=1)
+    widths = [width for width, _, _, _ in serial]
+    assert widths == sorted(set(widths)) and len(widths) == 12
+    assert render(filename, workers=3) == serial
+
+    # Only the selected pages are rendered, in the order that they were given.
+    pages = [0, 4, 5, 6, 7, 11]
+    expected = [serial[number] for number in pages]
+    assert render(filename, workers=1, pages=pages) == expected
+    assert render(filename, workers=3, pages=pages) == expected
+
+
+@pytest.mark.parametrize("value,expected", [("3", 3), ("0", 8), ("foo", 8)])
+def test_get_render_workers(
+    value: str, expected: int, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv(RENDER_WORKERS_ENV, value)
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    assert get_render_workers() == expected
+
+
+def test_page_dpi() -> None:
+    standard = DPI_PROFILES["standard"]
+    # Common page sizes keep the default DPI.
+    assert standard.page_dpi(A4) == DEFAULT_DPI
+    assert standard.page_dpi(RECEIPT) == DEFAULT_DPI
+    # Larger pages fit in the pixel budget, but not below the min DPI.
+    assert standard.page_dpi(A0) == standard.min_dpi
+    assert standard.page_dpi(A4 * 2) < DEFAULT_DPI
+    assert DPIProfile(10**9, 50, 300).page_dpi(RECEIPT) == 300
+
+
+def test_page_dpi_max_dimensions() -> None:
+    """Pages must never exceed the max page dimensions, no matter the DPI bounds."""
+    banner = fitz.Rect(0, 0, 200 * 72, 10 * 72)  # 200 inches long
+    dpi = DPI_PROFILES["high"].page_dpi(banner)
+    assert dpi < DPI_PROFILES["high"].min_dpi
+    with fitz.open() as doc:
+        page = doc.new_page(width=banner.width, height=banner.height)
+        pix = page.get_pixmap(dpi=dpi)
+        assert pix.width <= errors.MAX_PAGE_WIDTH
+        assert pix.height <= errors.MAX_PAGE_HEIGHT
+
+
+def test_render_pages_dpi(tmp_path: Path) -> None:
+    filename = str(tmp_path / "pages.pdf")
+    with fitz.open() as doc:
+        doc.new_page(width=A4.width, height=A4.height)
+        doc.new_page(width=A0.width, height=A0.height)
+        doc.save(filename)
+
+    (_, _, a4_dpi, _), (width, height, a0_dpi, _) = render(filename, workers=1)
+    assert (a4_dpi, a0_dpi) == (DEFAULT_DPI, DPI_PROFILES["standard"].min_dpi)
+    # The host computes the size of the page from its pixels and DPI.
+    assert round(width * 72 / a0_dpi) == round(A0.width)
+    assert round(height * 72 / a0_dpi) == round(A0.height)
+
+    # Without a profile, i.e., in protocol v1, every page has the default DPI.
+    pages = render(filename, profile=None)
+    assert [dpi for _, _, dpi, _ in pages] == [DEFAULT_DPI, DEFAULT_DPI]
+
+
+@pytest.mark.parametrize(
+    "filename,dpi",
+    [
+        # A 96 DPI image must not be upscaled to the default DPI.
+        ("sample-gif.gif", 96),
+        # A 300 DPI image must still be downscaled to the default DPI.
+        ("sample-png.png", DEFAULT_DPI),
+    ],
+)
+def test_render_image(filename: str, dpi: int) -> None:
+    path = str(test_docs_dir / filename)
+    with fitz.open(path) as doc:
+        rect = doc[0].rect
+
+    [(width, height, image_dpi, pixels)] = render(path, image=True)
+    assert image_dpi == dpi
+    assert (width, height) == (
+        round(rect.width * dpi / 72),
+        round(rect.height * dpi / 72),
+    )
+    assert len(pixels) == width * height * 3
+    # Rendered as a page, the image always has the DPI of the profile.
+    [(_, _, page_dpi, _)] = render(path)
+    assert page_dpi == DEFAULT_DPI
+
+
+@pytest.mark.parametrize(
+    "profile,pixel_budget,expected",
+    [
+        ("", "", DPI_PROFILES["standard"]),
+        ("fast", "", DPI_PROFILES["fast"]),
+        ("foo", "", DPI_PROFILES["standard"]),
+        ("high", "1000", DPIProfile(1000, 150, 300)),
+        ("high", "foo", DPI_PROFILES["high"]),
+    ],
+)
+def test_get_dpi_profile(
+    profile: str,
+    pixel_budget: str,
+    expected: DPIProfile,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv(DPI_PROFILE_ENV, profile)
+    monkeypatch.setenv(PIXEL_BUDGET_ENV, pixel_budget)
+    assert get_dpi_profile() == expected
+
+
+@pytest.mark.parametrize(
+    "spec,expected",
+    [
+        ("1", [(1, 1)]),
+        ("1-5,10", [(1, 5), (10, 10)]),
+        (" 2 - 3 , 7-", [(2, 3), (7, None)]),
+    ],
+)
+def test_parse_page_ranges(spec: str, expected: List[Tuple[int, int]]) -> None:
+    assert parse_page_ranges(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["", "0", "a", "3-1", "-3", "1,,2", "1-2-3"])
+def test_parse_page_ranges_invalid(spec: str) -> None:
+    with pytest.raises(ValueError, match="Invalid page range"):
+        parse_page_ranges(spec)
+
+
+def test_select_pages() -> None:
+    assert select_pages(None, 3) == [0, 1, 2]
+    assert select_pages("3,1-2,2", 5) == [0, 1, 2]
+    # Pages past the end of the document are ignored.
+    assert select_pages("2-,10", 4) == [1, 2, 3]
+    assert select_pages("10-", 4) == []
+
+
+def test_get_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert get_pages(3) == [0, 1, 2]
+    monkeypatch.setenv(PAGES_ENV, "2-")
+    assert get_pages(3) == [1, 2]
+    monkeypatch.setenv(PAGES_ENV, "4-")
+    with pytest.raises(errors.NoSelectedPagesException):
+        get_pages(3)
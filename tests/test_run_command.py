@@ -0,0 +1,73 @@
+import asyncio
+import sys
+import time
+import tracemalloc
+from typing import Tuple
+
+from dangerzone.conversion.common import DangerzoneConverter, OutputRing
+
+# A command that prints ~5MiB of output, in 50k lines.
+NOISY_COMMAND = [
+    sys.executable,
+    "-c",
+    "import sys; sys.stdout.write(('x' * 99 + '\\n') * 50_000)",
+]
+NOISY_OUTPUT_SIZE = 100 * 50_000
+
+
+class Converter(DangerzoneConverter):
+    async def convert(self) -> None:
+        pass
+
+    def update_progress(self, text: str) -> None:
+        pass
+
+
+def run_noisy_command(
+    converter: Converter, discard_stdout: bool
+) -> Tuple[bytes, float, int]:
+    """Run the noisy command, and return its output, duration and peak memory."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        stdout, _ = asyncio.run(
+            converter.run_command(
+                NOISY_COMMAND,
+                error_message="The noisy command failed",
+                discard_stdout=discard_stdout,
+            )
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return stdout, time.perf_counter() - start, peak
+
+
+def test_output_ring() -> None:
+    ring = OutputRing(max_size=5)
+    ring.append(b"abc")
+    assert ring.getvalue() == b"abc"
+    ring.append(b"defg")
+    assert ring.getvalue() == b"[... dropped 2 bytes ...]\ncdefg"
+
+
+def test_run_command_capture() -> None:
+    converter = Converter(captured_output_max_size=64 * 1024)
+    stdout, elapsed, _ = run_noisy_command(converter, discard_stdout=False)
+    assert stdout == (b"x" * 99 + b"\n") * 50_000
+    # Reading the output line by line must take linear time. Concatenating the lines
+    # into an immutable byte string took ~50s.
+    assert elapsed < 10
+
+    # Only the last lines of the output are kept for debugging purposes.
+    captured_output = converter.captured_output
+    assert captured_output.endswith(b"x" * 99 + b"\n")
+    assert len(captured_output) < 65 * 1024
+
+
+def test_run_command_discard() -> None:
+    converter = Converter(captured_output_max_size=64 * 1024)
+    stdout, _, peak = run_noisy_command(converter, discard_stdout=True)
+    assert stdout == b""
+    # If the output is discarded, the memory usage must not depend on its size.
+    assert peak < NOISY_OUTPUT_SIZE / 10
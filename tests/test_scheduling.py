@@ -0,0 +1,103 @@
+from pathlib import Path
+from typing import Any, List, Optional
+
+import pytest
+from pytest_mock import MockerFixture
+
+from dangerzone.document import Document
+from dangerzone.logic import DangerzoneCore
+from dangerzone.scheduling import (
+    LIBREOFFICE_COST,
+    estimate_cost,
+    probe_page_count,
+    queue_wait_summary,
+    schedule_documents,
+)
+
+from .conftest import test_docs_dir
+
+
+def write_pdf(path: Path, pages: int) -> str:
+    """Write the page objects of a PDF, which is all that the page probe looks for."""
+    objects = b"".join(
+        b"%d 0 obj << /Type /Page /Parent 1 0 R >> endobj\n" % i
+        for i in range(2, pages + 2)
+    )
+    path.write_bytes(b"%PDF-1.7\n1 0 obj << /Type /Pages >> endobj\n" + objects)
+    return str(path)
+
+
+def test_probe_page_count(sample_pdf: str, sample_doc: str, tmp_path: Path) -> None:
+    assert probe_page_count(sample_pdf) == 4
+    assert probe_page_count(write_pdf(tmp_path / "big.pdf", 800)) == 800
+    # Files that are not PDFs, or whose page objects are compressed, are not probed.
+    assert probe_page_count(sample_doc) is None
+    (tmp_path / "compressed.pdf").write_bytes(b"%PDF-1.7\n" + b"A" * 100)
+    assert probe_page_count(str(tmp_path / "compressed.pdf")) is None
+    assert probe_page_count(str(tmp_path / "missing.pdf")) is None
+
+
+def test_estimate_cost(sample_pdf: str, sample_doc: str) -> None:
+    assert estimate_cost(Document(sample_pdf)) == 4
+    assert estimate_cost(Document(sample_pdf, pages="2-")) == 3
+    assert estimate_cost(Document(sample_pdf, preview=True)) == 1
+    assert estimate_cost(Document(str(test_docs_dir / "sample-png.png"))) == 1
+    # Office documents are converted with LibreOffice first.
+    assert estimate_cost(Document(sample_doc)) > LIBREOFFICE_COST
+
+
+@pytest.mark.parametrize(
+    "schedule,expected",
+    [
+        ("fifo", ["urgent", "big", "small"]),
+        ("shortest-first", ["urgent", "small", "big"]),
+    ],
+)
+def test_schedule_documents(schedule: str, expected: List[str], tmp_path: Path) -> None:
+    names = {
+        write_pdf(tmp_path / "big.pdf", 800): "big",
+        write_pdf(tmp_path / "small.pdf", 1): "small",
+        write_pdf(tmp_path / "urgent.pdf", 100): "urgent",
+    }
+    documents = [Document(filename) for filename in names]
+    documents[2].priority = 1
+    scheduled = schedule_documents(documents, schedule)
+    assert [names[doc.input_filename] for doc in scheduled] == expected
+
+    with pytest.raises(ValueError):
+        schedule_documents(documents, "foo")
+
+
+def test_queue_wait_summary() -> None:
+    assert queue_wait_summary([]) == "No documents waited in the queue"
+    documents = [Document() for _ in range(20)]
+    for i, doc in enumerate(documents):
+        doc.queue_wait = float(i)
+    assert queue_wait_summary(documents) == (
+        "20 document(s) waited 9.00s in the queue (median), 18.00s (p95), 19.00s (max)"
+    )
+
+
+def test_convert_documents_queue_wait(tmp_path: Path, mocker: MockerFixture) -> None:
+    """Documents are converted shortest first, and their queue wait is measured."""
+    provider = mocker.MagicMock()
+    provider.get_max_parallel_conversions.return_value = 1
+    provider.get_session_size.return_value = 1
+    converted: List[Document] = []
+
+    def convert(document: Document, ocr_lang: Optional[str], *args: Any) -> None:
+        document.mark_as_converting()
+        converted.append(document)
+
+    provider.convert.side_effect = convert
+    dangerzone = DangerzoneCore(provider)
+    for pages in [30, 20, 10]:
+        dangerzone.add_document_from_filename(
+            write_pdf(tmp_path / f"{pages}.pdf", pages)
+        )
+    dangerzone.convert_documents(None, schedule="shortest-first")
+
+    assert converted == dangerzone.documents[::-1]
+    waits = [doc.queue_wait or 0.0 for doc in converted]
+    assert all(doc.queue_wait is not None for doc in converted)
+    assert waits == sorted(waits)